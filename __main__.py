@@ -1,29 +1,35 @@
 #!/usr/bin/env python3
 
-import random
-import matplotlib.pyplot as plt
+import argparse
+import json
+import os
+import sys
+
+import matplotlib
 import numpy as np
 
-from ev import EVSpec
-from home import Home, gen_schedule_by_prices_and_mean
-from rule_based_ev import RuleBasedEV
-from optimized_ev import OptimizedEV
-from grid import TimeOfUseGrid
-from recording_wrapper import RecordingWrapper
-from market import DoubleAuctionMarketController
+from scenario import load_scenario, run_scenario
 
-num_rbevs = 4
-num_loevs = 4
-num_homes = 8
-simulation_name = 'Mixed'
+# Runs a simulation scenario (see scenario.py) headless, printing each day's summary.
+# Examples:
+#     python . scenarios/mixed.json --days 30 --jsonl
+#     python . --figures out/ --output summary.json
+#     python . --show
+#     python . scenarios/mixed.json --days 60 --checkpoint run.npz --resume
+#     python . scenarios/mixed.json --days 365 --jsonl --record run/
 
-def display_day(day_num: int,
+def display_day(simulation_name: str,
+                day_num: int,
                 grid_prices: np.ndarray[float],
                 market_prices: np.ndarray[float],
                 grid_costs: np.ndarray[float],
                 rbev_costs: np.ndarray[float],
                 loev_costs: np.ndarray[float],
-                grid_amounts: np.ndarray[float]):
+                grid_amounts: np.ndarray[float],
+                path: str = None):
+    # With a path the figure is saved there and closed, otherwise it's shown (blocking).
+    import matplotlib.pyplot as plt
+
     hours = np.arange(24)
     nrows = 3
     ncols = 2
@@ -49,7 +55,6 @@ def display_day(day_num: int,
     plt.axhline(y=market_prices.max(), color='red', linestyle='--')
     plt.legend()
 
-    print(f'Mean market price: f{market_prices.mean()}')
 
     plt.subplot(nrows, ncols, 3)
     plt.plot(hours, grid_amounts, label='Energy (kWh)')
@@ -60,7 +65,6 @@ def display_day(day_num: int,
     plt.axhline(y=grid_amounts.mean(), color='red', linestyle='--')
     plt.legend()
 
-    print(f'Grid total amount: {grid_amounts.sum()}')
 
     plt.subplot(nrows, ncols, 4)
     plt.plot(hours, grid_costs, label='Cost ($)')
@@ -71,7 +75,6 @@ def display_day(day_num: int,
     plt.axhline(y=grid_costs.max(), color='red', linestyle='--')
     plt.legend()
 
-    print(f'Grid total cost: {grid_costs.sum()}')
 
     plt.subplot(nrows, ncols, 5)
     plt.plot(hours, rbev_costs, label='Cost ($)')
@@ -82,7 +85,6 @@ def display_day(day_num: int,
     plt.axhline(y=rbev_costs.max(), color='red', linestyle='--')
     plt.legend()
 
-    print(f'RBEV mean cost: {rbev_costs.mean()}')
 
     plt.subplot(nrows, ncols, 6)
     plt.plot(hours, loev_costs, label='Cost ($)')
@@ -93,120 +95,83 @@ def display_day(day_num: int,
     plt.axhline(y=loev_costs.mean(), color='red', linestyle='--')
     plt.legend()
 
-    print(f'LOEV mean cost: {loev_costs.mean()}')
 
     plt.tight_layout()
-    plt.show()
-
-def main():
-
-    # Ensure same results with each test
-    random.seed(0)
-    
-    # Source: https://www.hydroone.com/rates-and-billing/rates-and-charges/electricity-pricing-and-costs
-    weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
-                               12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
-    mean = weekday_winter.mean()
-    maximum = weekday_winter.max()
-    minimum = weekday_winter.min()
-
-    home_schedule = gen_schedule_by_prices_and_mean(weekday_winter, 2.0)
-
-    driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
-                        4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-    
-    # MDR is based on the following:
-    # User wants a minimum all the time for emergencies.
-    # User wants extra throughout the day for unexpected travel needs.
-    # User wants a lot during rush hours in case of traffic or accidents etc.
-    mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
-           15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
-
-    dso = RecordingWrapper(TimeOfUseGrid(weekday_winter))
-    market = DoubleAuctionMarketController(dso, 1)
-
-    ev_spec = EVSpec(
-        capacity=40, # kWh
-        charge_rate_max=10, # kW
-        discharge_rate_max=10, # kW
-        initial_energy=0.0, # kWh
-        operating_range=(0.2, 0.8), # Percent
-    )
-
-    for i in range(num_rbevs):
-        der = RecordingWrapper(RuleBasedEV(
-            spec=ev_spec,
-            mdr=mdr,
-            driving_schedule=driving_schedule,
-            max_charge_price=(minimum+mean)/2,
-            min_discharge_price=(maximum+mean)/2,
-        ))
-        market.add_der(der, f'rbev_{i}')
-
-    for i in range(num_loevs):
-        der = RecordingWrapper(OptimizedEV(
-            spec=ev_spec,
-            driving_schedule=driving_schedule,
-            mdr=mdr,
-            history=weekday_winter.copy(), # It'll be editing this list, may not want to give it the original.
-        ))
-        market.add_der(der, f'loev_{i}')
-    
-    for i in range(num_homes):
-        der = RecordingWrapper(Home(
-            schedule=home_schedule,
-            randomness=0.1,
-        ))
-        market.add_der(der, f'home_{i}')
-
-    for i in range(5):
-        print(f'RUNNING DAY {i}:')
-        day_stats: list[dict] = []
-        dso_stats: list[dict] = []
-
-        day_rbev_costs: list[float] = []
-        day_loev_costs: list[float] = []
-        day_home_costs: list[float] = []
-
-        for t in range(24):
-            stats = market.run_tick()
-            day_stats.append(stats)
-            dso_stats.append(market.dso.post_bid_stats)
-
-            for j in range(num_rbevs):
-                if not market.ders[f'rbev_{j}'].post_bid_stats['meeting_next_mdr']:
-                    print(f'ft={t} rbev not meeting next mdr! action={market.ders[f'rbev_{j}'].post_bid_stats['last_action']}')
-            for j in range(num_loevs):
-                if not market.ders[f'loev_{j}'].post_bid_stats['meeting_next_mdr']:
-                    print(f'ft={t} loev not meeting next mdr! action={market.ders[f'loev_{j}'].post_bid_stats['last_action']}')
-
-            # TODO Display these
-            rbev_costs = np.array([market.ders[f'rbev_{j}'].post_bid_stats['cost'] for j in range(num_rbevs)])
-            # print(rbev_costs)
-            day_rbev_costs.append(rbev_costs.mean())
-            loev_costs = np.array([market.ders[f'loev_{j}'].post_bid_stats['cost'] for j in range(num_loevs)])
-            # print(market.ders['loev_1'].post_bid_stats)
-            day_loev_costs.append(loev_costs.mean())
-            home_costs = np.array([market.ders[f'home_{j}'].post_bid_stats['cost'] for j in range(num_homes)])
-            # print(home_costs)
-            day_home_costs.append(home_costs.mean())
-
-        day_market_prices = [s['price'] for s in day_stats]
-        day_grid_prices = [s['grid_price'] for s in day_stats]
-        day_grid_costs = [s['cost'] for s in dso_stats]
-
-        # TODO display this
-        day_grid_amount = [s['granted_amount'] for s in dso_stats]
-        
-        display_day(
-            day_num=i+1,
-            grid_prices=np.array(day_grid_prices),
-            market_prices=np.array(day_market_prices),
-            grid_costs=np.array(day_grid_costs),
-            rbev_costs=np.array(day_rbev_costs),
-            loev_costs=np.array(day_loev_costs),
-            grid_amounts=np.array(day_grid_amount),
-        )
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()
+
+def print_day(day_num: int, day: dict):
+    summary = day['summary']
+    print(f'DAY {day_num}:')
+    for miss in day['mdr_misses']:
+        print(f"ft={miss['t']} {miss['der']} not meeting next mdr! action={miss['action']}")
+    print(f"Mean market price: {summary['mean_market_price']}")
+    print(f"Grid total amount: {summary['grid_total_amount']}")
+    print(f"Grid total cost: {summary['grid_total_cost']}")
+    print(f"RBEV mean cost: {summary['rbev_mean_cost']}")
+    print(f"LOEV mean cost: {summary['loev_mean_cost']}")
+    print(f"Day took {summary['seconds']:.3f} s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a market simulation scenario.')
+    parser.add_argument('scenario', nargs='?', help='Scenario JSON file, see scenarios/. Defaults to scenario.DEFAULT_SCENARIO.')
+    parser.add_argument('--days', type=int, help='Override the number of days.')
+    parser.add_argument('--seed', type=int, help='Override the random seed.')
+    parser.add_argument('--jsonl', action='store_true', help="Print one JSON line per day instead of text.")
+    parser.add_argument('--output', help='Write the daily summaries and hourly series as JSON to this file.')
+    parser.add_argument('--figures', help='Save one figure per day to this directory.')
+    parser.add_argument('--show', action='store_true', help='Show each day\'s figure interactively (blocks until closed).')
+    parser.add_argument('--checkpoint', help='Save the simulation state to this .npz file as it runs.')
+    parser.add_argument('--checkpoint-days', type=int, default=1, help='Days between checkpoints.')
+    parser.add_argument('--resume', action='store_true', help='Resume from the checkpoint file if it exists.')
+    parser.add_argument('--record', help='Record every tick to this directory, see recorder.RecordingReader.')
+    args = parser.parse_args(argv)
+
+    if not args.show:
+        # Never needs a display.
+        matplotlib.use('Agg')
+
+    overrides = {}
+    if args.days is not None:
+        overrides['days'] = args.days
+    if args.seed is not None:
+        overrides['seed'] = args.seed
+    scenario = load_scenario(args.scenario, overrides)
+    if args.figures:
+        os.makedirs(args.figures, exist_ok=True)
+
+    def on_day(day_num: int, day: dict):
+        if args.jsonl:
+            print(json.dumps({'day': day_num, **day['summary']}))
+        else:
+            print_day(day_num, day)
+        sys.stdout.flush()
+
+        if args.figures or args.show:
+            hourly = day['hourly']
+            path = None
+            if args.figures:
+                path = os.path.join(args.figures, f'day_{day_num:03d}.png')
+            display_day(
+                simulation_name=scenario['name'],
+                day_num=day_num,
+                grid_prices=np.array(hourly['grid_price']),
+                market_prices=np.array(hourly['market_price']),
+                grid_costs=np.array(hourly['grid_cost']),
+                rbev_costs=np.array(hourly['rbev_cost'], dtype=float),
+                loev_costs=np.array(hourly['loev_cost'], dtype=float),
+                grid_amounts=np.array(hourly['grid_amount']),
+                path=path,
+            )
+
+    days = run_scenario(scenario, on_day, args.checkpoint, args.checkpoint_days, args.resume, args.record)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'scenario': scenario, 'days': days}, f, indent=2, default=float)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import inspect
+
+from market import Bid, DoubleAuctionMarketController
+
+# A DoubleAuctionMarketController for DERs that are remote agents.
+# DER methods may be coroutine functions (async def make_bid etc.), plain methods are called as usual.
+# Each phase of the tick (bidding, result notification, post_bid) runs concurrently for every DER and
+# is bounded by `deadline` seconds. DERs that haven't bid by the deadline don't take part in that tick, as if they had
+# returned None, but still get post_bid. Late notifications and post_bid calls are cancelled.
+# The names of late or failing DERs are reported in the tick's stats, for every phase.
+# The grid (dso) and planners are run locally, as in DoubleAuctionMarketController.
+# Example: stats = asyncio.run(market.run_tick())
+class AsyncMarketController(DoubleAuctionMarketController):
+    def __init__(self, dso, td, deadline: float = 1.0, clearing='loop', tick_size: float = 0.0):
+        super().__init__(dso, td, clearing=clearing, tick_size=tick_size)
+        self.deadline = deadline
+        self.notifications = []
+
+    # Notifications are queued while the bids are settled and sent all at once afterwards.
+    def notify(self, creator, bid):
+        self.notifications.append((creator, bid))
+
+    async def run_tick(self) -> dict:
+        source_bids: list[Bid] = []
+        sink_bids: list[Bid] = []
+
+        grid_price = None
+        if self.dso is not None:
+            dso_bid = self.dso.make_bid(self.t, None)
+            grid_price = self.add_bid(source_bids, sink_bids, dso_bid, None)
+
+        self.plan(grid_price)
+
+        names = list(self.ders)
+        bids, late, failed = await self.gather(names, [(d.make_bid, self.t, grid_price) for d in self.ders.values()])
+        for name in names:
+            # Bids are added in registration order, so clearing doesn't depend on which agent answered first.
+            bid = bids.get(name)
+            if isinstance(bid, list):
+                for b in bid:
+                    self.add_bid(source_bids, sink_bids, b, grid_price)
+            else:
+                self.add_bid(source_bids, sink_bids, bid, grid_price)
+
+        self.notifications = []
+        price = self.settle(source_bids, sink_bids, self.clear)
+        notifications = self.notifications
+        self.notifications = []
+        _, late_results, failed_results = await self.gather(
+            list(range(len(notifications))),
+            [(creator.collect_bid_results, self.t, bid) for creator, bid in notifications],
+        )
+
+        _, late_post_bid, failed_post_bid = await self.gather(names, [(d.post_bid, self.t, price) for d in self.ders.values()])
+        self.dso.post_bid(self.t, price)
+        self.t = (self.t + 1) % 24
+
+        creator_names = self.creator_names()
+        result_names = lambda keys: sorted({creator_names[id(notifications[i][0])] for i in keys
+                                            if id(notifications[i][0]) in creator_names})
+
+        return {
+            'price': price,
+            'grid_price': grid_price,
+            'sources_total': len(source_bids),
+            'sinks_total': len(sink_bids),
+            'late': late,
+            'failed': failed,
+            'late_results': result_names(late_results),
+            'failed_results': result_names(failed_results),
+            'late_post_bid': late_post_bid,
+            'failed_post_bid': failed_post_bid,
+        }
+
+    # Names of the bid creators, by id: the DERs under their registered names, and the grid as 'dso'.
+    # Notifications for any other creator aren't reported by name.
+    def creator_names(self) -> dict[int, str]:
+        names = {id(der): name for name, der in self.ders.items()}
+        if self.dso is not None:
+            names[id(self.dso)] = 'dso'
+        return names
+
+    # Runs every (function, *args) call concurrently until the deadline.
+    # Returns the results of the calls that finished by key, and the keys of the late and failed calls.
+    async def gather(self, keys: list, calls: list[tuple]) -> tuple[dict, list, list]:
+        if len(calls) == 0:
+            return {}, [], []
+        tasks = {asyncio.ensure_future(_call(*call)): key for key, call in zip(keys, calls)}
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        if len(pending) > 0:
+            await asyncio.wait(pending)
+
+        results = {}
+        failed = []
+        for task in done:
+            if task.exception() is not None:
+                failed.append(tasks[task])
+            else:
+                results[tasks[task]] = task.result()
+        late = [key for task, key in tasks.items() if task in pending]
+        return results, late, sorted(failed, key=keys.index)
+
+async def _call(function, *args):
+    result = function(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+# Stands in for a remote agent: wraps a local DER and answers every call after a delay.
+# latency is in seconds, either fixed or a function of (method name, t).
+class SimulatedAgent:
+    def __init__(self, der, latency):
+        self.der = der
+        self.latency = latency
+
+    async def delay(self, method: str, t: int):
+        latency = self.latency(method, t) if callable(self.latency) else self.latency
+        await asyncio.sleep(latency)
+
+    async def make_bid(self, t, grid_price):
+        await self.delay('make_bid', t)
+        bid = self.der.make_bid(t, grid_price)
+        # Results come back through the agent.
+        if isinstance(bid, list):
+            for b in bid:
+                b.creator = self
+        elif bid is not None:
+            bid.creator = self
+        return bid
+
+    async def collect_bid_results(self, t, bid: Bid):
+        await self.delay('collect_bid_results', t)
+        return self.der.collect_bid_results(t, bid)
+
+    async def post_bid(self, t, price):
+        await self.delay('post_bid', t)
+        return self.der.post_bid(t, price)
@@ -0,0 +1,117 @@
+import numpy as np
+
+from clearing import clear_batched
+from ev import EVSpec
+from home import HomePopulation, gen_schedule_by_prices_and_mean
+from rule_based_ev_fleet import RuleBasedEVFleet
+from scenario import thresholds
+
+# Runs many independent copies (scenarios) of the same neighbourhood at once, e.g. for Monte Carlo risk studies.
+# Every scenario has a TimeOfUseGrid, `vehicles` rule-based EVs and `homes` homes, and the DER state is held in
+# one RuleBasedEVFleet and one HomePopulation with the scenarios laid out one after another
+# (vehicle i of scenario s is fleet vehicle s * vehicles + i).
+# Each run_tick does one vectorized pass through the double auction for every scenario (see clear_batched),
+# clearing each one exactly like a DoubleAuctionMarketController with the grid, fleet and homes added in that order.
+# grid_prices is a shared 24 hour price list or one row per scenario.
+class BatchedMarket:
+    def __init__(self, scenarios: int, grid_prices, fleet: RuleBasedEVFleet = None, homes: HomePopulation = None):
+        self.scenarios = scenarios
+        self.grid_prices = np.broadcast_to(np.asarray(grid_prices, dtype=float), (scenarios, 24)).copy()
+        self.fleet = fleet
+        self.homes = homes
+        self.vehicles = 0
+        if fleet is not None:
+            if fleet.size % scenarios != 0:
+                raise ValueError(f'Fleet of {fleet.size} vehicles does not split into {scenarios} scenarios.')
+            self.vehicles = fleet.size // scenarios
+        self.home_bids = 0
+        if homes is not None:
+            if homes.size % scenarios != 0:
+                raise ValueError(f'Population of {homes.size} homes does not split into {scenarios} scenarios.')
+            self.home_bids = 1 if homes.aggregate else homes.size // scenarios
+        self.t = 0
+
+    # Returns the per-scenario results of the tick as arrays.
+    def run_tick(self) -> dict:
+        t = self.t
+        S = self.scenarios
+        N = self.vehicles
+        grid_price = self.grid_prices[:, t]
+
+        # Sinks are the vehicles' charge bids then the homes, sources are the grid then the vehicles' discharge bids.
+        ev_amounts = np.zeros((S, N))
+        bidding = np.zeros((S, N), dtype=bool)
+        discharging = np.zeros((S, N), dtype=bool)
+        if self.fleet is not None:
+            _, amounts = self.fleet.decide_bids(t, np.repeat(grid_price, N))
+            ev_amounts.flat[self.fleet.bid_vehicles] = amounts
+            bidding.flat[self.fleet.bid_vehicles] = True
+            discharging.flat[self.fleet.bid_vehicles] = self.fleet.bid_discharge
+
+        home_amounts = np.zeros((S, 0))
+        if self.homes is not None:
+            self.homes.amounts = self.homes.draw_amounts(t)
+            home_amounts = self.homes.amounts.reshape(S, -1)
+            if self.homes.aggregate:
+                home_amounts = home_amounts.sum(axis=1, keepdims=True)
+
+        sink_prices = np.broadcast_to(grid_price[:, None], (S, N + self.home_bids))
+        sink_amounts = np.concatenate((ev_amounts, home_amounts), axis=1)
+        sink_active = np.concatenate((bidding & ~discharging, np.ones((S, self.home_bids), dtype=bool)), axis=1)
+        source_prices = np.concatenate((grid_price[:, None], np.zeros((S, N))), axis=1)
+        source_amounts = np.concatenate((np.full((S, 1), np.inf), ev_amounts), axis=1)
+        source_active = np.concatenate((np.ones((S, 1), dtype=bool), bidding & discharging), axis=1)
+
+        price, sink_fills, source_fills, notified = clear_batched(
+            sink_prices, sink_amounts, sink_active, source_prices, source_amounts, source_active)
+
+        if self.fleet is not None:
+            granted = np.where(discharging, source_fills[:, 1:], sink_fills[:, :N])
+            self.fleet.granted[:] = granted.ravel()
+            self.fleet.cost[:] = (granted * price[:, None] * np.where(discharging, -1, 1)).ravel()
+            self.fleet.collected[:] = (bidding & notified[:, None]).ravel()
+            self.fleet.apply_results(t)
+
+        grid_amount = np.where(notified, source_fills[:, 0], 0.0)
+        self.t = (self.t + 1) % 24
+        return {
+            'price': price,
+            'grid_price': grid_price,
+            'grid_amount': grid_amount,
+            'grid_cost': -grid_amount * price,
+            'sources_total': source_active.sum(axis=1),
+            'sinks_total': sink_active.sum(axis=1),
+        }
+
+# Builds `count` copies of a scenario (see scenario.py) as a BatchedMarket.
+# Copies differ in their home load draws, and in the vehicles' initial energy when initial_energy_range is given.
+# OptimizedEVs solve one LP each and can't be batched, so scenarios with 'loev' in the fleet are rejected.
+def build_batched_market(scenario: dict, count: int, initial_energy_range: tuple[float, float] = None) -> BatchedMarket:
+    fleet_mix = scenario['fleet']
+    if fleet_mix.get('loev', 0) > 0:
+        raise ValueError('OptimizedEVs are not supported in batched simulations.')
+    rng = np.random.default_rng(scenario['seed'])
+    prices = np.asarray(scenario['prices'], dtype=float)
+    spec = dict(scenario['ev_spec'])
+    spec['operating_range'] = tuple(spec['operating_range'])
+
+    fleet = None
+    vehicles = fleet_mix.get('rbev', 0)
+    if vehicles > 0:
+        specs = [EVSpec(**spec)] * (vehicles * count)
+        if initial_energy_range is not None:
+            energies = rng.uniform(*initial_energy_range, vehicles * count)
+            specs = [EVSpec(**(spec | {'initial_energy': e})) for e in energies.tolist()]
+        max_charge_price, min_discharge_price = thresholds(scenario)
+        fleet = RuleBasedEVFleet(specs, scenario['mdr'], scenario['driving_schedule'], max_charge_price, min_discharge_price)
+
+    homes = None
+    if fleet_mix.get('home', 0) > 0:
+        homes = HomePopulation(
+            fleet_mix['home'] * count,
+            gen_schedule_by_prices_and_mean(prices, scenario['home']['mean']),
+            scenario['home']['randomness'],
+            seed=scenario['seed'],
+            aggregate=False,
+        )
+    return BatchedMarket(count, prices, fleet, homes)
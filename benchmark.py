@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import Home, gen_schedule_by_prices_and_mean
+from market import DoubleAuctionMarketController
+from optimized_ev import OptimizedEV
+from rule_based_ev import RuleBasedEV
+
+# Scaling benchmarks for market ticks and EV planning.
+# Builds synthetic markets of increasing size and writes ticks/sec, latency percentiles and peak memory as JSON,
+# so clearing engines and solver backends can be compared across commits.
+# Example: python benchmark.py --sizes 10 1000 100000 --clearing loop vectorized --output bench.json
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+DEFAULT_MIX = {'rbev': 0.4, 'loev': 0.1, 'home': 0.5}
+
+# Splits size DERs between the kinds in mix, giving any remainder to the first kind.
+def split_mix(size: int, mix: dict[str, float]) -> dict[str, int]:
+    total = sum(mix.values())
+    counts = {kind: int(size * share / total) for kind, share in mix.items()}
+    first = next(iter(counts))
+    counts[first] += size - sum(counts.values())
+    return counts
+
+def build_market(size: int, mix: dict[str, float], clearing: str = 'loop', solver: str = 'dp', seed: int = 0) -> DoubleAuctionMarketController:
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    mean = weekday_winter.mean()
+    home_schedule = gen_schedule_by_prices_and_mean(weekday_winter, 2.0)
+
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1, clearing=clearing)
+    counts = split_mix(size, mix)
+    for i in range(counts.get('rbev', 0)):
+        spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=rng.uniform(8.0, 32.0), operating_range=(0.2, 0.8))
+        market.add_der(RuleBasedEV(spec, mdr, driving_schedule, (weekday_winter.min() + mean) / 2, (weekday_winter.max() + mean) / 2), f'rbev_{i}')
+    for i in range(counts.get('loev', 0)):
+        spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=rng.uniform(8.0, 32.0), operating_range=(0.2, 0.8))
+        market.add_der(OptimizedEV(spec, mdr, driving_schedule, weekday_winter * rng.uniform(0.9, 1.1, 24), solver=solver), f'loev_{i}')
+    for i in range(counts.get('home', 0)):
+        market.add_der(Home(home_schedule, 0.1), f'home_{i}')
+    return market
+
+def percentiles(samples: list[float]) -> dict:
+    samples = np.array(samples) * 1000.0
+    if len(samples) == 0:
+        return {}
+    return {
+        'count': len(samples),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'max_ms': float(samples.max()),
+    }
+
+def time_calls(fn, args_list) -> list[float]:
+    durations = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def bench_market(size: int, mix: dict[str, float], clearing: str, solver: str, ticks: int, trace_memory: bool) -> dict:
+    if trace_memory:
+        tracemalloc.start()
+    market = build_market(size, mix, clearing, solver)
+    ders = list(market.ders.values())
+
+    # Midnight ticks include the OptimizedEV solves, so they're reported separately.
+    tick_durations = time_calls(market.run_tick, [()] * ticks)
+    midnight = [d for i, d in enumerate(tick_durations) if i % 24 == 0]
+    other = [d for i, d in enumerate(tick_durations) if i % 24 != 0]
+
+    loevs = [d for d in ders if isinstance(d, OptimizedEV)]
+    rbevs = [d for d in ders if isinstance(d, RuleBasedEV)]
+    t = market.t
+    grid_price = market.dso.prices[t]
+    phases = {
+        'tick': percentiles(tick_durations),
+        'midnight_tick': percentiles(midnight),
+        'other_tick': percentiles(other),
+        'update_model': percentiles(time_calls(lambda ev: ev.update_model(), [(ev,) for ev in loevs[:100]])),
+        'rbev_make_bid': percentiles(time_calls(lambda ev: ev.make_bid(t, grid_price), [(ev,) for ev in rbevs[:10000]])),
+    }
+
+    result = {
+        'size': size,
+        'clearing': clearing,
+        'solver': solver,
+        'ticks': ticks,
+        'ticks_per_sec': ticks / sum(tick_durations),
+        'phases': phases,
+    }
+    if trace_memory:
+        result['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+# Runs bench_market in a fresh process. ru_maxrss is the high-water mark of the whole process, so only a process that
+# ran a single config gives that config's peak memory.
+def bench_isolated(*args) -> dict:
+    result = bench_market(*args)
+    result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+# With isolate every config runs in its own process and reports its peak RSS (max_rss_kb).
+def run_benchmarks(sizes: list[int], mix: dict[str, float], clearings: list[str], solvers: list[str], ticks: int, trace_memory: bool = False, isolate: bool = True) -> dict:
+    results = []
+    for size in sizes:
+        for clearing in clearings:
+            for solver in solvers:
+                args = (size, mix, clearing, solver, ticks, trace_memory)
+                if isolate:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                        results.append(executor.submit(bench_isolated, *args).result())
+                else:
+                    results.append(bench_market(*args))
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'mix': mix,
+        'results': results,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        kind, share = part.split('=')
+        mix[kind.strip()] = float(share)
+    return mix
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark market ticks and EV planning.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='e.g. rbev=0.4,loev=0.1,home=0.5')
+    parser.add_argument('--clearing', nargs='+', default=['loop', 'vectorized'])
+    parser.add_argument('--solver', nargs='+', default=['dp'])
+    parser.add_argument('--ticks', type=int, default=24)
+    parser.add_argument('--trace-memory', action='store_true', help='Track peak Python allocations (slower).')
+    parser.add_argument('--no-isolate', dest='isolate', action='store_false',
+                        help='Run every config in this process (no per-config max_rss_kb).')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.mix, args.clearing, args.solver, args.ticks, args.trace_memory, args.isolate)
+    for r in report['results']:
+        print(f"size={r['size']} clearing={r['clearing']} solver={r['solver']}: "
+              f"{r['ticks_per_sec']:.2f} ticks/s, p50 tick {r['phases']['tick']['p50_ms']:.2f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
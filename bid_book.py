@@ -0,0 +1,120 @@
+import numpy as np
+
+# Columnar storage for a tick's bids, reused from tick to tick.
+# Each row is one bid: price, amount (np.inf for unbounded), discharge flag and the index of its creator.
+# Creators are registered once and referred to by index, and DERs can append rows directly
+# (see write_bids in DoubleAuctionMarketController), so steady-state ticks don't allocate bid objects.
+class BidBook:
+    def __init__(self, capacity: int = 64):
+        self.price = np.zeros(capacity)
+        self.amount = np.zeros(capacity)
+        self.discharge = np.zeros(capacity, dtype=bool)
+        self.creator = np.zeros(capacity, dtype=np.int32)
+        self.size = 0
+        self.creators = []
+        self.creator_indices = {}
+        # One view per row, handed to DERs in place of Bid objects.
+        self.views = []
+
+    # Returns the index bids by this creator are stored under.
+    def register(self, creator) -> int:
+        index = self.creator_indices.get(id(creator))
+        if index is None:
+            index = len(self.creators)
+            self.creators.append(creator)
+            self.creator_indices[id(creator)] = index
+        return index
+
+    def clear(self):
+        self.size = 0
+
+    def reserve(self, count: int):
+        needed = self.size + count
+        capacity = len(self.price)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('price', 'amount', 'discharge', 'creator'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    # Adds a bid and returns its row. An amount of None is unbounded.
+    def append(self, price_per_kwh, amount, discharge, creator: int) -> int:
+        self.reserve(1)
+        row = self.size
+        self.price[row] = price_per_kwh
+        self.amount[row] = np.inf if amount is None else amount
+        self.discharge[row] = discharge
+        self.creator[row] = creator
+        self.size += 1
+        return row
+
+    # Adds one bid per element of the arrays and returns the first row.
+    def extend(self, prices, amounts, discharge, creator: int) -> int:
+        count = len(amounts)
+        self.reserve(count)
+        start = self.size
+        end = start + count
+        self.price[start:end] = prices
+        self.amount[start:end] = amounts
+        self.discharge[start:end] = discharge
+        self.creator[start:end] = creator
+        self.size = end
+        return start
+
+    # Adds a Bid object (or a list of them, or None) made by make_bid.
+    def add_bid(self, bid):
+        if bid is None:
+            return
+        if isinstance(bid, list):
+            for b in bid:
+                self.add_bid(b)
+            return
+        self.append(bid.price_per_kwh, bid.amount, bid.discharge, self.register(bid.creator))
+
+    def view(self, row: int) -> 'BidView':
+        while len(self.views) <= row:
+            self.views.append(BidView(self, len(self.views)))
+        return self.views[row]
+
+# A row of a BidBook with the same attributes as a Bid, so DERs can read and write results as usual.
+class BidView:
+    __slots__ = ('book', 'row')
+
+    def __init__(self, book: BidBook, row: int):
+        self.book = book
+        self.row = row
+
+    @property
+    def price_per_kwh(self):
+        return self.book.price[self.row]
+
+    @price_per_kwh.setter
+    def price_per_kwh(self, value):
+        self.book.price[self.row] = value
+
+    @property
+    def amount(self):
+        amount = self.book.amount[self.row]
+        if np.isinf(amount):
+            return None
+        return amount
+
+    @amount.setter
+    def amount(self, value):
+        self.book.amount[self.row] = np.inf if value is None else value
+
+    @property
+    def discharge(self):
+        return bool(self.book.discharge[self.row])
+
+    @discharge.setter
+    def discharge(self, value):
+        self.book.discharge[self.row] = value
+
+    @property
+    def creator(self):
+        return self.book.creators[self.book.creator[self.row]]
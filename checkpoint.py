@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import random
+
+import numpy as np
+
+# Snapshots of a running simulation: the market clock, the random and numpy.random global states and the state of
+# every DER implementing get_state() / set_state(state) (EVs, RuleBasedEVFleet, HomePopulation, ...).
+# DERs without get_state are taken to have no state of their own (e.g. Home, which draws from the random module).
+# Wrappers (RecordingWrapper, SimulatedAgent) are looked through, and markets registered as DERs (FeederMarket)
+# are saved with their own DERs.
+# States are stored per DER class, stacked into one array per field, in a single .npz file: saving thousands of EVs
+# writes a handful of arrays rather than thousands of pickled objects, and loading needs no pickle at all.
+# A checkpoint can only be restored into a market built the same way (same DER names and classes),
+# e.g. scenario.build_market with the same scenario.
+# Markets hosting their DERs elsewhere (ShardedMarketController) aren't supported.
+
+VERSION = 1
+
+def unwrap(der):
+    while hasattr(der, 'der'):
+        der = der.der
+    return der
+
+# (name, DER) for every DER of the market with state to save, feeder DERs named <feeder>/<der>.
+def stateful_ders(ders: dict, prefix: str = '') -> list[tuple[str, object]]:
+    found = []
+    for name, der in ders.items():
+        der = unwrap(der)
+        if hasattr(der, 'get_state'):
+            found.append((prefix + name, der))
+        if isinstance(getattr(der, 'ders', None), dict):
+            found.extend(stateful_ders(der.ders, f'{prefix}{name}/'))
+    return found
+
+def _groups(ders: list[tuple[str, object]]) -> dict[str, tuple[list[str], dict]]:
+    # DERs of the same class with fields of the same shapes are stacked together.
+    grouped = {}
+    for name, der in ders:
+        state = {field: np.asarray(value) for field, value in der.get_state().items()}
+        key = (type(der).__name__, tuple((field, value.shape, value.dtype.str) for field, value in state.items()))
+        grouped.setdefault(key, []).append((name, state))
+
+    groups = {}
+    for i, ((type_name, _), members) in enumerate(grouped.items()):
+        names = [name for name, _ in members]
+        fields = {field: np.stack([state[field] for _, state in members]) for field in members[0][1]}
+        groups[f'{type_name}_{i}'] = (names, fields)
+    return groups
+
+def save_checkpoint(path: str, market, ticks: int = 0, compress: bool = False):
+    version, mt, gauss_next = random.getstate()
+    numpy_state = np.random.get_state()
+    groups = _groups(stateful_ders(market.ders))
+    meta = {
+        'version': VERSION,
+        't': market.t,
+        'ticks': ticks,
+        'random': [version, gauss_next],
+        'numpy_random': [numpy_state[0], int(numpy_state[2]), int(numpy_state[3]), float(numpy_state[4])],
+        'groups': {group: names for group, (names, _) in groups.items()},
+    }
+    arrays = {
+        'meta': np.array(json.dumps(meta)),
+        'random': np.array(mt, dtype=np.uint32),
+        'numpy_random': numpy_state[1],
+    }
+    for group, (_, fields) in groups.items():
+        for field, values in fields.items():
+            arrays[f'{group}/{field}'] = values
+
+    # Written next to the target and moved over it, so a crash mid-save leaves the previous checkpoint intact.
+    buffer = io.BytesIO()
+    (np.savez_compressed if compress else np.savez)(buffer, **arrays)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(buffer.getbuffer())
+    os.replace(tmp, path)
+
+# Restores a checkpoint into the market and returns its metadata (t, ticks, ...).
+def load_checkpoint(path: str, market) -> dict:
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        if meta['version'] != VERSION:
+            raise ValueError(f'Checkpoint version {meta["version"]} is not supported.')
+        ders = dict(stateful_ders(market.ders))
+        saved = [name for names in meta['groups'].values() for name in names]
+        if sorted(saved) != sorted(ders):
+            raise ValueError(f'Checkpoint {path} does not match the market\'s DERs.')
+
+        for group, names in meta['groups'].items():
+            fields = {key.split('/', 1)[1]: data[key] for key in data.files if key.startswith(group + '/')}
+            for i, name in enumerate(names):
+                ders[name].set_state({field: values[i] for field, values in fields.items()})
+
+        version, gauss_next = meta['random']
+        random.setstate((version, tuple(data['random'].tolist()), gauss_next))
+        name, pos, has_gauss, cached_gaussian = meta['numpy_random']
+        np.random.set_state((name, data['numpy_random'], pos, has_gauss, cached_gaussian))
+    market.t = meta['t']
+    return meta
+
+# Saves a checkpoint of the market every `interval` ticks. Call advance after running ticks.
+# Example:
+#     checkpointer = Checkpointer('run.npz', market, interval=24 * 7)
+#     for _ in range(ticks):
+#         market.run_tick()
+#         checkpointer.advance()
+class Checkpointer:
+    def __init__(self, path: str, market, interval: int = 24, compress: bool = False):
+        self.path = path
+        self.market = market
+        self.interval = interval
+        self.compress = compress
+        self.ticks = 0
+        self.saved = 0
+
+    def advance(self, ticks: int = 1):
+        before = self.ticks
+        self.ticks += ticks
+        if self.interval > 0 and self.ticks // self.interval > before // self.interval:
+            self.save()
+
+    def save(self):
+        save_checkpoint(self.path, self.market, self.ticks, self.compress)
+        self.saved += 1
+
+    # Restores the last checkpoint, returning the number of ticks run when it was saved.
+    def restore(self) -> int:
+        self.ticks = load_checkpoint(self.path, self.market)['ticks']
+        return self.ticks
@@ -0,0 +1,535 @@
+from functools import cmp_to_key
+
+import numpy as np
+
+from profiling import traced
+
+# Clearing engines for the double auction.
+# Each engine takes the unsorted source and sink bids of a tick, sorts both lists in place into the order
+# the DERs get notified in (except clear_levels), writes the result price and granted amount into every bid and returns the market price.
+# Both lists must be non-empty. Sorting and matching are timed as the 'sort' and 'match' phases of tracer, if given.
+
+# Double-Auction logic from Wikipedia (average mechanism):
+# https://en.wikipedia.org/wiki/Double_auction
+# Below is a modified version of that algorithm with the following changes:
+# 1. Bids are weighted by the amount of energy the bid calls for. Fractional fulfillment is allowed.
+# 2. All sink (load) bids are fulfilled - the grid compensates for the extra load by supplying power at grid price.
+#    This grid-priced power is factored into the average price.
+
+def clear_loop(source_bids: list, sink_bids: list, tracer=None) -> float:
+    with traced(tracer, 'sort'):
+        sink_bids.sort(key=cmp_to_key(lambda a, b: a.compare_to(b))) # TODO does this need to be reversed?
+        source_bids.sort(key=cmp_to_key(lambda a, b: a.compare_to(b)), reverse=True)
+
+    with traced(tracer, 'match'):
+        return _match_loop(source_bids, sink_bids)
+
+def _match_loop(source_bids: list, sink_bids: list) -> float:
+    source_index = 0
+    source_taken = 0.0
+    sink_index = 0
+    sink_taken = 0.0
+    while sink_index < len(sink_bids) and source_index < len(source_bids) and sink_bids[sink_index].price_per_kwh >= source_bids[source_index].price_per_kwh:
+        source_rem = None
+        sink_rem = None
+        if source_bids[source_index].amount is not None:
+            source_rem = source_bids[source_index].amount - source_taken
+        if sink_bids[sink_index].amount is not None:
+            sink_rem = sink_bids[sink_index].amount - sink_taken
+
+        if sink_rem == source_rem:
+            # Sink and source balance out - increment both.
+            source_taken = 0.0
+            source_index += 1
+            sink_taken = 0.0
+            sink_index += 1
+        elif source_rem is None or sink_rem < source_rem:
+            # Sink is full, source is partially full.
+            source_taken += sink_rem
+            sink_taken = 0.0
+            sink_index += 1
+        else:
+            # Source is full, sink is partially full.
+            source_taken = 0.0
+            source_index += 1
+            sink_taken += source_rem
+
+    price = (sink_bids[sink_index-1].price_per_kwh + source_bids[source_index-1].price_per_kwh) / 2
+
+    for i, b in enumerate(source_bids):
+        if i == source_index and source_taken > 0:
+            # The final bid is partially full.
+            b.price_per_kwh = price
+            b.amount = source_taken
+        elif i < source_index:
+            # All less than index are guaranteed to be full.
+            b.price_per_kwh = price
+        else:
+            # The rest are not fulfilled.
+            b.price_per_kwh = price
+            b.amount = 0.0
+
+    for i, b in enumerate(sink_bids):
+        if i == sink_index and sink_taken > 0:
+            # The final bid is partially full.
+            b.price_per_kwh = price
+            b.amount = source_taken
+        elif i < sink_index:
+            # All less than index are guaranteed to be full.
+            b.price_per_kwh = price
+        else:
+            # The rest are not fulfilled.
+            b.price_per_kwh = price
+            b.amount = 0.0
+
+    return price
+
+# Returns the order Bid.compare_to sorts a list of bids into.
+# Sinks go by ascending price then descending amount, sources by ascending price then ascending amount.
+# Unbounded amounts (np.inf) go last for sinks and first for sources. Ties keep their original order.
+def clearing_order(prices: np.ndarray, amounts: np.ndarray, discharge: bool) -> np.ndarray:
+    unbounded = np.isinf(amounts)
+    if discharge:
+        amount_key = np.where(unbounded, -np.inf, amounts)
+    else:
+        amount_key = np.where(unbounded, np.inf, -amounts)
+    return np.lexsort((amount_key, prices))
+
+# Rank of each value within its run of equal values in a sorted array.
+def _run_ranks(values: np.ndarray) -> np.ndarray:
+    return np.arange(len(values)) - np.searchsorted(values, values, side='left')
+
+# Scalar version of the matching walk for books the cumulative sums can't describe (negative amounts).
+def _walk(sink_prices, sink_amounts, source_prices, source_amounts) -> tuple[int, float, int, float]:
+    source_index = 0
+    source_taken = 0.0
+    sink_index = 0
+    sink_taken = 0.0
+    while sink_index < len(sink_prices) and source_index < len(source_prices) and sink_prices[sink_index] >= source_prices[source_index]:
+        source_rem = source_amounts[source_index] - source_taken
+        sink_rem = sink_amounts[sink_index] - sink_taken
+        if sink_rem == source_rem:
+            source_taken = 0.0
+            source_index += 1
+            sink_taken = 0.0
+            sink_index += 1
+        elif sink_rem < source_rem:
+            source_taken += sink_rem
+            sink_taken = 0.0
+            sink_index += 1
+        else:
+            source_taken = 0.0
+            source_index += 1
+            sink_taken += source_rem
+    return sink_index, sink_taken, source_index, source_taken
+
+# Finds where the sorted sink and source books stop crossing.
+# Amounts use np.inf for unbounded bids. Returns (sink_index, sink_taken, source_index, source_taken) exactly as
+# the loop in clear_loop leaves them, up to floating point rounding of the running totals.
+def find_crossing(sink_prices: np.ndarray,
+                  sink_amounts: np.ndarray,
+                  source_prices: np.ndarray,
+                  source_amounts: np.ndarray) -> tuple[int, float, int, float]:
+    if (sink_amounts < 0).any() or (source_amounts < 0).any() or np.isinf(sink_amounts).any():
+        return _walk(sink_prices.tolist(), sink_amounts.tolist(), source_prices.tolist(), source_amounts.tolist())
+
+    n = len(sink_amounts)
+    m = len(source_amounts)
+
+    # The loop walks the cumulative sink and source amounts like a merge: whichever bid runs out first
+    # is incremented, and both are incremented when they run out together.
+    # With non-negative amounts the cumulative sums are sorted, so the walk is a sort of both boundary lists.
+    # Equal boundaries on both sides are consumed pairwise, so they're matched up by their rank within equal runs.
+    sink_bounds = np.cumsum(sink_amounts)
+    source_bounds = np.cumsum(source_amounts)
+    bounds = np.concatenate((sink_bounds, source_bounds))
+    ranks = np.concatenate((_run_ranks(sink_bounds), _run_ranks(source_bounds)))
+    is_sink = np.concatenate((np.ones(n, dtype=bool), np.zeros(m, dtype=bool)))
+
+    order = np.lexsort((~is_sink, ranks, bounds))
+    bounds = bounds[order]
+    ranks = ranks[order]
+    is_sink = is_sink[order]
+
+    # A step ends at its last event - events sharing a boundary and rank form one "both" step.
+    step_end = np.ones(n + m, dtype=bool)
+    step_end[:-1] = (bounds[1:] != bounds[:-1]) | (ranks[1:] != ranks[:-1])
+
+    # Walk state before each step and after the last one.
+    sink_states = np.concatenate(([0], np.cumsum(is_sink)[step_end]))
+    source_states = np.concatenate(([0], np.cumsum(~is_sink)[step_end]))
+    taken_states = np.concatenate(([0.0], bounds[step_end]))
+
+    # The walk stops at the first state where either book is exhausted or the books no longer cross.
+    # The final state has both books exhausted, so there's always a stop.
+    sink_heads = sink_prices[np.minimum(sink_states, n - 1)]
+    source_heads = source_prices[np.minimum(source_states, m - 1)]
+    stop = (sink_states >= n) | (source_states >= m) | (sink_heads < source_heads)
+    k = int(np.argmax(stop))
+
+    sink_index = int(sink_states[k])
+    source_index = int(source_states[k])
+    taken = taken_states[k]
+    sink_before = sink_bounds[sink_index - 1] if sink_index > 0 else 0.0
+    source_before = source_bounds[source_index - 1] if source_index > 0 else 0.0
+    return sink_index, float(taken - sink_before), source_index, float(taken - source_before)
+
+# The walk of find_crossing on price levels instead of individual bids, for books whose amounts are all positive
+# (sources may be unbounded). Levels are sorted the same way as the bids and described by their price and total amount.
+# The walk can only stop where the head of either book moves to a new price level, so it's enough to step from
+# level boundary to level boundary, which takes time proportional to the number of crossed levels.
+# Returns (sink_level, sink_offset, source_level, source_offset): the head level of each book when the walk stops and
+# how much of it was taken, from which the bid-level result follows by walking the bids of the head levels.
+# totals can be any sequence, and is only indexed up to the head levels.
+def find_level_crossing(sink_prices, sink_totals, source_prices, source_totals) -> tuple[int, float, int, float]:
+    n = len(sink_prices)
+    m = len(source_prices)
+    sink_level = 0
+    source_level = 0
+    sink_start = 0.0
+    source_start = 0.0
+    taken = 0.0
+    sink_end = sink_totals[0] if n > 0 else 0.0
+    source_end = source_totals[0] if m > 0 else 0.0
+    while sink_level < n and source_level < m and sink_prices[sink_level] >= source_prices[source_level]:
+        taken = min(sink_end, source_end)
+        if sink_end == taken:
+            sink_level += 1
+            sink_start = sink_end
+            if sink_level < n:
+                sink_end += sink_totals[sink_level]
+        if source_end == taken:
+            source_level += 1
+            source_start = source_end
+            if source_level < m:
+                source_end += source_totals[source_level]
+    return sink_level, taken - sink_start, source_level, taken - source_start
+
+# Granted amount of each sorted bid, given the crossing on its side of the book.
+# Bids before the index are granted in full, the bid at the index gets partial_amount if taken > 0, the rest get 0.
+def fill_amounts(amounts: np.ndarray, index: int, taken: float, partial_amount: float) -> np.ndarray:
+    fills = np.zeros(len(amounts))
+    fills[:index] = amounts[:index]
+    if index < len(amounts) and taken > 0:
+        fills[index] = partial_amount
+    return fills
+
+def _amounts(bids: list) -> np.ndarray:
+    return np.array([np.inf if b.amount is None else b.amount for b in bids], dtype=float)
+
+def _prices(bids: list) -> np.ndarray:
+    return np.array([b.price_per_kwh for b in bids], dtype=float)
+
+# Same results as clear_loop, but sorting and matching are done on NumPy arrays.
+def clear_vectorized(source_bids: list, sink_bids: list, tracer=None) -> float:
+    with traced(tracer, 'sort'):
+        sink_amounts = _amounts(sink_bids)
+        sink_prices = _prices(sink_bids)
+        order = clearing_order(sink_prices, sink_amounts, False)
+        sink_bids[:] = [sink_bids[i] for i in order]
+        sink_amounts = sink_amounts[order]
+        sink_prices = sink_prices[order]
+
+        source_amounts = _amounts(source_bids)
+        source_prices = _prices(source_bids)
+        order = clearing_order(source_prices, source_amounts, True)
+        source_bids[:] = [source_bids[i] for i in order]
+        source_amounts = source_amounts[order]
+        source_prices = source_prices[order]
+
+    with traced(tracer, 'match'):
+        return _match_vectorized(source_bids, sink_bids, source_prices, source_amounts, sink_prices, sink_amounts)
+
+def _match_vectorized(source_bids, sink_bids, source_prices, source_amounts, sink_prices, sink_amounts) -> float:
+    sink_index, sink_taken, source_index, source_taken = find_crossing(sink_prices, sink_amounts, source_prices, source_amounts)
+    price = (sink_bids[sink_index-1].price_per_kwh + source_bids[source_index-1].price_per_kwh) / 2
+
+    # Bids before the crossing keep their amount, so only the rest are written back.
+    # The partially full sink is granted source_taken to match clear_loop.
+    source_fills = fill_amounts(source_amounts, source_index, source_taken, source_taken)
+    sink_fills = fill_amounts(sink_amounts, sink_index, sink_taken, source_taken)
+    for bids, fills, index in ((source_bids, source_fills, source_index), (sink_bids, sink_fills, sink_index)):
+        for b in bids:
+            b.price_per_kwh = price
+        for b, amount in zip(bids[index:], fills[index:].tolist()):
+            b.amount = amount
+
+    return price
+
+# Clears bids stored in a BidBook in place, with the same results as clear_vectorized.
+# Takes the rows of the source and sink bids in the order they were added and returns the price
+# and both sets of rows sorted into notification order.
+def clear_book(book, source_rows: np.ndarray, sink_rows: np.ndarray, tracer=None) -> tuple[float, np.ndarray, np.ndarray]:
+    with traced(tracer, 'sort'):
+        sink_rows = sink_rows[clearing_order(book.price[sink_rows], book.amount[sink_rows], False)]
+        source_rows = source_rows[clearing_order(book.price[source_rows], book.amount[source_rows], True)]
+
+    with traced(tracer, 'match'):
+        price = _match_book(book, source_rows, sink_rows)
+    return price, source_rows, sink_rows
+
+def _match_book(book, source_rows: np.ndarray, sink_rows: np.ndarray) -> float:
+    sink_prices = book.price[sink_rows]
+    sink_amounts = book.amount[sink_rows]
+    source_prices = book.price[source_rows]
+    source_amounts = book.amount[source_rows]
+
+    sink_index, sink_taken, source_index, source_taken = find_crossing(sink_prices, sink_amounts, source_prices, source_amounts)
+    price = float((sink_prices[sink_index-1] + source_prices[source_index-1]) / 2)
+
+    source_fills = fill_amounts(source_amounts, source_index, source_taken, source_taken)
+    sink_fills = fill_amounts(sink_amounts, sink_index, sink_taken, source_taken)
+    book.price[source_rows] = price
+    book.price[sink_rows] = price
+    book.amount[source_rows[source_index:]] = source_fills[source_index:]
+    book.amount[sink_rows[sink_index:]] = sink_fills[sink_index:]
+    return price
+
+# Groups bids into price levels. With tick_size > 0 prices are bucketed into [k * tick_size, (k + 1) * tick_size)
+# and a bucket's price is the mean price of its bids.
+# Returns each bid's level and the price and total amount of every level, in ascending price order.
+# Buckets are counted by their integer index k (see _bucket_levels), so grouping takes O(n + buckets) with no sort
+# of the bids. With tick_size = 0 the levels are the exact prices, which still need an O(n log n) sort (np.unique).
+def price_levels(prices: np.ndarray, amounts: np.ndarray, tick_size: float = 0.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    grouped = _bucket_levels(np.floor(prices / tick_size)) if tick_size > 0 else None
+    if grouped is None:
+        keys = np.floor(prices / tick_size) if tick_size > 0 else prices
+        grouped = np.unique(keys, return_inverse=True)
+    level_keys, levels = grouped
+    totals = np.bincount(levels, weights=amounts, minlength=len(level_keys))
+    if tick_size > 0:
+        level_prices = np.bincount(levels, weights=prices, minlength=len(level_keys)) / np.bincount(levels, minlength=len(level_keys))
+    else:
+        level_prices = level_keys
+    return levels, level_prices, totals
+
+# np.unique(buckets, return_inverse=True) by counting: the occupied buckets between the lowest and highest are found with
+# np.bincount, and come out in ascending order. Returns None when the buckets are spread too thinly
+# (many more empty buckets than bids) or aren't finite, for np.unique to handle.
+def _bucket_levels(buckets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    if len(buckets) == 0 or not np.isfinite(buckets).all():
+        return None
+    low = buckets.min()
+    span = buckets.max() - low + 1
+    if span > 4 * len(buckets) + 1024:
+        return None
+    index = (buckets - low).astype(np.int64)
+    occupied = np.bincount(index, minlength=int(span)) > 0
+    rank = np.cumsum(occupied) - 1
+    return np.flatnonzero(occupied) + low, rank[index]
+
+# Price of the last bid taken on one side, wrapping around to the last level like clear_loop.
+def _level_price_before(level_prices: np.ndarray, level: int, partly_taken: bool) -> float:
+    if partly_taken:
+        return level_prices[level]
+    return level_prices[level - 1]
+
+# The bids of a level in clearing order, and where the walk stopped within them.
+def _level_index(prices, amounts, levels, level, offset, discharge) -> tuple[np.ndarray, int, float]:
+    members = np.flatnonzero(levels == level)
+    members = members[clearing_order(prices[members], amounts[members], discharge)]
+    cumulative = np.cumsum(amounts[members])
+    index = int(np.searchsorted(cumulative, offset, side='right'))
+    before = cumulative[index - 1] if index > 0 else 0.0
+    return members, index, float(offset - before)
+
+# Clears on aggregate supply and demand curves instead of sorted bids. Bids are grouped into price levels
+# (see price_levels), the walk of find_crossing runs over the levels with find_level_crossing,
+# and only the bids of the marginal level on each side are looked at individually.
+# With tick_size = 0 the levels are exact prices, and the marginal levels are walked bid by bid in clearing order,
+# which gives the same price and amounts as clear_vectorized up to floating point rounding of the running totals.
+# With tick_size > 0 bids in the marginal bucket are filled pro rata (unbounded sources share what was taken equally),
+# the price uses the buckets' mean prices, and partial sink fills are their own share rather than the source's.
+# Books with zero, negative or unbounded sink amounts are cleared with clear_vectorized instead.
+# Unlike the other engines, the bid lists are left in the order they were added.
+def clear_levels(source_bids: list, sink_bids: list, tracer=None, tick_size: float = 0.0) -> float:
+    sink_amounts = _amounts(sink_bids)
+    source_amounts = _amounts(source_bids)
+    if not (sink_amounts > 0).all() or np.isinf(sink_amounts).any() or not (source_amounts > 0).all():
+        return clear_vectorized(source_bids, sink_bids, tracer)
+    sink_prices = _prices(sink_bids)
+    source_prices = _prices(source_bids)
+
+    with traced(tracer, 'sort'):
+        sink_levels, sink_level_prices, sink_totals = price_levels(sink_prices, sink_amounts, tick_size)
+        source_levels, source_level_prices, source_totals = price_levels(source_prices, source_amounts, tick_size)
+
+    with traced(tracer, 'match'):
+        sink_level, sink_offset, source_level, source_offset = find_level_crossing(
+            sink_level_prices, sink_totals, source_level_prices, source_totals)
+        sink_fills = np.where(sink_levels < sink_level, sink_amounts, 0.0)
+        source_fills = np.where(source_levels < source_level, source_amounts, 0.0)
+
+        if tick_size > 0:
+            price = (_level_price_before(sink_level_prices, sink_level, sink_offset > 0)
+                     + _level_price_before(source_level_prices, source_level, source_offset > 0)) / 2
+            for fills, amounts, levels, totals, level, offset in (
+                    (sink_fills, sink_amounts, sink_levels, sink_totals, sink_level, sink_offset),
+                    (source_fills, source_amounts, source_levels, source_totals, source_level, source_offset)):
+                if level < len(totals) and offset > 0:
+                    members = levels == level
+                    if np.isinf(totals[level]):
+                        unbounded = members & np.isinf(amounts)
+                        fills[unbounded] = offset / unbounded.sum()
+                    else:
+                        fills[members] = amounts[members] * (offset / totals[level])
+        else:
+            sink_index = source_index = 0
+            sink_taken = source_taken = 0.0
+            if sink_level < len(sink_totals):
+                sink_members, sink_index, sink_taken = _level_index(sink_prices, sink_amounts, sink_levels, sink_level, sink_offset, False)
+            if source_level < len(source_totals):
+                source_members, source_index, source_taken = _level_index(source_prices, source_amounts, source_levels, source_level, source_offset, True)
+            price = (_level_price_before(sink_level_prices, sink_level, sink_index > 0)
+                     + _level_price_before(source_level_prices, source_level, source_index > 0)) / 2
+
+            # The partially full sink is granted source_taken to match clear_loop.
+            if sink_level < len(sink_totals):
+                sink_fills[sink_members[:sink_index]] = sink_amounts[sink_members[:sink_index]]
+                if sink_index < len(sink_members) and sink_taken > 0:
+                    sink_fills[sink_members[sink_index]] = source_taken
+            if source_level < len(source_totals):
+                source_fills[source_members[:source_index]] = source_amounts[source_members[:source_index]]
+                if source_index < len(source_members) and source_taken > 0:
+                    source_fills[source_members[source_index]] = source_taken
+
+    price = float(price)
+    for bids, fills, amounts in ((source_bids, source_fills, source_amounts), (sink_bids, sink_fills, sink_amounts)):
+        for b in bids:
+            b.price_per_kwh = price
+        for i in np.flatnonzero(fills != amounts).tolist():
+            bids[i].amount = float(fills[i])
+    return price
+
+# Batched clearing of many independent books at once, one per row (see batched_market.py).
+# Each book has a fixed set of slots, and inactive slots hold no bid.
+# Rows are cleared exactly as clear_book would clear the active slots in their column order.
+
+# clearing_order for every row, with inactive slots sorted to the end.
+def clearing_order_batched(prices: np.ndarray, amounts: np.ndarray, active: np.ndarray, discharge: bool) -> np.ndarray:
+    unbounded = np.isinf(amounts)
+    if discharge:
+        amount_key = np.where(unbounded, -np.inf, amounts)
+    else:
+        amount_key = np.where(unbounded, np.inf, -amounts)
+    return np.lexsort((amount_key, prices, ~active), axis=-1)
+
+# _run_ranks for every row of a row-wise sorted array.
+def _run_ranks_batched(values: np.ndarray) -> np.ndarray:
+    index = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    starts = np.zeros(values.shape, dtype=np.intp)
+    starts[:, 1:] = np.where(values[:, 1:] != values[:, :-1], index[:, 1:], 0)
+    return index - np.maximum.accumulate(starts, axis=1)
+
+# find_crossing for every row. Rows are sorted with their sink_counts/source_counts active bids first.
+# Uses the same merge of cumulative sums as find_crossing, with the inactive slots' boundaries at infinity
+# so they sort after the walk has stopped. Rows the cumulative sums can't describe are walked one by one.
+def find_crossing_batched(sink_prices: np.ndarray,
+                          sink_amounts: np.ndarray,
+                          sink_counts: np.ndarray,
+                          source_prices: np.ndarray,
+                          source_amounts: np.ndarray,
+                          source_counts: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    rows = np.arange(len(sink_counts))
+    sink_valid = np.arange(sink_amounts.shape[1]) < sink_counts[:, None]
+    source_valid = np.arange(source_amounts.shape[1]) < source_counts[:, None]
+    sink_bounds = np.where(sink_valid, np.cumsum(np.where(sink_valid, sink_amounts, 0.0), axis=1), np.inf)
+    source_bounds = np.where(source_valid, np.cumsum(np.where(source_valid, source_amounts, 0.0), axis=1), np.inf)
+
+    bounds = np.concatenate((sink_bounds, source_bounds), axis=1)
+    ranks = np.concatenate((_run_ranks_batched(sink_bounds), _run_ranks_batched(source_bounds)), axis=1)
+    is_sink = np.zeros(bounds.shape, dtype=bool)
+    is_sink[:, :sink_amounts.shape[1]] = True
+
+    order = np.lexsort((~is_sink, ranks, bounds), axis=-1)
+    bounds = np.take_along_axis(bounds, order, axis=1)
+    ranks = np.take_along_axis(ranks, order, axis=1)
+    is_sink = np.take_along_axis(is_sink, order, axis=1)
+
+    step_end = np.ones(bounds.shape, dtype=bool)
+    step_end[:, :-1] = (bounds[:, 1:] != bounds[:, :-1]) | (ranks[:, 1:] != ranks[:, :-1])
+
+    # Walk state before the first step and after every event, of which only step ends are real states.
+    zeros = np.zeros((len(rows), 1), dtype=np.intp)
+    sink_states = np.concatenate((zeros, np.cumsum(is_sink, axis=1)), axis=1)
+    source_states = np.concatenate((zeros, np.cumsum(~is_sink, axis=1)), axis=1)
+    taken_states = np.concatenate((zeros.astype(float), bounds), axis=1)
+    real = np.concatenate((np.ones((len(rows), 1), dtype=bool), step_end), axis=1)
+
+    sink_heads = np.take_along_axis(sink_prices, np.minimum(sink_states, np.maximum(sink_counts - 1, 0)[:, None]), axis=1)
+    source_heads = np.take_along_axis(source_prices, np.minimum(source_states, np.maximum(source_counts - 1, 0)[:, None]), axis=1)
+    stop = real & ((sink_states >= sink_counts[:, None]) | (source_states >= source_counts[:, None]) | (sink_heads < source_heads))
+    k = np.argmax(stop, axis=1)
+
+    sink_index = sink_states[rows, k]
+    source_index = source_states[rows, k]
+    taken = taken_states[rows, k]
+    sink_before = np.where(sink_index > 0, sink_bounds[rows, sink_index - 1], 0.0)
+    source_before = np.where(source_index > 0, source_bounds[rows, source_index - 1], 0.0)
+    with np.errstate(invalid='ignore'):
+        sink_taken = taken - sink_before
+        source_taken = taken - source_before
+
+    walk = ((sink_valid & ((sink_amounts < 0) | np.isinf(sink_amounts))).any(axis=1)
+            | (source_valid & (source_amounts < 0)).any(axis=1))
+    for row in np.flatnonzero(walk).tolist():
+        n = sink_counts[row]
+        m = source_counts[row]
+        sink_index[row], sink_taken[row], source_index[row], source_taken[row] = _walk(
+            sink_prices[row, :n].tolist(), sink_amounts[row, :n].tolist(), source_prices[row, :m].tolist(), source_amounts[row, :m].tolist())
+    return sink_index, sink_taken, source_index, source_taken
+
+# Clears every row's book and returns (price, sink_fills, source_fills, notified), with the fills (granted amounts)
+# in the original slot order and 0 for inactive slots.
+# Matches run_book_tick: rows without sinks deny every source at the lowest source price,
+# and rows without sources get the highest sink price and notify nobody (notified is False).
+def clear_batched(sink_prices: np.ndarray,
+                  sink_amounts: np.ndarray,
+                  sink_active: np.ndarray,
+                  source_prices: np.ndarray,
+                  source_amounts: np.ndarray,
+                  source_active: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    rows = np.arange(len(sink_prices))
+    sink_order = clearing_order_batched(sink_prices, sink_amounts, sink_active, False)
+    source_order = clearing_order_batched(source_prices, source_amounts, source_active, True)
+    sorted_sink_prices = np.take_along_axis(sink_prices, sink_order, axis=1)
+    sorted_sink_amounts = np.take_along_axis(sink_amounts, sink_order, axis=1)
+    sorted_source_prices = np.take_along_axis(source_prices, source_order, axis=1)
+    sorted_source_amounts = np.take_along_axis(source_amounts, source_order, axis=1)
+    sink_counts = sink_active.sum(axis=1)
+    source_counts = source_active.sum(axis=1)
+
+    sink_index, sink_taken, source_index, source_taken = find_crossing_batched(
+        sorted_sink_prices, sorted_sink_amounts, sink_counts, sorted_source_prices, sorted_source_amounts, source_counts)
+
+    # Index -1 wraps around to the last active bid, like the Python lists in clear_loop.
+    sink_last = np.where(sink_index > 0, sink_index - 1, sink_counts - 1)
+    source_last = np.where(source_index > 0, source_index - 1, source_counts - 1)
+    no_sinks = sink_counts == 0
+    no_sources = source_counts == 0
+    with np.errstate(invalid='ignore'):
+        price = (sorted_sink_prices[rows, sink_last] + sorted_source_prices[rows, source_last]) / 2
+        price = np.where(no_sinks, np.where(source_active, source_prices, np.inf).min(axis=1), price)
+        price = np.where(no_sources, np.where(sink_active, sink_prices, -np.inf).max(axis=1), price)
+
+    # The partially full sink is granted source_taken to match clear_loop.
+    sink_columns = np.arange(sink_prices.shape[1])
+    source_columns = np.arange(source_prices.shape[1])
+    sink_fills = np.where(sink_columns < sink_index[:, None], sorted_sink_amounts,
+                          np.where((sink_columns == sink_index[:, None]) & (sink_taken > 0)[:, None], source_taken[:, None], 0.0))
+    source_fills = np.where(source_columns < source_index[:, None], sorted_source_amounts,
+                            np.where((source_columns == source_index[:, None]) & (source_taken > 0)[:, None], source_taken[:, None], 0.0))
+    sink_fills[sink_columns >= sink_counts[:, None]] = 0.0
+    source_fills[source_columns >= source_counts[:, None]] = 0.0
+
+    unsorted_sink_fills = np.empty_like(sink_fills)
+    np.put_along_axis(unsorted_sink_fills, sink_order, sink_fills, axis=1)
+    unsorted_source_fills = np.empty_like(source_fills)
+    np.put_along_axis(unsorted_source_fills, source_order, source_fills, axis=1)
+    return price, unsorted_sink_fills, unsorted_source_fills, ~no_sources
+
+CLEARING_ENGINES = {
+    'loop': clear_loop,
+    'vectorized': clear_vectorized,
+    'levels': clear_levels,
+}
@@ -0,0 +1,46 @@
+import numpy as np
+
+# EV.determine_energy_transfer for arrays of batteries, in one NumPy pass.
+# direction is IDLE, CHARGE or DISCHARGE per battery (or one for all), driving is a discharge.
+# amount is the energy asked for, np.inf for the full rate (amount=None in the scalar method).
+# Charging stops at max_capacity and discharging at min_capacity, without moving batteries already past them,
+# exactly like the scalar method with the same operating range.
+# Returns the new energies and the energy transferred (negative when discharging).
+
+IDLE, CHARGE, DISCHARGE = 0, 1, -1
+
+def transfer_energy(current_energy: np.ndarray,
+                    direction,
+                    amount,
+                    charge_rate_max: np.ndarray,
+                    discharge_rate_max: np.ndarray,
+                    min_capacity: np.ndarray,
+                    max_capacity: np.ndarray,
+                    dt: float = 1) -> tuple[np.ndarray, np.ndarray]:
+    direction = np.asarray(direction)
+    charging = direction == CHARGE
+    step = np.minimum(amount, np.where(charging, dt * charge_rate_max, dt * discharge_rate_max))
+    charged = np.minimum(current_energy + step, np.maximum(max_capacity, current_energy))
+    discharged = np.maximum(current_energy - step, np.minimum(min_capacity, current_energy))
+    energy = np.where(charging, charged, np.where(direction == DISCHARGE, discharged, current_energy))
+    return energy, energy - current_energy
+
+# Operating bounds of a list of EVs as arrays, for transfer_energy. range narrows the operating range like
+# EV.max_operating_capacity(range).
+def ev_bounds(evs: list, range=None) -> dict:
+    return {
+        'charge_rate_max': np.array([ev.spec.charge_rate_max for ev in evs], dtype=float),
+        'discharge_rate_max': np.array([ev.spec.discharge_rate_max for ev in evs], dtype=float),
+        'min_capacity': np.array([ev.min_operating_capacity(range) for ev in evs], dtype=float),
+        'max_capacity': np.array([ev.max_operating_capacity(range) for ev in evs], dtype=float),
+    }
+
+# Applies one transfer to every EV object of a list, writing back current_energy. Returns the transfers.
+def transfer_ev_energy(evs: list, direction, amount, dt: float = 1, range=None, bounds: dict = None) -> np.ndarray:
+    if bounds is None:
+        bounds = ev_bounds(evs, range)
+    current_energy = np.array([ev.current_energy for ev in evs], dtype=float)
+    energy, transfer = transfer_energy(current_energy, direction, amount, dt=dt, **bounds)
+    for ev, e in zip(evs, energy.tolist()):
+        ev.current_energy = e
+    return transfer
@@ -1,3 +1,6 @@
+from lookahead import lookahead_table
+from market import Bid
+
 # Contains characteristics defining an EV's hardware.
 class EVSpec:
     def __init__(self,
@@ -13,15 +16,44 @@ class EVSpec:
         self.operating_range = operating_range # Percent
 
 # Defines an EV with all common functionality between different EV DER algorithms.
+# Subclasses implement decide_bid(t, grid_price), returning (price_per_kwh, amount, discharge) or None for no bid.
 class EV:
     def __init__(self,
                  spec: EVSpec,
                  mdr: list[float],
-                 driving_schedule: list[float]):
+                 driving_schedule: list[float],
+                 lookahead_window: int = 3):
         self.spec = spec
         self.current_energy = spec.initial_energy
         self.mdr = mdr
         self.driving_schedule = driving_schedule
+        # Shared with every vehicle on the same schedules, see lookahead.py.
+        self.lookahead = lookahead_table(mdr, driving_schedule, lookahead_window)
+
+    def make_bid(self, t, grid_price):
+        bid = self.decide_bid(t, grid_price)
+        if bid is None:
+            return None
+        price_per_kwh, amount, discharge = bid
+        return Bid(
+            price_per_kwh=price_per_kwh,
+            amount=amount,
+            discharge=discharge,
+            creator=self,
+        )
+
+    def write_bids(self, t, grid_price, book, creator):
+        bid = self.decide_bid(t, grid_price)
+        if bid is not None:
+            price_per_kwh, amount, discharge = bid
+            book.append(price_per_kwh, amount, discharge, creator)
+
+    # Dynamic state for checkpoints (see checkpoint.py), as arrays or scalars. Subclasses add their own.
+    def get_state(self) -> dict:
+        return {'current_energy': self.current_energy}
+
+    def set_state(self, state: dict):
+        self.current_energy = float(state['current_energy'])
 
     def max_operating_capacity(self, range=None):
         if range is None:
@@ -41,19 +73,7 @@ class EV:
         return max(0, self.max_operating_capacity(range) - self.current_energy)
 
     def minimum_charge_amount(self, t: int) -> float:
-        skips = 0
-        lost_to_driving = 0.0
-        min_charge_amount = 0.0
-        for i in range(1, 4):
-            target = (t + i) % 24
-            if self.driving_schedule[target] != 0.0:
-                # Driving
-                skips += 1
-                lost_to_driving += self.driving_schedule[target]
-            rem = i - skips
-            deficit = self.mdr[target] + lost_to_driving - self.current_energy
-            min_charge_amount = max(min_charge_amount, deficit / (rem+1))
-        return min_charge_amount
+        return self.lookahead.minimum_charge_amount(t, self.current_energy)
 
     def current_energy_percent(self):
          return self.current_energy / self.spec.capacity
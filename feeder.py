@@ -0,0 +1,149 @@
+from clearing import CLEARING_ENGINES
+from market import Bid
+
+# A feeder: a local market for the DERs on one feeder, registered as a single DER on an upstream market
+# (a DoubleAuctionMarketController with the TimeOfUseGrid as its dso, or another FeederMarket).
+# Each tick the feeder's DERs bid with the upstream grid price, and the feeder clears their bids against each other.
+# What's left over is forwarded upstream as at most two bids: the residual demand at the highest unfilled sink price
+# and the residual supply at the lowest unfilled source price. Whatever the upstream market grants those bids is
+# shared out pro rata to the DERs' unfilled amounts, at a price averaging the local and upstream prices by volume.
+# The upstream book only holds two bids per feeder, so clearing cost grows with feeder size, not total population.
+# Local results are whatever the clearing engine grants, partial sink rule included (see clearing.py).
+# Local clearing can run concurrently for every feeder with FeederClearingPlanner.
+class FeederMarket:
+    def __init__(self, clearing='loop'):
+        self.ders = {}
+        self.planners = []
+        self.clear = CLEARING_ENGINES[clearing]
+        self.prepared_t = None
+        self.local_bids = []
+        self.local_price = None
+        self.residual_bids = []
+        self.upstream_results = {}
+
+    def add_der(self, der, name):
+        self.ders[name] = der
+
+    def add_planner(self, planner):
+        self.planners.append(planner)
+
+    # Collects the local bids, clears them and works out the residual bids. Called by make_bid if it hasn't been yet.
+    def prepare(self, t, grid_price):
+        for planner in self.planners:
+            planner.plan(t, grid_price, self.ders.values())
+
+        source_bids: list[Bid] = []
+        sink_bids: list[Bid] = []
+        for d in self.ders.values():
+            bid = d.make_bid(t, grid_price)
+            for b in bid if isinstance(bid, list) else [bid]:
+                if b is None:
+                    continue
+                if b.discharge:
+                    source_bids.append(b)
+                else:
+                    # Clamp the max sink bid to grid price, like the upstream market would.
+                    if grid_price is not None and b.price_per_kwh > grid_price:
+                        b.price_per_kwh = grid_price
+                    sink_bids.append(b)
+
+        # (bid, requested amount, requested price)
+        self.local_bids = [(b, b.amount, b.price_per_kwh) for b in source_bids + sink_bids]
+        self.local_price = None
+        if len(source_bids) > 0 and len(sink_bids) > 0:
+            self.local_price = self.clear(source_bids, sink_bids)
+        else:
+            for b in source_bids + sink_bids:
+                b.amount = 0.0
+
+        self.residual_bids = []
+        for discharge in (False, True):
+            residuals = [(price, self.residual(b, requested)) for b, requested, price in self.local_bids if b.discharge == discharge]
+            residuals = [(price, amount) for price, amount in residuals if amount is None or amount > 0]
+            if len(residuals) == 0:
+                continue
+            prices = [price for price, _ in residuals]
+            amounts = [amount for _, amount in residuals]
+            self.residual_bids.append(Bid(
+                price_per_kwh=min(prices) if discharge else max(prices),
+                amount=None if None in amounts else sum(amounts),
+                discharge=discharge,
+                creator=self,
+            ))
+        self.upstream_results = {}
+        self.prepared_t = t
+
+    # Amount of a local bid left unfilled by local clearing (None if unbounded).
+    def residual(self, bid: Bid, requested):
+        if requested is None:
+            return None
+        return max(requested - bid.amount, 0.0)
+
+    def make_bid(self, t, grid_price):
+        if self.prepared_t != t:
+            self.prepare(t, grid_price)
+        self.prepared_t = None
+        if len(self.residual_bids) == 0:
+            return None
+        # Copies, since the upstream market overwrites them with its results.
+        return [Bid(b.price_per_kwh, b.amount, b.discharge, self) for b in self.residual_bids]
+
+    # A demand and a supply bid.
+    def max_bids(self) -> int:
+        return 2
+
+    def collect_bid_results(self, t, bid: Bid):
+        self.upstream_results[bid.discharge] = (bid.price_per_kwh, bid.amount)
+
+    def post_bid(self, t, price) -> dict:
+        residual_totals = {}
+        for residual_bid in self.residual_bids:
+            residual_totals[residual_bid.discharge] = residual_bid.amount
+
+        imported = 0.0
+        exported = 0.0
+        for b, requested, _ in self.local_bids:
+            local_amount = b.amount
+            local_price = self.local_price if self.local_price is not None else 0.0
+            upstream_price, upstream_amount = self.upstream_results.get(b.discharge, (price, 0.0))
+            residual = self.residual(b, requested)
+            total = residual_totals.get(b.discharge)
+            share = 0.0
+            if upstream_amount and total is not None and total > 0:
+                share = upstream_amount * residual / total
+            elif upstream_amount and residual is None:
+                share = upstream_amount
+
+            amount = local_amount + share
+            b.amount = amount
+            if amount > 0:
+                b.price_per_kwh = (local_amount * local_price + share * upstream_price) / amount
+            else:
+                b.price_per_kwh = self.local_price if self.local_price is not None else upstream_price
+            if b.discharge:
+                exported += share
+            else:
+                imported += share
+            b.creator.collect_bid_results(t, b)
+
+        for d in self.ders.values():
+            d.post_bid(t, price)
+
+        return {
+            'local_price': self.local_price,
+            'imported': imported,
+            'exported': exported,
+        }
+
+# Prepares every FeederMarket on a market at the start of the tick, clearing their local books concurrently
+# on the given executor. Feeders keep their DERs' state in-process, so it needs a ThreadPoolExecutor, and the GIL
+# runs the Python clearing one feeder at a time: this gives concurrency (e.g. with DERs that wait on I/O while
+# bidding), not a speedup over clearing the feeders one by one.
+# Register with DoubleAuctionMarketController.add_planner.
+class FeederClearingPlanner:
+    def __init__(self, executor):
+        self.executor = executor
+
+    def plan(self, t, grid_price, ders):
+        feeders = [d for d in ders if isinstance(d, FeederMarket)]
+        list(self.executor.map(lambda feeder: feeder.prepare(t, grid_price), feeders))
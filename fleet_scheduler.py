@@ -0,0 +1,48 @@
+from schedule import planning_problems, SCHEDULE_SOLVERS, solve_dp, solve_pulp_batch
+
+# Solvers whose problems are batched into the shared LP.
+BATCHED_SOLVERS = {'pulp', 'pulp_optimal'}
+
+# Plans every OptimizedEV on a market with one LP solve instead of one CBC run per vehicle.
+# Register it with DoubleAuctionMarketController.add_planner.
+# Only vehicles solving with CBC (see OptimizedEV.solver_config and BATCHED_SOLVERS) go into the LP, the others are
+# solved with their own solver. Every vehicle's cache is looked up first and gets the result.
+# The LP runs under the scheduler's time_limit rather than the vehicles' own, and only accepts an optimal solution,
+# also for vehicles with accept_infeasible. One infeasible vehicle makes the whole LP infeasible, so if CBC doesn't
+# solve it to optimality every batched vehicle is solved on its own with solve_dp. Vehicles left without a schedule
+# are handed None and fall back to solve_heuristic.
+class FleetScheduler:
+    def __init__(self, time_limit: float = None):
+        self.time_limit = time_limit
+        self.fleet_size = 0
+        self.fallbacks = 0
+
+    def plan(self, t, grid_price, ders):
+        pending = planning_problems(t, ders)
+        self.fleet_size = len(pending)
+        if len(pending) == 0:
+            return
+
+        batch = []
+        for d, problem in pending:
+            solver, _, cache = d.solver_config()
+            found, schedule = (False, None) if cache is None else cache.lookup(problem, solver)
+            if found:
+                self.apply(d, schedule)
+            elif solver in BATCHED_SOLVERS:
+                batch.append((d, problem, solver, cache))
+            else:
+                self.apply(d, SCHEDULE_SOLVERS[solver](problem), problem, solver, cache)
+
+        schedules = solve_pulp_batch([problem for _, problem, _, _ in batch], self.time_limit, require_optimal=True) if len(batch) > 0 else []
+        for (d, problem, solver, cache), schedule in zip(batch, schedules):
+            if schedule is None:
+                schedule = solve_dp(problem)
+            self.apply(d, schedule, problem, solver, cache)
+
+    def apply(self, d, schedule, problem=None, solver=None, cache=None):
+        if cache is not None:
+            cache.store(problem, solver, schedule)
+        if schedule is None:
+            self.fallbacks += 1
+        d.apply_schedule(schedule)
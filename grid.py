@@ -12,6 +12,9 @@ class TimeOfUseGrid:
             creator=self,
         )
 
+    def write_bids(self, t, grid_price, book, creator):
+        book.append(self.prices[t], None, True, creator)
+
     def collect_bid_results(self, t, bid: Bid):
         pass
 
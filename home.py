@@ -1,5 +1,6 @@
 import random
 
+import numpy as np
 from numpy import ndarray
 
 from market import Bid
@@ -12,19 +13,86 @@ class Home:
         self.schedule = schedule
         self.randomness = randomness
     
-    def make_bid(self, t, grid_price):
+    def draw_amount(self, t) -> float:
         offset = self.schedule[t] * self.randomness * random.uniform(-1.0, 1.0)
-        amount = self.schedule[t] + offset
+        return self.schedule[t] + offset
 
+    def make_bid(self, t, grid_price):
         return Bid(
             price_per_kwh=grid_price,
-            amount=amount,
+            amount=self.draw_amount(t),
             discharge=False,
             creator=self,
         )
 
+    def write_bids(self, t, grid_price, book, creator):
+        book.append(grid_price, self.draw_amount(t), False, creator)
+
+    def collect_bid_results(self, t, bid: Bid):
+        pass
+
+    def post_bid(self, t, price):
+        return {}
+
+# A population of Homes stored as arrays, registered on the market as a single DER.
+# schedule is a shared 24 hour load schedule or one row per home, and randomness is shared or one per home.
+# Offsets are drawn from a Generator seeded with (seed, tick number), so each home's draw only depends on the seed,
+# the tick and the home's position: runs are exactly reproducible, and adding homes doesn't change existing homes' draws.
+# With aggregate=True the population submits one bid for its total load, otherwise one bid per home.
+class HomePopulation:
+    def __init__(self, size: int, schedule: list[float], randomness: float, seed: int = 0, aggregate: bool = True):
+        self.size = size
+        self.schedule = np.broadcast_to(np.asarray(schedule, dtype=float), (size, 24)).copy()
+        self.randomness = np.broadcast_to(np.asarray(randomness, dtype=float), (size,)).copy()
+        self.seed = seed
+        self.aggregate = aggregate
+        self.ticks = 0
+        self.amounts = np.zeros(size)
+
+    # Dynamic state for checkpoints, see checkpoint.py. Draws only depend on the seed and the tick count.
+    def get_state(self) -> dict:
+        return {'ticks': self.ticks}
+
+    def set_state(self, state: dict):
+        self.ticks = int(state['ticks'])
+
+    def draw_amounts(self, t) -> ndarray[float]:
+        rng = np.random.default_rng((self.seed, self.ticks))
+        self.ticks += 1
+        offsets = self.schedule[:, t] * self.randomness * rng.uniform(-1.0, 1.0, self.size)
+        return self.schedule[:, t] + offsets
+
+    def make_bid(self, t, grid_price):
+        self.amounts = self.draw_amounts(t)
+        if self.aggregate:
+            return Bid(
+                price_per_kwh=grid_price,
+                amount=float(self.amounts.sum()),
+                discharge=False,
+                creator=self,
+            )
+        return [
+            Bid(
+                price_per_kwh=grid_price,
+                amount=amount,
+                discharge=False,
+                creator=self,
+            )
+            for amount in self.amounts.tolist()
+        ]
+
+    def max_bids(self) -> int:
+        return 1 if self.aggregate else self.size
+
+    def write_bids(self, t, grid_price, book, creator):
+        self.amounts = self.draw_amounts(t)
+        if self.aggregate:
+            book.append(grid_price, self.amounts.sum(), False, creator)
+        else:
+            book.extend(grid_price, self.amounts, False, creator)
+
     def collect_bid_results(self, t, bid: Bid):
         pass
 
     def post_bid(self, t, price):
-        return {}
\ No newline at end of file
+        return {}
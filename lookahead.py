@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# Precomputed lookahead for EV.minimum_charge_amount.
+# The charge an EV needs now to meet the MDR over the next `window` hours only depends on its energy through
+#     max(0, max over i of (mdr[t+i] + driving losses up to t+i - current_energy) / (hours plugged in up to t+i + 1))
+# so for each hour the offsets (mdr plus cumulative driving losses) and divisors are worked out once per
+# (mdr, driving_schedule, window) and shared by every vehicle with those schedules (see lookahead_table).
+# Results are identical to the original loop, the additions happen in the same order.
+# Tables are built when a vehicle is created; vehicles whose mdr or driving schedule change need a new one.
+class LookaheadTable:
+    def __init__(self, mdr: list[float], driving_schedule: list[float], window: int = 3):
+        self.window = window
+        # Per hour, (offset, divisor) for each of the next window hours.
+        self.steps = []
+        for t in range(24):
+            skips = 0
+            lost_to_driving = 0.0
+            steps = []
+            for i in range(1, window + 1):
+                target = (t + i) % 24
+                if driving_schedule[target] != 0.0:
+                    # Driving
+                    skips += 1
+                    lost_to_driving += driving_schedule[target]
+                rem = i - skips
+                steps.append((mdr[target] + lost_to_driving, rem + 1))
+            self.steps.append(tuple(steps))
+        self.offsets = np.array([[offset for offset, _ in steps] for steps in self.steps], dtype=float).reshape(24, window)
+        self.divisors = np.array([[divisor for _, divisor in steps] for steps in self.steps], dtype=float).reshape(24, window)
+
+    def minimum_charge_amount(self, t: int, current_energy: float) -> float:
+        min_charge_amount = 0.0
+        for offset, divisor in self.steps[t]:
+            min_charge_amount = max(min_charge_amount, (offset - current_energy) / divisor)
+        return min_charge_amount
+
+    # Same as minimum_charge_amount for an array of energies.
+    def minimum_charge_amounts(self, t: int, current_energy: np.ndarray) -> np.ndarray:
+        min_charge_amount = np.zeros(len(current_energy))
+        for offset, divisor in self.steps[t]:
+            np.maximum(min_charge_amount, (offset - current_energy) / divisor, out=min_charge_amount)
+        return min_charge_amount
+
+# Tables of the most recently used schedule pairs. Vehicles keep a reference to their table,
+# so an evicted table is only rebuilt for vehicles created afterwards.
+MAX_TABLES = 256
+_TABLES = OrderedDict()
+
+# The shared table for a schedule pair, built on first use.
+def lookahead_table(mdr: list[float], driving_schedule: list[float], window: int = 3) -> LookaheadTable:
+    key = (tuple(float(m) for m in mdr), tuple(float(d) for d in driving_schedule), window)
+    table = _TABLES.get(key)
+    if table is None:
+        table = LookaheadTable(key[0], key[1], window)
+        _TABLES[key] = table
+        if len(_TABLES) > MAX_TABLES:
+            _TABLES.popitem(last=False)
+    else:
+        _TABLES.move_to_end(key)
+    return table
+
+# Lookahead for vehicles with per-vehicle schedules (e.g. RuleBasedEVFleet): one table per distinct
+# (mdr, driving_schedule) row pair, gathered per vehicle each tick. The tables belong to the fleet rather than
+# the shared cache, so fleets with many random schedules don't fill it.
+class FleetLookahead:
+    def __init__(self, mdr: np.ndarray, driving_schedule: np.ndarray, window: int = 3):
+        rows, index = np.unique(np.concatenate((mdr, driving_schedule), axis=1), axis=0, return_inverse=True)
+        if len(rows) == 0:
+            rows = np.zeros((1, 48))
+        self.tables = [LookaheadTable(row[:24], row[24:], window) for row in rows]
+        # Shared schedules don't need gathering.
+        self.index = None if len(self.tables) == 1 else index.reshape(-1)
+        # (24, distinct rows, window)
+        self.offsets = np.stack([table.offsets for table in self.tables], axis=1)
+        self.divisors = np.stack([table.divisors for table in self.tables], axis=1)
+
+    def minimum_charge_amount(self, t: int, current_energy: np.ndarray) -> np.ndarray:
+        if self.index is None:
+            return self.tables[0].minimum_charge_amounts(t, current_energy)
+        offsets = self.offsets[t][self.index]
+        divisors = self.divisors[t][self.index]
+        min_charge_amount = np.zeros(len(current_energy))
+        for i in range(offsets.shape[1]):
+            np.maximum(min_charge_amount, (offsets[:, i] - current_energy) / divisors[:, i], out=min_charge_amount)
+        return min_charge_amount
@@ -1,6 +1,15 @@
-from functools import cmp_to_key
+from functools import partial
+
+import numpy as np
+
+from bid_book import BidBook
+from clearing import CLEARING_ENGINES, clear_book
+from order_book import OrderBook, order_key
+from profiling import traced
 
 class Bid:
+    __slots__ = ('price_per_kwh', 'amount', 'discharge', 'creator')
+
     def __init__(self, price_per_kwh, amount, discharge, creator):
         self.price_per_kwh = price_per_kwh
         self.amount = amount
@@ -29,54 +38,96 @@ class Bid:
         return other.amount - self.amount
 
 class PassiveMarketController:
-    def __init__(self, grid_prices, td):
+    # tracer is an optional profiling.TickTracer, see profiling.py.
+    def __init__(self, grid_prices, td, tracer=None):
         self.grid_prices = grid_prices
         self.td = td
         self.ders = []
         self.t = 0
+        self.tracer = tracer
     
     def add_der(self, der):
         self.ders.append(der)
     
     def run_tick(self):
+        tracer = self.tracer
         source_bids = []
         sink_bids = []
-        for d in self.ders:
-            bid: Bid = d.make_bid(self.t, self.grid_prices[self.t])
-            if bid is None:
-                continue
-            if bid.discharge:
-                source_bids.append(bid)
-            else:
-                sink_bids.append(bid)
+        with traced(tracer, 'bid'):
+            for i, d in enumerate(self.ders):
+                if tracer is None:
+                    bid: Bid = d.make_bid(self.t, self.grid_prices[self.t])
+                else:
+                    # DERs are reported by their position, since they're added without a name.
+                    bid: Bid = tracer.call(i, d, 'make_bid', self.t, self.grid_prices[self.t])
+                if bid is None:
+                    continue
+                if bid.discharge:
+                    source_bids.append(bid)
+                else:
+                    sink_bids.append(bid)
         
-        for b in source_bids:
-            b.price_per_kwh = 0
-            b.amount = 0
-            b.creator.collect_bid_results(self.t, bid)
-        for b in sink_bids:
-            if b.price_per_kwh >= self.grid_prices[self.t]:
-                b.price_per_kwh = self.grid_prices[self.t]
-                b.creator.collect_bid_results(self.t, b)
-            else:
+        with traced(tracer, 'notify'):
+            for b in source_bids:
                 b.price_per_kwh = 0
                 b.amount = 0
-                b.creator.collect_bid_results(self.t, b)
+                self.notify(b.creator, bid)
+            for b in sink_bids:
+                if b.price_per_kwh >= self.grid_prices[self.t]:
+                    b.price_per_kwh = self.grid_prices[self.t]
+                    self.notify(b.creator, b)
+                else:
+                    b.price_per_kwh = 0
+                    b.amount = 0
+                    self.notify(b.creator, b)
         
-        for d in self.ders:
-            d.post_bid(self.t)
+        with traced(tracer, 'post_bid'):
+            for i, d in enumerate(self.ders):
+                if tracer is None:
+                    d.post_bid(self.t)
+                else:
+                    tracer.call(i, d, 'post_bid', self.t)
 
+        if tracer is not None:
+            tracer.end_tick()
         self.t = (self.t + 1) % 24
 
+    def notify(self, creator, bid: Bid):
+        if self.tracer is None:
+            creator.collect_bid_results(self.t, bid)
+        else:
+            self.tracer.call(None, creator, 'collect_bid_results', self.t, bid)
+
+
 class DoubleAuctionMarketController:
-    def __init__(self, dso, td):
+    # clearing selects the engine used to match bids, see CLEARING_ENGINES in clearing.py.
+    # tick_size buckets prices for the 'levels' engine, see clear_levels.
+    # With a bid_book, bids are stored and cleared in the book's arrays instead (see run_book_tick).
+    # With an order_book, bids are kept sorted by price level across ticks (see run_order_book_tick).
+    # tracer is an optional profiling.TickTracer timing each phase of the tick, see profiling.py.
+    def __init__(self, dso, td, clearing='loop', bid_book: BidBook = None, tracer=None, order_book: OrderBook = None, tick_size: float = 0.0):
         self.dso = dso
         self.td = td
         self.ders = {}
         self.t = 0
+        self.clearing = clearing
+        self.clear = CLEARING_ENGINES[clearing]
+        if tick_size > 0:
+            if clearing != 'levels':
+                raise ValueError(f"tick_size only applies to 'levels' clearing, not '{clearing}'.")
+            self.clear = partial(self.clear, tick_size=tick_size)
+        self.planners = []
+        self.bid_book = bid_book
+        self.tracer = tracer
+        self.order_book = order_book
     
     def add_der(self, der, name):
         self.ders[name] = der
+
+    # Planners run before the DERs bid each tick with plan(t, grid_price, ders).
+    # They do expensive work for many DERs at once, e.g. FleetScheduler.
+    def add_planner(self, planner):
+        self.planners.append(planner)
     
     def collect_bid_results(self, t, bid: Bid):
         # We're not currently doing anything with grid bids.
@@ -100,127 +151,224 @@ class DoubleAuctionMarketController:
             sink_bids.append(bid)
         return grid_price
 
+    def plan(self, grid_price):
+        with traced(self.tracer, 'plan'):
+            for planner in self.planners:
+                planner.plan(self.t, grid_price, self.ders.values())
+
     def run_tick(self) -> dict:
+        if self.bid_book is not None:
+            return self.run_book_tick()
+        if self.order_book is not None:
+            return self.run_order_book_tick()
+
+        tracer = self.tracer
         source_bids: list[Bid] = []
         sink_bids: list[Bid] = []
 
         if self.dso is not None:
-            dso_bid = self.dso.make_bid(self.t, None)
-            grid_price = self.add_bid(source_bids, sink_bids, dso_bid, None)
+            with traced(tracer, 'bid'):
+                dso_bid = self.dso.make_bid(self.t, None)
+                grid_price = self.add_bid(source_bids, sink_bids, dso_bid, None)
+
+        self.plan(grid_price)
 
-        for d in self.ders.values():
-            bid: Bid = d.make_bid(self.t, grid_price)
-            self.add_bid(source_bids, sink_bids, bid, grid_price)
+        with traced(tracer, 'bid'):
+            for name, d in self.ders.items():
+                if tracer is None:
+                    bid: Bid = d.make_bid(self.t, grid_price)
+                else:
+                    bid: Bid = tracer.call(name, d, 'make_bid', self.t, grid_price)
+                if isinstance(bid, list):
+                    # DERs standing in for many devices (e.g. RuleBasedEVFleet) bid once per device.
+                    for b in bid:
+                        self.add_bid(source_bids, sink_bids, b, grid_price)
+                else:
+                    self.add_bid(source_bids, sink_bids, bid, grid_price)
 
-        # Double-Auction logic from Wikipedia (average mechanism):
-        # https://en.wikipedia.org/wiki/Double_auction
-        # Below is a modified version of that algorithm with the following changes:
-        # 1. Bids are weighted by the amount of energy the bid calls for. Fractional fulfillment is allowed.
-        # 2. All sink (load) bids are fulfilled - the grid compensates for the extra load by supplying power at grid price.
-        #    This grid-priced power is factored into the average price.
+        price = self.settle(source_bids, sink_bids, self.clear)
+        self.post_bid(price)
+
+        return {
+            'price': price,
+            'grid_price': grid_price,
+            'sources_total': len(source_bids),
+            'sinks_total': len(sink_bids),
+        }
+
+    # Clears the tick's bids and notifies their creators, returning the price.
+    # clear(source_bids, sink_bids, tracer) is only called when there are both sources and sinks.
+    def settle(self, source_bids: list[Bid], sink_bids: list[Bid], clear) -> float:
+        tracer = self.tracer
+
+        # See clearing.py for the double-auction logic.
 
         price = None
         if len(sink_bids) == 0:
             # This breaks the double-auction logic, just manually deny all bids.
             price = min(b.price_per_kwh for b in source_bids)
-            for b in source_bids:
-                b.price_per_kwh = price
-                b.amount = 0.0
-                b.creator.collect_bid_results(self.t, b)
+            with traced(tracer, 'notify'):
+                for b in source_bids:
+                    b.price_per_kwh = price
+                    b.amount = 0.0
+                    self.notify(b.creator, b)
         elif len(source_bids) == 0:
             # This breaks the double-auction logic, just manually deny all bids.
             price = max(b.price_per_kwh for b in sink_bids)
             for b in source_bids:
                 b.price_per_kwh = price
                 b.amount = 0.0
-                b.creator.collect_bid_results(self.t, b)
+                self.notify(b.creator, b)
         else:
-            sink_bids.sort(key=cmp_to_key(lambda a, b: a.compare_to(b))) # TODO does this need to be reversed?
-            source_bids.sort(key=cmp_to_key(lambda a, b: a.compare_to(b)), reverse=True)
-
-            # print("SINKS:")
-            # for b in sink_bids:
-            #     print(b.price_per_kwh)
-            # print('SOURCES:')
-            # for b in source_bids:
-            #     print(b.price_per_kwh)
-
-            source_index = 0
-            source_taken = 0.0
-            sink_index = 0
-            sink_taken = 0.0
-            # print(f'> RUNNING TICK WITH {len(sink_bids)} sinks and {len(source_bids)} bids:')
-            while sink_index < len(sink_bids) and source_index < len(source_bids) and sink_bids[sink_index].price_per_kwh >= source_bids[source_index].price_per_kwh:
-                # print(f'=> With sink {sink_index} ({sink_taken}) and source {source_index} ({source_taken})')
-                source_rem = None
-                sink_rem = None
-                if source_bids[source_index].amount is not None:
-                    source_rem = source_bids[source_index].amount - source_taken
-                if sink_bids[sink_index].amount is not None:
-                    sink_rem = sink_bids[sink_index].amount - sink_taken
-                
-                if sink_rem == source_rem:
-                    # print('==> BOTH INC')
-                    # Sink and source balance out - increment both.
-                    source_taken = 0.0
-                    source_index += 1
-                    sink_taken = 0.0
-                    sink_index += 1
-                elif source_rem is None or sink_rem < source_rem:
-                    # print('==> SINK INC')
-                    # Sink is full, source is partially full.
-                    source_taken += sink_rem
-                    sink_taken = 0.0
-                    sink_index += 1
-                else:
-                    # print('==> SOURCE INC')
-                    # Source is full, sink is partially full.
-                    source_taken = 0.0
-                    source_index += 1
-                    sink_taken += source_rem
-
-            # print(f'{sink_index} {source_index}')
-            price = (sink_bids[sink_index-1].price_per_kwh + source_bids[source_index-1].price_per_kwh) / 2
+            price = clear(source_bids, sink_bids, tracer)
 
             # Notifying the DERs of their bid results
 
-            for i, b in enumerate(source_bids):
-                if i == source_index and source_taken > 0:
-                    # The final bid is partially full.
-                    b.price_per_kwh = price
-                    b.amount = source_taken
-                elif i < source_index:
-                    # All less than index are guaranteed to be full.
-                    b.price_per_kwh = price
-                else:
-                    # The rest are not fulfilled.
-                    b.price_per_kwh = price
-                    b.amount = 0.0
-                b.creator.collect_bid_results(self.t, b)
+            with traced(tracer, 'notify'):
+                for b in source_bids:
+                    self.notify(b.creator, b)
+                for b in sink_bids:
+                    self.notify(b.creator, b)
+        return price
 
-            for i, b in enumerate(sink_bids):
-                if i == sink_index and sink_taken > 0:
-                    # The final bid is partially full.
-                    b.price_per_kwh = price
-                    b.amount = source_taken
-                elif i < sink_index:
-                    # All less than index are guaranteed to be full.
-                    b.price_per_kwh = price
-                else:
-                    # The rest are not fulfilled.
-                    b.price_per_kwh = price
-                    b.amount = 0.0
-                b.creator.collect_bid_results(self.t, b)
+    # Same as run_tick, but bids are kept in self.order_book across ticks and cleared there.
+    def run_order_book_tick(self) -> dict:
+        tracer = self.tracer
+        book = self.order_book
+        book.begin_tick()
+        source_bids: list[Bid] = []
+        sink_bids: list[Bid] = []
 
-        for d in self.ders.values():
-            d.post_bid(self.t, price)
-        self.dso.post_bid(self.t, price)
+        grid_price = None
+        if self.dso is not None:
+            with traced(tracer, 'bid'):
+                dso_bid = self.dso.make_bid(self.t, None)
+                grid_price = self.add_bid(source_bids, sink_bids, dso_bid, None)
+                if dso_bid is not None:
+                    book.update(order_key(-1, 0), dso_bid)
 
-        self.t = (self.t + 1) % 24
+        self.plan(grid_price)
+
+        with traced(tracer, 'bid'):
+            for i, (name, d) in enumerate(self.ders.items()):
+                if tracer is None:
+                    bid = d.make_bid(self.t, grid_price)
+                else:
+                    bid = tracer.call(name, d, 'make_bid', self.t, grid_price)
+                if not isinstance(bid, list):
+                    bid = [bid]
+                for j, b in enumerate(bid):
+                    if b is not None:
+                        # add_bid clamps sink prices before the book sees them.
+                        self.add_bid(source_bids, sink_bids, b, grid_price)
+                        book.update(order_key(i, j), b)
+            book.end_tick()
+
+        price = self.settle(source_bids, sink_bids, lambda sources, sinks, tracer: book.clear(tracer))
+        self.post_bid(price)
 
         return {
             'price': price,
             'grid_price': grid_price,
             'sources_total': len(source_bids),
             'sinks_total': len(sink_bids),
-        }
\ No newline at end of file
+        }
+
+    def notify(self, creator, bid):
+        if self.tracer is None:
+            creator.collect_bid_results(self.t, bid)
+        else:
+            self.tracer.call(None, creator, 'collect_bid_results', self.t, bid)
+
+    # Ends the tick: every DER and the DSO get the price, then the clock moves on.
+    def post_bid(self, price):
+        tracer = self.tracer
+        with traced(tracer, 'post_bid'):
+            for name, d in self.ders.items():
+                if tracer is None:
+                    d.post_bid(self.t, price)
+                else:
+                    tracer.call(name, d, 'post_bid', self.t, price)
+            self.dso.post_bid(self.t, price)
+
+        if tracer is not None:
+            tracer.end_tick()
+        self.t = (self.t + 1) % 24
+
+    # Adds a DER's bids to the bid book.
+    # DERs implementing write_bids(t, grid_price, book, creator) append rows themselves under the given creator index,
+    # the rest are asked for Bid objects with make_bid.
+    def write_bids(self, der, grid_price, name=None):
+        method = 'make_bid'
+        args = (self.t, grid_price)
+        if hasattr(der, 'write_bids'):
+            method = 'write_bids'
+            args = (self.t, grid_price, self.bid_book, self.bid_book.register(der))
+
+        if self.tracer is None:
+            result = getattr(der, method)(*args)
+        else:
+            result = self.tracer.call(name, der, method, *args)
+        if method == 'make_bid':
+            self.bid_book.add_bid(result)
+
+    # Sends the results of the given book rows to their creators as BidViews.
+    def notify_rows(self, rows: np.ndarray):
+        book = self.bid_book
+        for row in rows.tolist():
+            self.notify(book.creators[book.creator[row]], book.view(row))
+
+    # Same as run_tick, but the bids live in self.bid_book and are cleared with clear_book.
+    def run_book_tick(self) -> dict:
+        tracer = self.tracer
+        book = self.bid_book
+        book.clear()
+
+        grid_price = None
+        if self.dso is not None:
+            with traced(tracer, 'bid'):
+                self.write_bids(self.dso, None)
+                for row in range(book.size):
+                    if book.discharge[row] and np.isinf(book.amount[row]) and (grid_price is None or book.price[row] < grid_price):
+                        grid_price = book.price[row]
+        dso_rows = book.size
+
+        self.plan(grid_price)
+
+        with traced(tracer, 'bid'):
+            for name, d in self.ders.items():
+                self.write_bids(d, grid_price, name)
+
+            # Clamp the max sink bid to grid price.
+            der_prices = book.price[dso_rows:book.size]
+            der_sinks = ~book.discharge[dso_rows:book.size]
+            der_prices[der_sinks] = np.minimum(der_prices[der_sinks], grid_price)
+
+            source_rows = np.flatnonzero(book.discharge[:book.size])
+            sink_rows = np.flatnonzero(~book.discharge[:book.size])
+
+        price = None
+        if len(sink_rows) == 0:
+            # This breaks the double-auction logic, just manually deny all bids.
+            price = book.price[source_rows].min()
+            book.price[source_rows] = price
+            book.amount[source_rows] = 0.0
+            with traced(tracer, 'notify'):
+                self.notify_rows(source_rows)
+        elif len(source_rows) == 0:
+            # This breaks the double-auction logic, just manually deny all bids.
+            price = book.price[sink_rows].max()
+        else:
+            price, source_rows, sink_rows = clear_book(book, source_rows, sink_rows, tracer)
+            with traced(tracer, 'notify'):
+                self.notify_rows(source_rows)
+                self.notify_rows(sink_rows)
+
+        self.post_bid(price)
+
+        return {
+            'price': price,
+            'grid_price': grid_price,
+            'sources_total': len(source_rows),
+            'sinks_total': len(sink_rows),
+        }
@@ -1,57 +1,159 @@
+from functools import partial
+
 import numpy as np
-from pulp import LpProblem, lpSum, LpVariable, PULP_CBC_CMD
 
 from ev import EV, EVSpec
 from market import Bid
+from schedule import ScheduleModel, ScheduleProblem, schedule_policy, SCHEDULE_SOLVERS, solve_heuristic, TIME_LIMITED_SOLVERS
+from schedule_cache import ScheduleCache
 
 class OptimizedEV(EV):
     def __init__(self,
                  spec: EVSpec,
                  mdr: list[float],
                  driving_schedule: list[float],
-                 history: list[int]):
+                 history: list[int],
+                 solver: str = 'pulp',
+                 cache: ScheduleCache = None,
+                 time_limit: float = None,
+                 replan_threshold: float = None,
+                 accept_infeasible: bool = False):
         super().__init__(spec, mdr, driving_schedule)
         self.schedule = np.zeros(24)
         self.history = history
+        # See SCHEDULE_SOLVERS in schedule.py.
+        self.solver = solver
+        # Schedules CBC doesn't prove optimal (infeasible, or out of time) fall back to solve_heuristic,
+        # unless accept_infeasible keeps the values CBC reports for them like the original 'pulp' solver.
+        # solver_name is the entry of SCHEDULE_SOLVERS that behaves like this vehicle's solver.
+        self.solver_name = 'pulp_optimal' if solver == 'pulp' and not accept_infeasible else solver
+        self.solve = SCHEDULE_SOLVERS[self.solver_name]
+        if solver in ('pulp', 'pulp_optimal'):
+            # The vehicle's LP is built once and updated in place every day.
+            self.solve = ScheduleModel(require_optimal=self.solver_name == 'pulp_optimal')
+        # Seconds allowed per solve, for the solvers in TIME_LIMITED_SOLVERS.
+        self.time_limit = time_limit
+        if time_limit is not None:
+            if solver not in TIME_LIMITED_SOLVERS:
+                raise ValueError(f"time_limit doesn't apply to the '{solver}' solver.")
+            self.solve = partial(self.solve, time_limit=time_limit)
+        # Solves that gave no optimal schedule (infeasible, or out of time) and fell back to solve_heuristic.
+        self.fallbacks = 0
+        # Optional ScheduleCache shared with other vehicles.
+        self.cache = cache
+        self.schedule_presolved = False
+        # With a replan_threshold (kWh), the rest of the day is re-planned whenever the energy at the start of an hour
+        # is further than that from the plan's (partial fills, missed bids...). Re-plans follow the SchedulePolicy of
+        # the day (see schedule.py), worked out on the first re-plan and reused until midnight, so every re-plan
+        # after that is a single pass over the remaining hours.
+        self.replan_threshold = replan_threshold
+        self.planned_energy = None
+        # None until worked out, False if the rest of the day turned out infeasible.
+        self.policy = None
+        self.replans = 0
     
+    def get_state(self) -> dict:
+        return super().get_state() | {
+            'schedule': np.asarray(self.schedule, dtype=float),
+            'history': np.asarray(self.history, dtype=float),
+            'schedule_presolved': self.schedule_presolved,
+            'planned_energy': np.full(25, np.nan) if self.planned_energy is None else self.planned_energy,
+            'fallbacks': self.fallbacks,
+            'replans': self.replans,
+        }
+
+    def set_state(self, state: dict):
+        super().set_state(state)
+        self.schedule = np.array(state['schedule'], dtype=float)
+        if isinstance(self.history, np.ndarray):
+            self.history[:] = state['history']
+        else:
+            self.history = [float(h) for h in state['history']]
+        self.schedule_presolved = bool(state['schedule_presolved'])
+        planned_energy = np.array(state['planned_energy'], dtype=float)
+        self.planned_energy = None if np.isnan(planned_energy).all() else planned_energy
+        self.policy = None
+        self.fallbacks = int(state['fallbacks'])
+        self.replans = int(state['replans'])
+
+    def schedule_problem(self) -> ScheduleProblem:
+        return ScheduleProblem(
+            history=self.history,
+            mdr=self.mdr,
+            driving_schedule=self.driving_schedule,
+            current_energy=self.current_energy,
+            energy_range=(self.min_operating_capacity(), self.max_operating_capacity()),
+        )
+
     def update_model(self):
-        model = LpProblem('ChargeSchedule')
-
-        # Adding charge rate (c) and current energy (E) variables
-        charge_vars = []
-        for i in range(24):
-            charge_vars.append(LpVariable(f'c_{i}', -10, 10))
-        energy_vars = []
-        for i in range(25):
-            energy_vars.append(LpVariable(f'E_{i}', self.min_operating_capacity(), self.max_operating_capacity()))
-        
-        # Adding an objective
-        model += lpSum(charge_vars[i] * self.history[i] for i in range(24)) # TODO is this minimizing or maximizing?
+        problem = self.schedule_problem()
+        if self.cache is not None:
+            schedule = self.cache.solve(problem, self.solve, self.solver_name)
+        else:
+            schedule = self.solve(problem)
+        self.set_plan(self.or_fallback(schedule, problem))
 
-        # Start condition
-        model += (energy_vars[0] == self.current_energy, 'start_energy')
+    def or_fallback(self, schedule, problem: ScheduleProblem):
+        if schedule is None:
+            schedule = solve_heuristic(problem)
+            self.fallbacks += 1
+        return schedule
 
-        # MDR conditions
-        for i in range(24):
-            model += (energy_vars[i+1] >= self.mdr[i], f'mdr_{i}')
+    # How planners solving this vehicle's problem for it should solve it: (SCHEDULE_SOLVERS name, time limit, cache).
+    # Cache entries are keyed on the solver name.
+    def solver_config(self) -> tuple[str, float, ScheduleCache]:
+        return self.solver_name, self.time_limit, self.cache
 
-        # Constraints on energy logic
-        for i in range(24):
-            if self.driving_schedule[i] == 0.0:
-                # Car is plugged in, let it charge/discharge.
-                model += (energy_vars[i+1] == energy_vars[i] + charge_vars[i], f'energy_logic_{i}')
-            else:
-                # Car is not plugged in, simulate driving.
-                model += (energy_vars[i+1] == energy_vars[i] - self.driving_schedule[i], f'energy_logic_{i}')
-                model += (charge_vars[i] == 0)
+    # Returns the problem that needs solving before bidding at time t, if any.
+    # Planners (e.g. FleetScheduler) can solve it ahead of time and hand the result to apply_schedule.
+    def planning_problem(self, t) -> ScheduleProblem:
+        if t != 0:
+            return None
+        return self.schedule_problem()
+
+    # A planner that couldn't solve the problem hands None, which falls back to solve_heuristic like update_model.
+    def apply_schedule(self, schedule):
+        self.set_plan(self.or_fallback(schedule, self.schedule_problem()))
+        self.schedule_presolved = True
+
+    # Starts following a new day's schedule from the current energy.
+    def set_plan(self, schedule):
+        self.schedule = schedule
+        self.policy = None
+        self.planned_energy = self.current_energy + np.concatenate(([0.0], np.cumsum(self.planned_moves(0))))
 
-        model.solve(PULP_CBC_CMD(msg=0)) # Argument is to disable logging to stdout.
-        solution = {v.name: v.value() for v in model.variables()}
-        self.schedule = [solution[f'c_{i}'] for i in range(24)]
+    # Planned change in energy of every hour from t on.
+    def planned_moves(self, t: int) -> np.ndarray:
+        driving = np.asarray(self.driving_schedule[t:], dtype=float)
+        return np.where(driving == 0.0, np.asarray(self.schedule[t:], dtype=float), -driving)
 
-    def make_bid(self, t, grid_price):
+    def needs_replan(self, t: int) -> bool:
+        if self.replan_threshold is None or self.planned_energy is None:
+            return False
+        return abs(self.current_energy - self.planned_energy[t]) > self.replan_threshold
+
+    # Re-plans hours t..23 from the current energy.
+    # Does nothing if the rest of the day is infeasible, and keeps following the plan until midnight.
+    def replan(self, t: int):
+        if self.policy is None:
+            # Hours t..23 of today's prices are still in history, so this is the policy of today's plan.
+            self.policy = schedule_policy(self.schedule_problem()) or False
+        if self.policy is False:
+            return
+        schedule = np.array(self.schedule, dtype=float)
+        schedule[t:] = self.policy.schedule_from(t, self.current_energy)
+        self.schedule = schedule
+        self.planned_energy[t:] = self.current_energy + np.concatenate(([0.0], np.cumsum(self.planned_moves(t))))
+        self.replans += 1
+
+    def decide_bid(self, t, grid_price):
         if t == 0:
-            self.update_model()
+            if self.schedule_presolved:
+                self.schedule_presolved = False
+            else:
+                self.update_model()
+        elif self.needs_replan(t):
+            self.replan(t)
 
         next = (t + 1) % 24
         min_charge_amount = self.minimum_charge_amount(t)
@@ -61,30 +163,15 @@ class OptimizedEV(EV):
             # We bid at grid price because we want to charge regardless of the price.
             # The bid gets clamped up so that it always hits MDR. Should we clamp up to E[t+1] instead?
             # Notably not E[next] because an E[25] exists.
-            return Bid(
-                price_per_kwh=grid_price,
-                amount=min(self.schedule[t], self.spec.charge_rate_max, self.left_to_charge()),
-                discharge=False,
-                creator=self,
-            )
+            return (grid_price, min(self.schedule[t], self.spec.charge_rate_max, self.left_to_charge()), False)
         elif min_charge_amount > 0.0:
             # The EV needs to meet its charging goals.
-            return Bid(
-                price_per_kwh=grid_price,
-                amount=min(self.spec.charge_rate_max, min_charge_amount),
-                discharge=False,
-                creator=self,
-            )
+            return (grid_price, min(self.spec.charge_rate_max, min_charge_amount), False)
         elif self.schedule[t] < 0.0:
             # Discharging
             # We bid at 0 because we want to discharge regardless of the price.
             # Would it be better to bid at some minimum? Like 80% of the on-peak rate? Or some percentile of the history?
-            return Bid(
-                price_per_kwh=0.0,
-                amount=min(self.schedule[t] * -1, self.current_energy - self.mdr[next]),
-                discharge=True,
-                creator=self,
-            )
+            return (0.0, min(self.schedule[t] * -1, self.current_energy - self.mdr[next]), True)
         return None
     
     def collect_bid_results(self, t, bid: Bid):
@@ -99,6 +186,8 @@ class OptimizedEV(EV):
         self.determine_energy_transfer(1, 'discharge', amount=self.driving_schedule[t])
         stats = {
             'history': old_hist,
-            'schedule': self.schedule[t]
+            'schedule': self.schedule[t],
+            'fallbacks': self.fallbacks,
+            'replans': self.replans,
         }
         return stats | self.get_current_stats(t)
\ No newline at end of file
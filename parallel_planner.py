@@ -0,0 +1,51 @@
+from concurrent.futures import Executor
+
+from schedule import planning_problems, ScheduleProblem, SCHEDULE_SOLVERS
+
+# Solves the planning problems of all DERs on a market concurrently before they bid.
+# Register it with DoubleAuctionMarketController.add_planner. With a ProcessPoolExecutor the midnight solves
+# scale with the number of cores: only the ScheduleProblem goes to the workers and only the schedule comes back.
+# Every problem is solved the way its DER would solve it (see OptimizedEV.solver_config): with its solver and
+# time limit, looking it up in its cache first and storing the result there. Problems the solver gives no schedule
+# for are handed to the DER as None, and it falls back to solve_heuristic. The counters add up over every tick planned.
+class ParallelPlanner:
+    def __init__(self, executor: Executor, chunksize: int = 1):
+        self.executor = executor
+        self.chunksize = chunksize
+        self.planned = 0
+        self.fallbacks = 0
+
+    def plan(self, t, grid_price, ders):
+        pending = planning_problems(t, ders)
+        self.planned += len(pending)
+        if len(pending) == 0:
+            return
+
+        unsolved = []
+        for d, problem in pending:
+            solver, time_limit, cache = d.solver_config()
+            found, schedule = (False, None) if cache is None else cache.lookup(problem, solver)
+            if found:
+                self.apply(d, schedule)
+            else:
+                unsolved.append((d, problem, solver, time_limit, cache))
+
+        solvers = [solver for _, _, solver, _, _ in unsolved]
+        problems = [problem for _, problem, _, _, _ in unsolved]
+        time_limits = [time_limit for _, _, _, time_limit, _ in unsolved]
+        schedules = self.executor.map(solve_schedule, solvers, problems, time_limits, chunksize=self.chunksize)
+        for (d, problem, solver, _, cache), schedule in zip(unsolved, schedules):
+            if cache is not None:
+                cache.store(problem, solver, schedule)
+            self.apply(d, schedule)
+
+    def apply(self, d, schedule):
+        if schedule is None:
+            self.fallbacks += 1
+        d.apply_schedule(schedule)
+
+# Module level so that process pools can pickle it.
+def solve_schedule(solver: str, problem: ScheduleProblem, time_limit: float = None):
+    if time_limit is None:
+        return SCHEDULE_SOLVERS[solver](problem)
+    return SCHEDULE_SOLVERS[solver](problem, time_limit=time_limit)
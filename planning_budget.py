@@ -0,0 +1,58 @@
+import time
+
+from schedule import planning_problems, SCHEDULE_SOLVERS, TIME_LIMITED_SOLVERS
+
+# Bounds the time spent planning each tick: solves the DERs' planning problems one by one until `budget` seconds
+# have passed, and hands the rest None so they fall back to solve_heuristic (counted in the DER's own fallbacks too).
+# Every problem is solved the way its DER would solve it (see OptimizedEV.solver_config), looking it up in the DER's
+# cache first and storing the result there. Solvers in TIME_LIMITED_SOLVERS are limited to the DER's time limit,
+# the planner's time_limit if given, and never more than what's left of the budget.
+# Problems the solver gives no schedule for (infeasible, or out of time) are handed None too.
+# Register it with DoubleAuctionMarketController.add_planner. The counters add up over every tick planned.
+class PlanningBudget:
+    def __init__(self, budget: float, time_limit: float = None):
+        self.budget = budget
+        self.time_limit = time_limit
+        self.solved = 0
+        self.failed = 0
+        self.over_budget = 0
+        self.seconds = 0.0
+
+    def plan(self, t, grid_price, ders):
+        pending = planning_problems(t, ders)
+        if len(pending) == 0:
+            return
+
+        start = time.perf_counter()
+        for d, problem in pending:
+            solver, time_limit, cache = d.solver_config()
+            found, schedule = (False, None) if cache is None else cache.lookup(problem, solver)
+            remaining = self.budget - (time.perf_counter() - start)
+            if not found and remaining <= 0:
+                self.over_budget += 1
+            else:
+                if not found:
+                    schedule = self.solve_within(problem, solver, time_limit, remaining)
+                    if cache is not None:
+                        cache.store(problem, solver, schedule)
+                if schedule is None:
+                    self.failed += 1
+                else:
+                    self.solved += 1
+            d.apply_schedule(schedule)
+        self.seconds += time.perf_counter() - start
+
+    def solve_within(self, problem, solver: str, time_limit: float, remaining: float):
+        if solver not in TIME_LIMITED_SOLVERS:
+            return SCHEDULE_SOLVERS[solver](problem)
+        limits = [limit for limit in (time_limit, self.time_limit) if limit is not None]
+        return SCHEDULE_SOLVERS[solver](problem, time_limit=min(limits + [remaining]))
+
+    def get_stats(self) -> dict:
+        return {
+            'solved': self.solved,
+            'failed': self.failed,
+            'over_budget': self.over_budget,
+            'fallbacks': self.failed + self.over_budget,
+            'seconds': self.seconds,
+        }
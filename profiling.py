@@ -0,0 +1,109 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+# Per-phase timing for market ticks.
+# Markets hold a tracer (None by default). When it's None every phase is entered through a shared nullcontext
+# and DER methods are called directly, so untraced runs pay one attribute check per phase and per DER call.
+# Phases: 'plan', 'bid', 'sort', 'match', 'notify', 'post_bid'.
+# Example:
+#     tracer = TickTracer()
+#     with tracer.attach(market):
+#         for _ in range(24):
+#             market.run_tick()
+#     print(tracer.report())
+
+_UNTRACED = nullcontext()
+
+# Returns the context to time a phase in, or a no-op context when tracer is None.
+def traced(tracer, phase: str):
+    if tracer is None:
+        return _UNTRACED
+    return tracer.phase(phase)
+
+# The type a DER is reported under. Wrappers (e.g. RecordingWrapper) are reported as the DER they wrap.
+def der_type(der) -> str:
+    while hasattr(der, 'der'):
+        der = der.der
+    return type(der).__name__
+
+class TickTracer:
+    def __init__(self):
+        self.ticks = 0
+        # Totals are [wall seconds, CPU seconds, calls].
+        self.phases = {}
+        # Keyed by (DER type, method).
+        self.der_types = {}
+        # Keyed by DER name.
+        self.der_names = {}
+        # Names of the DERs seen so far by id, so results can be attributed when only the creator is known.
+        self.names = {}
+
+    @contextmanager
+    def attach(self, market):
+        previous = market.tracer
+        market.tracer = self
+        try:
+            yield self
+        finally:
+            market.tracer = previous
+
+    @contextmanager
+    def phase(self, name: str):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            _add(self.phases, name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    # Calls der.<method>(*args) and attributes the time to the DER's type and name.
+    # name can be None for DERs that were already called with their name this tick (e.g. when notifying bid creators).
+    def call(self, name, der, method: str, *args):
+        if name is None:
+            name = self.names.get(id(der))
+        else:
+            self.names[id(der)] = name
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        result = getattr(der, method)(*args)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        _add(self.der_types, (der_type(der), method), wall, cpu)
+        if name is not None:
+            _add(self.der_names, name, wall, cpu)
+        return result
+
+    def end_tick(self):
+        self.ticks += 1
+
+    # The n DERs with the most wall time, as (name, wall seconds) pairs.
+    def slowest_ders(self, n: int = 10) -> list[tuple]:
+        totals = sorted(self.der_names.items(), key=lambda item: item[1][0], reverse=True)
+        return [(name, total[0]) for name, total in totals[:n]]
+
+    def report(self, slowest: int = 10) -> dict:
+        return {
+            'ticks': self.ticks,
+            'phases': {name: _totals(total) for name, total in self.phases.items()},
+            'der_types': {f'{kind}.{method}': _totals(total) for (kind, method), total in self.der_types.items()},
+            'slowest_ders': self.slowest_ders(slowest),
+        }
+
+    def reset(self):
+        self.ticks = 0
+        self.phases.clear()
+        self.der_types.clear()
+        self.der_names.clear()
+        self.names.clear()
+
+def _add(totals: dict, key, wall: float, cpu: float):
+    total = totals.get(key)
+    if total is None:
+        totals[key] = [wall, cpu, 1]
+    else:
+        total[0] += wall
+        total[1] += cpu
+        total[2] += 1
+
+def _totals(total: list) -> dict:
+    return {'wall': total[0], 'cpu': total[1], 'calls': total[2]}
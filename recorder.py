@@ -0,0 +1,208 @@
+import json
+import os
+
+import numpy as np
+
+from recording_wrapper import RecordingWrapper
+from rule_based_ev import ACTIONS
+
+# Per-DER columns: (dtype, value when the DER didn't report it).
+DER_FIELDS = {
+    'cost': (np.float64, 0.0),
+    'granted_amount': (np.float64, np.nan),
+    'current_energy': (np.float64, np.nan),
+    'meeting_next_mdr': (np.int8, -1),
+    'action': (np.int8, -1),
+}
+
+# Per-tick market columns, taken from the stats returned by run_tick.
+TICK_FIELDS = {
+    'price': (np.float64, np.nan),
+    'grid_price': (np.float64, np.nan),
+}
+
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+# Records per-DER stats into preallocated (ticks, DERs) buffers and writes them to disk in chunks,
+# so memory stays bounded no matter how long the simulation runs.
+# Each chunk is a directory of .npy files, one per column, which RecordingReader loads lazily.
+# Wrap DERs in StreamingRecordingWrapper and call end_tick with the market stats after every run_tick.
+# DERs standing for several devices (RuleBasedEVFleet) get one column per member, named <name>/<i>, by passing
+# members={name: count}. They must report per-member arrays in their stats (cost and granted_amount included),
+# since bid results can't be told apart by member.
+class ColumnarRecorder:
+    def __init__(self, directory: str, names: list[str], chunk_ticks: int = 24 * 7, members: dict[str, int] = None):
+        self.directory = directory
+        members = members or {}
+        self.names = []
+        # Column of every DER, or slice of columns for DERs with members.
+        self.indices = {}
+        for name in names:
+            if name in members:
+                start = len(self.names)
+                self.names.extend(f'{name}/{i}' for i in range(members[name]))
+                self.indices[name] = slice(start, len(self.names))
+            else:
+                self.indices[name] = len(self.names)
+                self.names.append(name)
+        self.chunk_ticks = chunk_ticks
+        self.chunk_sizes = []
+        self.row = 0
+        self.buffers = {}
+        for field, (dtype, fill) in DER_FIELDS.items():
+            self.buffers[field] = np.full((chunk_ticks, len(self.names)), fill, dtype=dtype)
+        for field, (dtype, fill) in TICK_FIELDS.items():
+            self.buffers[field] = np.full(chunk_ticks, fill, dtype=dtype)
+        os.makedirs(directory, exist_ok=True)
+
+    def wrap(self, der, name: str) -> 'StreamingRecordingWrapper':
+        if name not in self.indices:
+            raise ValueError(f'{name} is not one of the recorded DERs.')
+        return StreamingRecordingWrapper(der, self, name)
+
+    def set(self, field: str, index: int, value):
+        self.buffers[field][self.row, index] = value
+
+    # Adds to the value recorded so far this tick, a field that wasn't reported yet counts as 0.
+    def add(self, field: str, index: int, value):
+        current = self.buffers[field][self.row, index]
+        self.buffers[field][self.row, index] = value if np.isnan(current) else current + value
+
+    # The fields recorded so far this tick for a single-column DER, keyed like RecordingWrapper.post_bid_stats.
+    def current(self, name: str) -> dict:
+        index = self.indices[name]
+        meeting_next_mdr = int(self.buffers['meeting_next_mdr'][self.row, index])
+        action = int(self.buffers['action'][self.row, index])
+        return {
+            'cost': float(self.buffers['cost'][self.row, index]),
+            'granted_amount': float(self.buffers['granted_amount'][self.row, index]),
+            'current_energy': float(self.buffers['current_energy'][self.row, index]),
+            'meeting_next_mdr': None if meeting_next_mdr == -1 else bool(meeting_next_mdr),
+            'last_action': None if action == -1 else ACTIONS[action],
+        }
+
+    def end_tick(self, tick_stats: dict):
+        for field in TICK_FIELDS:
+            value = tick_stats.get(field)
+            if value is not None:
+                self.buffers[field][self.row] = value
+        self.row += 1
+        if self.row == self.chunk_ticks:
+            self.flush()
+
+    def flush(self):
+        if self.row == 0:
+            return
+        chunk_dir = os.path.join(self.directory, f'chunk_{len(self.chunk_sizes):05d}')
+        os.makedirs(chunk_dir, exist_ok=True)
+        for field, buffer in self.buffers.items():
+            np.save(os.path.join(chunk_dir, f'{field}.npy'), buffer[:self.row])
+            buffer.fill((DER_FIELDS | TICK_FIELDS)[field][1])
+        self.chunk_sizes.append(self.row)
+        self.row = 0
+        self.write_meta()
+
+    def close(self):
+        self.flush()
+        self.write_meta()
+
+    def write_meta(self):
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump({
+                'names': self.names,
+                'chunk_sizes': self.chunk_sizes,
+                'actions': ACTIONS,
+            }, f)
+
+# A RecordingWrapper that writes into a ColumnarRecorder instead of building a stats dict every tick.
+# post_bid_stats is left empty, post_bid still returns the wrapped DER's stats.
+class StreamingRecordingWrapper(RecordingWrapper):
+    def __init__(self, der, recorder: ColumnarRecorder, name: str):
+        super().__init__(der)
+        self.recorder = recorder
+        self.name = name
+        self.index = recorder.indices[name]
+
+    def start_tick(self):
+        pass
+
+    def record_result(self, cost: float, granted_amount: float):
+        # DERs with members report their results in their stats.
+        if isinstance(self.index, slice):
+            return
+        self.recorder.add('cost', self.index, cost)
+        self.recorder.add('granted_amount', self.index, granted_amount)
+
+    def record_stats(self, der_stats: dict) -> dict:
+        recorder = self.recorder
+        if isinstance(self.index, slice):
+            self.record_member_stats(der_stats)
+            return der_stats
+        if np.ndim(der_stats.get('current_energy')) > 0:
+            raise ValueError(f'DER {self.name} reports per-member stats, record it with members={{name: count}}.')
+        if 'current_energy' in der_stats:
+            recorder.set('current_energy', self.index, der_stats['current_energy'])
+        if 'meeting_next_mdr' in der_stats:
+            recorder.set('meeting_next_mdr', self.index, der_stats['meeting_next_mdr'])
+        if 'last_action' in der_stats:
+            recorder.set('action', self.index, ACTION_CODES.get(der_stats['last_action'], -1))
+        return der_stats
+
+    def record_member_stats(self, der_stats: dict):
+        recorder = self.recorder
+        size = self.index.stop - self.index.start
+        for field in ('cost', 'granted_amount', 'current_energy', 'meeting_next_mdr', 'last_action'):
+            if field not in der_stats:
+                continue
+            values = np.asarray(der_stats[field])
+            if values.shape != (size,):
+                raise ValueError(f'{field} of a DER recorded with {size} members has shape {values.shape}.')
+            if field == 'last_action':
+                recorder.set('action', self.index, [ACTION_CODES.get(action, -1) for action in values.tolist()])
+            else:
+                recorder.set(field, self.index, values)
+
+# Reads a recording written by ColumnarRecorder.
+# Chunks are memory-mapped, and only the chunks covering the requested ticks are touched.
+class RecordingReader:
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.names = meta['names']
+        self.actions = meta['actions']
+        self.chunk_sizes = meta['chunk_sizes']
+        self.chunk_starts = np.concatenate(([0], np.cumsum(self.chunk_sizes))).astype(int)
+        self.num_ticks = int(self.chunk_starts[-1])
+
+    def chunk(self, index: int, field: str) -> np.ndarray:
+        return np.load(os.path.join(self.directory, f'chunk_{index:05d}', f'{field}.npy'), mmap_mode='r')
+
+    # Returns a field for ticks [start, stop), as a (ticks, DERs) array for per-DER fields
+    # (restricted to the given DER names, if any) or a (ticks,) array for per-tick fields.
+    def column(self, field: str, start: int = 0, stop: int = None, names: list[str] = None) -> np.ndarray:
+        if stop is None:
+            stop = self.num_ticks
+        columns = None
+        if names is not None:
+            columns = [self.names.index(name) for name in names]
+
+        parts = []
+        for i, size in enumerate(self.chunk_sizes):
+            chunk_start = self.chunk_starts[i]
+            if chunk_start + size <= start or chunk_start >= stop:
+                continue
+            data = self.chunk(i, field)[max(start - chunk_start, 0):min(stop - chunk_start, size)]
+            if columns is not None:
+                data = data[:, columns]
+            parts.append(np.array(data))
+        if len(parts) == 0:
+            dtype = (DER_FIELDS | TICK_FIELDS)[field][0]
+            shape = (0,) if field in TICK_FIELDS else (0, len(self.names) if columns is None else len(columns))
+            return np.zeros(shape, dtype=dtype)
+        return np.concatenate(parts)
+
+    # Decodes an action column into action names (None where nothing was recorded).
+    def action_names(self, codes: np.ndarray) -> np.ndarray:
+        names = np.array(self.actions + [None], dtype=object)
+        return names[codes]
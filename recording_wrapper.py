@@ -7,23 +7,66 @@ class RecordingWrapper:
     
     def make_bid(self, t, grid_price) -> Bid:
         bid: Bid = self.der.make_bid(t, grid_price)
-        if bid is not None:
+        if isinstance(bid, list):
+            for b in bid:
+                b.creator = self
+        elif bid is not None:
             bid.creator = self
-        self.post_bid_stats = {
-            'cost': 0.0,
-        }
+        self.start_tick()
         return bid
 
+    def max_bids(self) -> int:
+        max_bids = getattr(self.der, 'max_bids', None)
+        if max_bids is None:
+            return 1
+        return max_bids()
+
+    def write_bids(self, t, grid_price, book, creator):
+        write_bids = getattr(self.der, 'write_bids', None)
+        if write_bids is None:
+            book.add_bid(self.make_bid(t, grid_price))
+            return
+        self.start_tick()
+        # Rows are written under the wrapper's index, so results come back through collect_bid_results below.
+        write_bids(t, grid_price, book, creator)
+
     def collect_bid_results(self, t, bid: Bid):
         # print(f'==> Bid got t={t}, p={bid.price_per_kwh}, a={bid.amount}')
         if bid.discharge:
-            self.post_bid_stats['cost'] = bid.amount * bid.price_per_kwh * -1
+            self.record_result(bid.amount * bid.price_per_kwh * -1, bid.amount)
         else:
-            self.post_bid_stats['cost'] = bid.amount * bid.price_per_kwh
-        self.post_bid_stats['granted_amount'] = bid.amount
+            self.record_result(bid.amount * bid.price_per_kwh, bid.amount)
         return self.der.collect_bid_results(t, bid)
     
+    def planning_problem(self, t):
+        planning_problem = getattr(self.der, 'planning_problem', None)
+        if planning_problem is None:
+            return None
+        return planning_problem(t)
+
+    def apply_schedule(self, schedule):
+        self.der.apply_schedule(schedule)
+
+    def solver_config(self):
+        return self.der.solver_config()
+
     def post_bid(self, t: int, price: float) -> dict:
         der_stats: dict = self.der.post_bid(t, price)
+        return self.record_stats(der_stats)
+
+    # Recording hooks, overridden by StreamingRecordingWrapper.
+
+    def start_tick(self):
+        self.post_bid_stats = {
+            'cost': 0.0,
+        }
+
+    # DERs bidding several times a tick get a result per bid, the tick's totals are recorded.
+    # granted_amount is only there once a bid got a result.
+    def record_result(self, cost: float, granted_amount: float):
+        self.post_bid_stats['cost'] += cost
+        self.post_bid_stats['granted_amount'] = self.post_bid_stats.get('granted_amount', 0.0) + granted_amount
+
+    def record_stats(self, der_stats: dict) -> dict:
         self.post_bid_stats = self.post_bid_stats | der_stats
-        return self.post_bid_stats
\ No newline at end of file
+        return self.post_bid_stats
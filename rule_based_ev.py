@@ -1,6 +1,9 @@
 from ev import EV, EVSpec
 from market import Bid
 
+# The last_action values of a RuleBasedEV, indexed by their code (see RuleBasedEVFleet and recorder.py).
+ACTIONS = [None, 'drive', 'voluntary_charge', 'required_charge', 'discharge']
+
 class RuleBasedEV(EV):
     def __init__(self, spec: EVSpec, mdr: list[float], driving_schedule: list[float], max_charge_price: float, min_discharge_price: float):
         super().__init__(spec, mdr, driving_schedule)
@@ -8,7 +11,14 @@ class RuleBasedEV(EV):
         self.max_charge_price = max_charge_price
         self.last_action = None
 
-    def make_bid(self, t, grid_price):
+    def get_state(self) -> dict:
+        return super().get_state() | {'last_action': ACTIONS.index(self.last_action)}
+
+    def set_state(self, state: dict):
+        super().set_state(state)
+        self.last_action = ACTIONS[int(state['last_action'])]
+
+    def decide_bid(self, t, grid_price):
         if self.driving_schedule[t] != 0.0:
             self.last_action = 'drive'
             # Not plugged in, can't bid.
@@ -20,29 +30,14 @@ class RuleBasedEV(EV):
         if grid_price < self.max_charge_price:
             # We want to charge now.
             self.last_action = 'voluntary_charge'
-            return Bid(
-                price_per_kwh=grid_price,
-                amount=min(self.spec.charge_rate_max, self.left_to_charge()),
-                discharge=False,
-                creator=self,
-            )
+            return (grid_price, min(self.spec.charge_rate_max, self.left_to_charge()), False)
         elif min_charge_amount > 0.0:
             # The EV needs to meet its charging goals.
             self.last_action = 'required_charge'
-            return Bid(
-                price_per_kwh=grid_price,
-                amount=min(self.spec.charge_rate_max, min_charge_amount),
-                discharge=False,
-                creator=self,
-            )
+            return (grid_price, min(self.spec.charge_rate_max, min_charge_amount), False)
         elif grid_price > self.min_discharge_price:
             self.last_action = 'discharge'
-            return Bid(
-                price_per_kwh=0.0,
-                amount=min(self.spec.discharge_rate_max, self.current_energy - self.mdr[next]),
-                discharge=True,
-                creator=self,
-            )
+            return (0.0, min(self.spec.discharge_rate_max, self.current_energy - self.mdr[next]), True)
     
     def collect_bid_results(self, t, bid: Bid):
         if bid.discharge:
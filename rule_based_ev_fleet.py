@@ -0,0 +1,161 @@
+import numpy as np
+
+from energy_transfer import CHARGE as CHARGE_ENERGY, DISCHARGE as DISCHARGE_ENERGY, IDLE, transfer_energy
+from ev import EVSpec
+from lookahead import FleetLookahead
+from market import Bid
+from rule_based_ev import ACTIONS
+
+NO_ACTION, DRIVE, VOLUNTARY_CHARGE, REQUIRED_CHARGE, DISCHARGE = range(len(ACTIONS))
+
+# A fleet of RuleBasedEVs stored as arrays, registered on the market as a single DER.
+# Behaves like one RuleBasedEV per vehicle registered in the same position, but every step is one NumPy pass.
+# mdr and driving_schedule are either shared 24 hour lists or one row per vehicle, and the prices are either
+# shared or one per vehicle.
+class RuleBasedEVFleet:
+    def __init__(self,
+                 specs: list[EVSpec],
+                 mdr: list[float],
+                 driving_schedule: list[float],
+                 max_charge_price: float,
+                 min_discharge_price: float,
+                 lookahead_window: int = 3):
+        n = len(specs)
+        self.size = n
+        self.capacity = np.array([s.capacity for s in specs], dtype=float)
+        self.charge_rate_max = np.array([s.charge_rate_max for s in specs], dtype=float)
+        self.discharge_rate_max = np.array([s.discharge_rate_max for s in specs], dtype=float)
+        self.min_capacity = np.array([s.capacity * s.operating_range[0] for s in specs], dtype=float)
+        self.max_capacity = np.array([s.capacity * s.operating_range[1] for s in specs], dtype=float)
+        self.current_energy = np.array([s.initial_energy for s in specs], dtype=float)
+        self.mdr = np.broadcast_to(np.asarray(mdr, dtype=float), (n, 24)).copy()
+        self.driving_schedule = np.broadcast_to(np.asarray(driving_schedule, dtype=float), (n, 24)).copy()
+        self.max_charge_price = np.broadcast_to(np.asarray(max_charge_price, dtype=float), (n,)).copy()
+        self.min_discharge_price = np.broadcast_to(np.asarray(min_discharge_price, dtype=float), (n,)).copy()
+        self.last_action = np.full(n, NO_ACTION, dtype=np.int8)
+        self.lookahead = FleetLookahead(self.mdr, self.driving_schedule, lookahead_window)
+
+        # Bids of the current tick.
+        self.bid_vehicles = np.zeros(0, dtype=np.intp)
+        self.bid_discharge = np.zeros(0, dtype=bool)
+        self.bid_index = {}
+        self.first_row = None
+        self.granted = np.zeros(n)
+        self.cost = np.zeros(n)
+        self.collected = np.zeros(n, dtype=bool)
+
+    # Dynamic state for checkpoints, see checkpoint.py.
+    def get_state(self) -> dict:
+        return {'current_energy': self.current_energy, 'last_action': self.last_action}
+
+    def set_state(self, state: dict):
+        self.current_energy = np.array(state['current_energy'], dtype=float)
+        self.last_action = np.array(state['last_action'], dtype=np.int8)
+
+    # Same as EV.minimum_charge_amount for every vehicle.
+    def minimum_charge_amount(self, t: int) -> np.ndarray:
+        return self.lookahead.minimum_charge_amount(t, self.current_energy)
+
+    def left_to_charge(self) -> np.ndarray:
+        return np.maximum(0, self.max_capacity - self.current_energy)
+
+    # Decides every vehicle's bid. Returns the prices and amounts of the vehicles that bid,
+    # which are listed in self.bid_vehicles with their discharge flags in self.bid_discharge.
+    # grid_price can also be one price per vehicle (see BatchedMarket).
+    def decide_bids(self, t, grid_price) -> tuple[np.ndarray, np.ndarray]:
+        next = (t + 1) % 24
+        driving = self.driving_schedule[:, t] != 0.0
+        min_charge_amount = self.minimum_charge_amount(t)
+
+        voluntary = ~driving & (grid_price < self.max_charge_price)
+        required = ~driving & ~voluntary & (min_charge_amount > 0.0)
+        discharge = ~driving & ~voluntary & ~required & (grid_price > self.min_discharge_price)
+
+        # Vehicles that don't bid keep their last action.
+        self.last_action[driving] = DRIVE
+        self.last_action[voluntary] = VOLUNTARY_CHARGE
+        self.last_action[required] = REQUIRED_CHARGE
+        self.last_action[discharge] = DISCHARGE
+
+        amounts = np.where(
+            voluntary,
+            np.minimum(self.charge_rate_max, self.left_to_charge()),
+            np.where(
+                required,
+                np.minimum(self.charge_rate_max, min_charge_amount),
+                np.minimum(self.discharge_rate_max, self.current_energy - self.mdr[:, next]),
+            ),
+        )
+
+        self.bid_vehicles = np.flatnonzero(voluntary | required | discharge)
+        self.bid_discharge = discharge[self.bid_vehicles]
+        self.granted[:] = 0.0
+        self.cost[:] = 0.0
+        self.collected[:] = False
+        prices = np.where(self.bid_discharge, 0.0, np.broadcast_to(grid_price, (self.size,))[self.bid_vehicles])
+        return prices, amounts[self.bid_vehicles]
+
+    def make_bid(self, t, grid_price) -> list[Bid]:
+        prices, amounts = self.decide_bids(t, grid_price)
+        bids = [
+            Bid(
+                price_per_kwh=0.0 if is_discharge else grid_price,
+                amount=amount,
+                discharge=is_discharge,
+                creator=self,
+            )
+            for amount, is_discharge in zip(amounts.tolist(), self.bid_discharge.tolist())
+        ]
+        self.bid_index = {id(b): i for i, b in zip(self.bid_vehicles.tolist(), bids)}
+        self.first_row = None
+        return bids
+
+    # At most one bid per vehicle.
+    def max_bids(self) -> int:
+        return self.size
+
+    def write_bids(self, t, grid_price, book, creator):
+        prices, amounts = self.decide_bids(t, grid_price)
+        self.first_row = book.extend(prices, amounts, self.bid_discharge, creator)
+        self.bid_index = None
+
+    def collect_bid_results(self, t, bid: Bid):
+        if self.first_row is None:
+            i = self.bid_index[id(bid)]
+        else:
+            # A BidView of the rows added by write_bids.
+            i = self.bid_vehicles[bid.row - self.first_row]
+        self.granted[i] = bid.amount
+        self.cost[i] = bid.amount * bid.price_per_kwh * (-1 if bid.discharge else 1)
+        self.collected[i] = True
+
+    # EV.determine_energy_transfer(1, ...) for every vehicle, see energy_transfer.py.
+    def transfer(self, direction, amount):
+        self.current_energy, _ = transfer_energy(
+            self.current_energy, direction, amount,
+            self.charge_rate_max, self.discharge_rate_max, self.min_capacity, self.max_capacity,
+        )
+
+    def post_bid(self, t, price) -> dict:
+        self.apply_results(t)
+        return self.get_current_stats(t)
+
+    # Bid results are applied here in bulk rather than one by one in collect_bid_results, then the vehicles drive.
+    def apply_results(self, t):
+        discharging = np.zeros(self.size, dtype=bool)
+        discharging[self.bid_vehicles] = self.bid_discharge
+        self.transfer(np.where(self.collected, np.where(discharging, DISCHARGE_ENERGY, CHARGE_ENERGY), IDLE), self.granted)
+
+        self.transfer(DISCHARGE_ENERGY, self.driving_schedule[:, t])
+
+    # Per-vehicle arrays of the stats a RecordingWrapper(RuleBasedEV) would report.
+    def get_current_stats(self, t) -> dict:
+        return {
+            'current_energy': self.current_energy.copy(),
+            'mdr': self.mdr[:, t].copy(),
+            'driving_schedule': self.driving_schedule[:, t].copy(),
+            'meeting_next_mdr': self.current_energy >= self.mdr[:, (t+1)%24],
+            'last_action': np.array(ACTIONS, dtype=object)[self.last_action],
+            'cost': self.cost.copy(),
+            'granted_amount': self.granted.copy(),
+        }
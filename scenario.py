@@ -0,0 +1,222 @@
+import copy
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from checkpoint import Checkpointer
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import Home, gen_schedule_by_prices_and_mean
+from market import DoubleAuctionMarketController
+from optimized_ev import OptimizedEV
+from recorder import ColumnarRecorder
+from recording_wrapper import RecordingWrapper
+from rule_based_ev import RuleBasedEV
+
+# Simulation scenarios as plain dicts, so they can be loaded from JSON files (see scenarios/).
+# A scenario file only needs the keys it changes, everything else comes from DEFAULT_SCENARIO.
+# Nested dicts are merged key by key.
+
+DEFAULT_SCENARIO = {
+    'name': 'Mixed',
+    'days': 5,
+    'seed': 0,
+    'clearing': 'loop',
+    'fleet': {'rbev': 4, 'loev': 4, 'home': 8},
+    # Source: https://www.hydroone.com/rates-and-billing/rates-and-charges/electricity-pricing-and-costs
+    'prices': [7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+               12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6],
+    'driving_schedule': [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                         4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+    # MDR is based on the following:
+    # User wants a minimum all the time for emergencies.
+    # User wants extra throughout the day for unexpected travel needs.
+    # User wants a lot during rush hours in case of traffic or accidents etc.
+    'mdr': [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+            15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0],
+    'ev_spec': {
+        'capacity': 40, # kWh
+        'charge_rate_max': 10, # kW
+        'discharge_rate_max': 10, # kW
+        'initial_energy': 0.0, # kWh
+        'operating_range': [0.2, 0.8], # Percent
+    },
+    # Thresholds default to halfway between the mean price and the min/max price.
+    'rbev': {'max_charge_price': None, 'min_discharge_price': None},
+    # replan_threshold (kWh) turns on intra-day re-planning, accept_infeasible keeps CBC's values for infeasible
+    # days instead of falling back to a heuristic schedule, see OptimizedEV.
+    'loev': {'solver': 'pulp', 'replan_threshold': None, 'accept_infeasible': False},
+    'home': {'mean': 2.0, 'randomness': 0.1},
+}
+
+KINDS = ('rbev', 'loev', 'home')
+
+def merge(base: dict, overrides: dict) -> dict:
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def load_scenario(path: str = None, overrides: dict = None) -> dict:
+    scenario = DEFAULT_SCENARIO
+    if path is not None:
+        with open(path) as f:
+            scenario = merge(scenario, json.load(f))
+    return merge(scenario, overrides or {})
+
+def thresholds(scenario: dict) -> tuple[float, float]:
+    prices = np.asarray(scenario['prices'], dtype=float)
+    mean = prices.mean()
+    max_charge_price = scenario['rbev']['max_charge_price']
+    min_discharge_price = scenario['rbev']['min_discharge_price']
+    if max_charge_price is None:
+        max_charge_price = (prices.min() + mean) / 2
+    if min_discharge_price is None:
+        min_discharge_price = (prices.max() + mean) / 2
+    return max_charge_price, min_discharge_price
+
+# The names of the scenario's DERs, <kind>_<i>, by kind.
+def der_names(fleet: dict) -> dict[str, list[str]]:
+    return {kind: [f'{kind}_{i}' for i in range(fleet.get(kind, 0))] for kind in KINDS}
+
+# Builds the market for a scenario, with every DER and the DSO wrapped in a RecordingWrapper, or recorded by
+# a ColumnarRecorder (the DSO as 'grid') if one is given.
+# DERs are named <kind>_<i>. Seeds the random module, which Home draws from.
+def build_market(scenario: dict, recorder: ColumnarRecorder = None) -> DoubleAuctionMarketController:
+    if recorder is None:
+        wrap = lambda der, name: RecordingWrapper(der)
+    else:
+        wrap = recorder.wrap
+    random.seed(scenario['seed'])
+    prices = np.asarray(scenario['prices'], dtype=float)
+    spec = dict(scenario['ev_spec'])
+    spec['operating_range'] = tuple(spec['operating_range'])
+    ev_spec = EVSpec(**spec)
+    max_charge_price, min_discharge_price = thresholds(scenario)
+    home_schedule = gen_schedule_by_prices_and_mean(prices, scenario['home']['mean'])
+
+    dso = wrap(TimeOfUseGrid(prices), 'grid')
+    market = DoubleAuctionMarketController(dso, 1, clearing=scenario['clearing'])
+    fleet = scenario['fleet']
+
+    for i in range(fleet.get('rbev', 0)):
+        der = wrap(RuleBasedEV(
+            spec=ev_spec,
+            mdr=scenario['mdr'],
+            driving_schedule=scenario['driving_schedule'],
+            max_charge_price=max_charge_price,
+            min_discharge_price=min_discharge_price,
+        ), f'rbev_{i}')
+        market.add_der(der, f'rbev_{i}')
+
+    for i in range(fleet.get('loev', 0)):
+        der = wrap(OptimizedEV(
+            spec=ev_spec,
+            driving_schedule=scenario['driving_schedule'],
+            mdr=scenario['mdr'],
+            history=prices.copy(), # It'll be editing this list, may not want to give it the original.
+            solver=scenario['loev']['solver'],
+            replan_threshold=scenario['loev']['replan_threshold'],
+            accept_infeasible=scenario['loev']['accept_infeasible'],
+        ), f'loev_{i}')
+        market.add_der(der, f'loev_{i}')
+
+    for i in range(fleet.get('home', 0)):
+        der = wrap(Home(
+            schedule=home_schedule,
+            randomness=scenario['home']['randomness'],
+        ), f'home_{i}')
+        market.add_der(der, f'home_{i}')
+
+    return market
+
+def _mean(values: list[float]) -> float:
+    if len(values) == 0:
+        return None
+    return float(np.mean(values))
+
+# Runs one day (24 ticks) and returns its hourly series and summary.
+# With the recorder the market was built with, every tick is also recorded.
+def run_day(market: DoubleAuctionMarketController, fleet: dict, recorder: ColumnarRecorder = None) -> dict:
+    names = der_names(fleet)
+    if recorder is None:
+        der_stats = lambda name: market.ders[name].post_bid_stats
+        dso_stats = lambda: market.dso.post_bid_stats
+    else:
+        der_stats = recorder.current
+        dso_stats = lambda: recorder.current('grid')
+    hourly = {'market_price': [], 'grid_price': [], 'grid_cost': [], 'grid_amount': []}
+    for kind in KINDS:
+        hourly[f'{kind}_cost'] = []
+    mdr_misses = []
+
+    start = time.perf_counter()
+    for t in range(24):
+        stats = market.run_tick()
+        grid_stats = dso_stats()
+        hourly['market_price'].append(stats['price'])
+        hourly['grid_price'].append(stats['grid_price'])
+        hourly['grid_cost'].append(grid_stats['cost'])
+        hourly['grid_amount'].append(grid_stats['granted_amount'])
+        for kind in KINDS:
+            hourly[f'{kind}_cost'].append(_mean([der_stats(name)['cost'] for name in names[kind]]))
+        for kind in ('rbev', 'loev'):
+            for name in names[kind]:
+                ev_stats = der_stats(name)
+                if not ev_stats['meeting_next_mdr']:
+                    mdr_misses.append({'t': t, 'der': name, 'action': ev_stats['last_action']})
+        if recorder is not None:
+            recorder.end_tick(stats)
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        'mean_market_price': _mean(hourly['market_price']),
+        'max_market_price': max(hourly['market_price']),
+        'grid_total_amount': float(np.sum(hourly['grid_amount'])),
+        'grid_total_cost': float(np.sum(hourly['grid_cost'])),
+        'mdr_misses': len(mdr_misses),
+        'seconds': elapsed,
+    }
+    for kind in KINDS:
+        costs = [c for c in hourly[f'{kind}_cost'] if c is not None]
+        summary[f'{kind}_mean_cost'] = _mean(costs)
+    # Since the start of the run.
+    for counter in ('fallbacks', 'replans'):
+        summary[f'loev_{counter}'] = sum(getattr(market.ders[name].der, counter) for name in names['loev'])
+    return {'hourly': hourly, 'summary': summary, 'mdr_misses': mdr_misses}
+
+# Runs every day of the scenario, calling on_day(day_num, day) after each one (day_num starts at 1).
+# With a checkpoint path the simulation state is saved there every checkpoint_days days (see checkpoint.py),
+# and with resume a run picks up after the last saved day if the checkpoint exists. Only the days run are returned.
+# With a record directory every tick is written there by a ColumnarRecorder (see recorder.py), for RecordingReader to
+# load later. A resumed run records from the day it resumes at, so give it its own directory.
+def run_scenario(scenario: dict, on_day=None, checkpoint: str = None, checkpoint_days: int = 1, resume: bool = False,
+                 record: str = None) -> list[dict]:
+    recorder = None
+    if record is not None:
+        names = der_names(scenario['fleet'])
+        recorder = ColumnarRecorder(record, ['grid'] + [name for kind in KINDS for name in names[kind]])
+    market = build_market(scenario, recorder)
+    checkpointer = None
+    start = 0
+    if checkpoint is not None:
+        checkpointer = Checkpointer(checkpoint, market, interval=24 * checkpoint_days)
+        if resume and os.path.exists(checkpoint):
+            start = checkpointer.restore() // 24
+    days = []
+    for i in range(start, scenario['days']):
+        day = run_day(market, scenario['fleet'], recorder)
+        days.append(day)
+        if checkpointer is not None:
+            checkpointer.advance(24)
+        if on_day is not None:
+            on_day(i + 1, day)
+    if recorder is not None:
+        recorder.close()
+    return days
@@ -0,0 +1,303 @@
+import numpy as np
+from pulp import LpProblem, LpStatus, lpSum, LpVariable, PULP_CBC_CMD
+
+# Inputs to an OptimizedEV's 24 hour charge schedule.
+# The schedule minimizes the cost of charging at the historical prices while keeping the energy
+# within the operating range and above the MDR, with no charging while the car is driving.
+class ScheduleProblem:
+    def __init__(self,
+                 history: list[float],
+                 mdr: list[float],
+                 driving_schedule: list[float],
+                 current_energy: float,
+                 energy_range: tuple[float, float],
+                 charge_range: tuple[float, float] = (-10, 10)):
+        self.history = np.array(history, dtype=float)
+        self.mdr = mdr
+        self.driving_schedule = driving_schedule
+        self.current_energy = current_energy
+        self.energy_range = energy_range # kWh
+        self.charge_range = charge_range # kW
+
+    # Builds the LP for this problem.
+    # Returns the charge variables, the objective and the constraints so that several problems can share one model.
+    # Variable names are prefixed with name_prefix to keep them unique within a shared model.
+    def lp_terms(self, name_prefix=''):
+        # Adding charge rate (c) and current energy (E) variables
+        charge_vars = []
+        for i in range(24):
+            charge_vars.append(LpVariable(f'{name_prefix}c_{i}', self.charge_range[0], self.charge_range[1]))
+        energy_vars = []
+        for i in range(25):
+            energy_vars.append(LpVariable(f'{name_prefix}E_{i}', self.energy_range[0], self.energy_range[1]))
+
+        # Adding an objective
+        objective = lpSum(charge_vars[i] * self.history[i] for i in range(24)) # TODO is this minimizing or maximizing?
+
+        # Start condition
+        constraints = [(energy_vars[0] == self.current_energy, f'{name_prefix}start_energy')]
+
+        # MDR conditions
+        for i in range(24):
+            constraints.append((energy_vars[i+1] >= self.mdr[i], f'{name_prefix}mdr_{i}'))
+
+        # Constraints on energy logic
+        for i in range(24):
+            if self.driving_schedule[i] == 0.0:
+                # Car is plugged in, let it charge/discharge.
+                constraints.append((energy_vars[i+1] == energy_vars[i] + charge_vars[i], f'{name_prefix}energy_logic_{i}'))
+            else:
+                # Car is not plugged in, simulate driving.
+                constraints.append((energy_vars[i+1] == energy_vars[i] - self.driving_schedule[i], f'{name_prefix}energy_logic_{i}'))
+                constraints.append((charge_vars[i] == 0, f'{name_prefix}parked_{i}'))
+
+        return charge_vars, objective, constraints
+
+    # Total cost of following a schedule at the historical prices.
+    def cost(self, schedule) -> float:
+        return float(np.dot(self.history, schedule))
+
+# Returns None if CBC finds no solution within time_limit seconds (unlimited by default).
+# Like the original solver, the values CBC reports for an infeasible problem are still returned,
+# use solve_pulp_optimal to only accept optimal schedules.
+def solve_pulp(problem: ScheduleProblem, time_limit: float = None) -> list[float]:
+    return solve_pulp_batch([problem], time_limit)[0]
+
+def solve_pulp_optimal(problem: ScheduleProblem, time_limit: float = None) -> list[float]:
+    return solve_pulp_batch([problem], time_limit, require_optimal=True)[0]
+
+# Solves several problems as one block-diagonal LP with a single CBC run.
+# The blocks share no variables, so each block's part of the solution is optimal for its own problem.
+# A block without values, or every block if require_optimal and CBC doesn't report an optimal solution, is None.
+def solve_pulp_batch(problems: list[ScheduleProblem], time_limit: float = None, require_optimal: bool = False) -> list[list[float]]:
+    model, all_charge_vars = _solve_pulp_model(problems, time_limit)
+    if require_optimal and LpStatus[model.status] != 'Optimal':
+        return [None] * len(problems)
+    solution = {v.name: v.value() for v in model.variables()}
+    schedules = []
+    for charge_vars in all_charge_vars:
+        schedule = [solution.get(v.name) for v in charge_vars]
+        schedules.append(None if None in schedule else schedule)
+    return schedules
+
+def _solve_pulp_model(problems: list[ScheduleProblem], time_limit: float = None) -> tuple[LpProblem, list[list[LpVariable]]]:
+    model = LpProblem('ChargeSchedule')
+
+    all_charge_vars = []
+    objectives = []
+    for i, problem in enumerate(problems):
+        # A single problem keeps the plain variable names.
+        name_prefix = f'ev_{i}_' if len(problems) > 1 else ''
+        charge_vars, objective, constraints = problem.lp_terms(name_prefix)
+        all_charge_vars.append(charge_vars)
+        objectives.append(objective)
+        for constraint in constraints:
+            model += constraint
+    model += lpSum(objectives)
+
+    model.solve(PULP_CBC_CMD(msg=0, timeLimit=time_limit)) # msg=0 disables logging to stdout.
+    return model, all_charge_vars
+
+# A vehicle's LP kept from day to day, for repeated solves of problems that only differ in prices and start energy.
+# The model is built on the first solve. After that each solve only sets the objective coefficients and the start energy
+# in place and reads the charge values straight off the variables. A change to anything else (MDR, driving schedule,
+# ranges) rebuilds it. Called like solve_pulp_optimal (or solve_pulp without require_optimal); returns NumPy arrays.
+class ScheduleModel:
+    def __init__(self, require_optimal: bool = True):
+        self.require_optimal = require_optimal
+        self.model = None
+        self.structure = None
+        self.charge_vars = None
+        self.start = None
+        self.builds = 0
+
+    def build(self, problem: ScheduleProblem):
+        self.model = LpProblem('ChargeSchedule')
+        self.charge_vars, objective, constraints = problem.lp_terms()
+        for constraint in constraints:
+            self.model += constraint
+        self.model += objective
+        self.start = self.model.get_constraint_by_name('start_energy')
+        self.builds += 1
+
+    def __call__(self, problem: ScheduleProblem, time_limit: float = None) -> np.ndarray:
+        structure = (tuple(problem.mdr), tuple(problem.driving_schedule), tuple(problem.energy_range), tuple(problem.charge_range))
+        if structure != self.structure:
+            self.build(problem)
+            self.structure = structure
+        else:
+            objective = self.model.objective
+            for var, price in zip(self.charge_vars, problem.history):
+                objective[var] = price
+            self.start.changeRHS(problem.current_energy)
+
+        self.model.solve(PULP_CBC_CMD(msg=0, timeLimit=time_limit)) # msg=0 disables logging to stdout.
+        if self.require_optimal and LpStatus[self.model.status] != 'Optimal':
+            return None
+        schedule = [v.varValue for v in self.charge_vars]
+        if None in schedule:
+            return None
+        return np.array(schedule, dtype=float)
+
+# Solves the schedule in-process by dynamic programming over convex piecewise linear cost-to-go functions.
+# V_k(E) is the cheapest cost of hours k..23 when starting hour k with energy E. It's convex and piecewise linear,
+# so it's stored as breakpoints (xs, ys), and every step of the recursion maps breakpoints to breakpoints exactly.
+# Returns None if the problem is infeasible.
+def solve_dp(problem: ScheduleProblem) -> np.ndarray:
+    policy = schedule_policy(problem)
+    if policy is None or not policy.feasible(0, problem.current_energy):
+        return None
+    return policy.schedule_from(0, problem.current_energy)
+
+# The optimal decision of every hour of a problem, for any energy: the energy hour k should end at (when reachable)
+# and the energies hour k can start at. Only depends on the prices, MDR and driving of hours k..23,
+# so a policy stays optimal for the rest of the day as long as those don't change.
+class SchedulePolicy:
+    def __init__(self, problem: ScheduleProblem, targets: np.ndarray, lows: np.ndarray, highs: np.ndarray):
+        self.problem = problem
+        self.targets = targets
+        self.lows = lows
+        self.highs = highs
+
+    def feasible(self, t: int, energy: float) -> bool:
+        return self.lows[t] - 1e-9 <= energy <= self.highs[t] + 1e-9
+
+    # The optimal schedule of hours t..23 starting hour t with the given energy, or the closest one can get
+    # to it if the energy is infeasible.
+    def schedule_from(self, t: int, energy: float) -> np.ndarray:
+        problem = self.problem
+        charge_low, charge_high = problem.charge_range
+        schedule = np.zeros(24 - t)
+        for k in range(t, 24):
+            if problem.driving_schedule[k] == 0.0:
+                next_energy = min(max(self.targets[k], energy + charge_low), energy + charge_high)
+                schedule[k - t] = next_energy - energy
+                energy = next_energy
+            else:
+                energy -= problem.driving_schedule[k]
+        return schedule
+
+# The backward pass of solve_dp. Returns None if some hour can't be met from any energy.
+def schedule_policy(problem: ScheduleProblem) -> SchedulePolicy:
+    low, high = problem.energy_range
+    charge_low, charge_high = problem.charge_range
+
+    # Energy bounds of E_0..E_24.
+    energy_lows = np.maximum(low, np.concatenate(([low], np.array(problem.mdr, dtype=float))))
+
+    xs = np.array([energy_lows[24], high])
+    ys = np.zeros(2)
+    targets = np.zeros(24)
+    lows = np.zeros(24)
+    highs = np.zeros(24)
+    for k in range(23, -1, -1):
+        if problem.driving_schedule[k] == 0.0:
+            # E_{k+1} = E_k + c with c in the charge range, so V_k(E) = min over that window of h*(x-E) + V_{k+1}(x).
+            # With f(x) = V_{k+1}(x) + h*x minimized at x*, the window either reaches x* (flat at f(x*)),
+            # or is stuck left or right of it, which shifts the matching side of f.
+            h = problem.history[k]
+            fs = ys + h * xs
+            best = int(np.argmin(fs))
+            targets[k] = xs[best]
+            xs = np.concatenate((xs[:best+1] - charge_high, xs[best:] - charge_low))
+            ys = np.concatenate((fs[:best+1], fs[best:])) - h * xs
+        else:
+            # Driving: E_{k+1} = E_k - d.
+            xs = xs + problem.driving_schedule[k]
+        xs, ys = _restrict(xs, ys, energy_lows[k], high)
+        if xs is None:
+            return None
+        lows[k] = xs[0]
+        highs[k] = xs[-1]
+    return SchedulePolicy(problem, targets, lows, highs)
+
+# Restricts a piecewise linear function to [low, high]. Returns (None, None) if nothing is left.
+def _restrict(xs: np.ndarray, ys: np.ndarray, low: float, high: float) -> tuple[np.ndarray, np.ndarray]:
+    low = max(low, xs[0])
+    high = min(high, xs[-1])
+    if low > high + 1e-9:
+        return None, None
+    high = max(low, high)
+    inner = (xs > low) & (xs < high)
+    new_xs = np.concatenate(([low], xs[inner], [high]))
+    new_ys = np.interp(new_xs, xs, ys)
+    return new_xs, new_ys
+
+# A quick schedule in the spirit of RuleBasedEV, for when the LP can't be solved in time or at all.
+# Works out the least energy each hour needs for every later MDR and drive to stay reachable, then charges to the top
+# of the range in hours cheaper than the day's mean price, discharges down to that least energy in dearer hours and
+# otherwise only charges what's needed. Feasible whenever the problem is, though rarely optimal. Never returns None.
+def solve_heuristic(problem: ScheduleProblem) -> np.ndarray:
+    low, high = problem.energy_range
+    charge_low, charge_high = problem.charge_range
+
+    # Least energy at the start of hours 0..24.
+    needed = np.zeros(25)
+    needed[24] = max(low, problem.mdr[23])
+    for k in range(23, -1, -1):
+        floor = max(low, problem.mdr[k-1]) if k > 0 else low
+        if problem.driving_schedule[k] == 0.0:
+            needed[k] = max(floor, needed[k+1] - charge_high)
+        else:
+            needed[k] = max(floor, needed[k+1] + problem.driving_schedule[k])
+
+    mean = problem.history.mean()
+    energy = problem.current_energy
+    schedule = np.zeros(24)
+    for k in range(24):
+        if problem.driving_schedule[k] != 0.0:
+            energy -= problem.driving_schedule[k]
+            continue
+        if problem.history[k] < mean:
+            target = high
+        elif problem.history[k] > mean:
+            target = needed[k+1]
+        else:
+            target = energy
+        target = min(max(target, needed[k+1]), high)
+        schedule[k] = min(max(target - energy, charge_low), charge_high)
+        energy += schedule[k]
+    return schedule
+
+class ScheduleMismatchError(Exception):
+    pass
+
+# Solves with solve_dp and verifies the result against CBC.
+# Raises ScheduleMismatchError if the feasibility or the cost of the two solutions disagree.
+def solve_checked(problem: ScheduleProblem, tolerance=1e-6) -> np.ndarray:
+    schedule = solve_dp(problem)
+    model, (charge_vars,) = _solve_pulp_model([problem])
+    cbc_feasible = LpStatus[model.status] == 'Optimal'
+    if (schedule is not None) != cbc_feasible:
+        raise ScheduleMismatchError(f'DP feasible: {schedule is not None}, CBC status: {LpStatus[model.status]}')
+    if schedule is not None:
+        dp_cost = problem.cost(schedule)
+        cbc_cost = problem.cost([v.value() for v in charge_vars])
+        if abs(dp_cost - cbc_cost) > tolerance * max(1.0, abs(cbc_cost)):
+            raise ScheduleMismatchError(f'DP cost {dp_cost} != CBC cost {cbc_cost}')
+    return schedule
+
+# Solvers for OptimizedEV, selected with its solver argument.
+SCHEDULE_SOLVERS = {
+    'pulp': solve_pulp,
+    'pulp_optimal': solve_pulp_optimal,
+    'dp': solve_dp,
+    'checked': solve_checked,
+    'heuristic': solve_heuristic,
+}
+
+# Solvers taking a time_limit in seconds.
+TIME_LIMITED_SOLVERS = {'pulp', 'pulp_optimal'}
+
+# Collects (der, problem) pairs for every DER with a schedule to solve before bidding at time t.
+# DERs opt in by implementing planning_problem(t), apply_schedule(schedule) and solver_config() (see OptimizedEV).
+def planning_problems(t, ders) -> list[tuple[object, ScheduleProblem]]:
+    pending = []
+    for d in ders:
+        planning_problem = getattr(d, 'planning_problem', None)
+        if planning_problem is None:
+            continue
+        problem = planning_problem(t)
+        if problem is not None:
+            pending.append((d, problem))
+    return pending
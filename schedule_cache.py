@@ -0,0 +1,79 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from schedule import ScheduleProblem
+
+# Bounded LRU cache of solved schedules shared between OptimizedEVs.
+# Vehicles with the same spec, MDR and driving schedule and (nearly) the same history and energy reuse one solve.
+# History prices and the current energy are rounded to multiples of their tolerance before keying,
+# so a tolerance of 0 only shares exact matches. A hit returns the schedule solved for the first vehicle with that key.
+# Schedules are keyed on the solver's name (see OptimizedEV.solver_config). Time limits aren't part of the key,
+# so vehicles sharing a cache should use the same one.
+class ScheduleCache:
+    def __init__(self, max_entries: int = 1024, history_tolerance: float = 0.0, energy_tolerance: float = 0.0):
+        self.max_entries = max_entries
+        self.history_tolerance = history_tolerance
+        self.energy_tolerance = energy_tolerance
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, problem: ScheduleProblem, solver_name: str) -> tuple:
+        return (
+            solver_name,
+            tuple(problem.energy_range),
+            tuple(problem.charge_range),
+            tuple(problem.mdr),
+            tuple(problem.driving_schedule),
+            _quantize(problem.history, self.history_tolerance),
+            _quantize([problem.current_energy], self.energy_tolerance),
+        )
+
+    # Returns the cached schedule for the problem, solving it with solver on a miss.
+    def solve(self, problem: ScheduleProblem, solver, solver_name: str):
+        found, schedule = self.lookup(problem, solver_name)
+        if not found:
+            schedule = _copy(solver(problem))
+            self.store(problem, solver_name, schedule)
+        return schedule
+
+    # Returns (True, schedule) on a hit and (False, None) on a miss, for callers solving misses themselves
+    # (e.g. ParallelPlanner) and handing the results to store.
+    def lookup(self, problem: ScheduleProblem, solver_name: str) -> tuple[bool, list[float]]:
+        key = self.key(problem, solver_name)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return True, _copy(self.entries[key])
+        self.misses += 1
+        return False, None
+
+    def store(self, problem: ScheduleProblem, solver_name: str, schedule):
+        self.entries[self.key(problem, solver_name)] = _copy(schedule)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+        }
+
+def _quantize(values, tolerance: float) -> tuple:
+    values = np.asarray(values, dtype=float)
+    if tolerance > 0.0:
+        return tuple(np.round(values / tolerance).astype(np.int64).tolist())
+    return tuple(values.tolist())
+
+def _copy(schedule):
+    if schedule is None:
+        return None
+    return list(schedule)
@@ -0,0 +1,257 @@
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from bid_book import BidBook
+from clearing import clear_book
+
+# Hosts DERs in worker processes, each running make_bid, collect_bid_results and post_bid for its shard of DERs,
+# so DER logic runs on every core.
+# Bids and results are exchanged through shared-memory arrays laid out like a BidBook: row 0 is the grid's bid and
+# every DER has a fixed block of rows (one, or max_bids() for DERs making several bids, e.g. RuleBasedEVFleet).
+# Workers write their DERs' bids into their rows, the market clears the rows in place with clear_book and the workers
+# read the results back into the DERs' own Bid objects. Only small commands go through the pipes each tick.
+# Ticks clear the same way as DoubleAuctionMarketController with a BidBook. DER state lives in the workers,
+# use get_attribute to read it. DERs drawing from the random module (Home) get each worker's own random state,
+# use seeded DERs (e.g. HomePopulation) for reproducible runs. Planners aren't supported.
+# Example:
+#     with ShardedMarketController(TimeOfUseGrid(prices), 1, workers=4) as market:
+#         market.add_der(der, 'der_0')
+#         market.start()
+#         market.run_tick()
+
+# Rows a DER's bids take up: DERs making more than one bid per tick implement max_bids().
+def bid_capacity(der) -> int:
+    max_bids = getattr(der, 'max_bids', None)
+    if max_bids is None:
+        return 1
+    return max_bids()
+
+# Shared arrays: (dtype, rows or DERs).
+ARRAYS = {
+    'price': (np.float64, 'rows'),
+    'amount': (np.float64, 'rows'),
+    'discharge': (np.bool_, 'rows'),
+    'creator': (np.int32, 'rows'),
+    'notified': (np.bool_, 'rows'),
+    'count': (np.int32, 'ders'),
+}
+
+def _attach(names: dict, shapes: dict) -> tuple[list, dict]:
+    blocks = []
+    arrays = {}
+    for field, name in names.items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        arrays[field] = np.ndarray(shapes[field], dtype=ARRAYS[field][0], buffer=block.buf)
+    return blocks, arrays
+
+def _worker(conn, ders: list[tuple], names: dict, shapes: dict):
+    blocks, arrays = _attach(names, shapes)
+    price = arrays['price']
+    amount = arrays['amount']
+    discharge = arrays['discharge']
+    notified = arrays['notified']
+    count = arrays['count']
+    # The Bid objects of the current tick, per DER.
+    bids = [[] for _ in ders]
+    try:
+        while True:
+            command = conn.recv()
+            try:
+                if command[0] == 'stop':
+                    conn.send(('ok', None))
+                    break
+                elif command[0] == 'bid':
+                    _, t, grid_price = command
+                    for k, (index, name, der, offset, capacity) in enumerate(ders):
+                        bid = der.make_bid(t, grid_price)
+                        if bid is None:
+                            bid = []
+                        elif not isinstance(bid, list):
+                            bid = [bid]
+                        if len(bid) > capacity:
+                            raise ValueError(f'{name} made {len(bid)} bids but has {capacity} rows.')
+                        for j, b in enumerate(bid):
+                            price[offset + j] = b.price_per_kwh
+                            amount[offset + j] = np.inf if b.amount is None else b.amount
+                            discharge[offset + j] = b.discharge
+                        count[index] = len(bid)
+                        bids[k] = bid
+                    conn.send(('ok', None))
+                elif command[0] == 'settle':
+                    _, t, market_price = command
+                    for k, (index, name, der, offset, capacity) in enumerate(ders):
+                        for j, b in enumerate(bids[k]):
+                            row = offset + j
+                            if notified[row]:
+                                b.price_per_kwh = float(price[row])
+                                b.amount = None if np.isinf(amount[row]) else float(amount[row])
+                                b.creator.collect_bid_results(t, b)
+                        der.post_bid(t, market_price)
+                    conn.send(('ok', None))
+                elif command[0] == 'get':
+                    _, name, attribute = command
+                    der = next(der for _, der_name, der, _, _ in ders if der_name == name)
+                    conn.send(('ok', getattr(der, attribute)))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+    finally:
+        for block in blocks:
+            block.close()
+
+class ShardedMarketController:
+    def __init__(self, dso, td, workers: int = None, context: str = None):
+        self.dso = dso
+        self.td = td
+        self.ders = {}
+        self.t = 0
+        self.workers = workers or multiprocessing.cpu_count()
+        self.context = multiprocessing.get_context(context)
+        self.blocks = []
+        self.processes = []
+        self.connections = []
+        self.shards = {}
+        self.book = None
+
+    def add_der(self, der, name):
+        if len(self.processes) > 0:
+            raise RuntimeError('DERs must be added before the workers are started.')
+        self.ders[name] = der
+
+    # Allocates the shared arrays and hands each worker its DERs. The DERs are copied into the workers once,
+    # after which the market's DER objects are no longer updated.
+    def start(self):
+        capacities = np.array([bid_capacity(der) for der in self.ders.values()], dtype=np.int64)
+        self.offsets = 1 + np.concatenate(([0], np.cumsum(capacities)[:-1])).astype(np.int64)
+        rows = 1 + int(capacities.sum())
+        shapes = {field: (rows if size == 'rows' else len(self.ders),) for field, (_, size) in ARRAYS.items()}
+        names = {}
+        arrays = {}
+        for field, (dtype, _) in ARRAYS.items():
+            nbytes = max(int(np.prod(shapes[field])) * np.dtype(dtype).itemsize, 1)
+            block = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.blocks.append(block)
+            names[field] = block.name
+            arrays[field] = np.ndarray(shapes[field], dtype=dtype, buffer=block.buf)
+            arrays[field][:] = 0
+        self.count = arrays['count']
+        self.notified = arrays['notified']
+
+        # The shared arrays are the book's columns: creator 0 is the grid, creator i + 1 is the i-th DER.
+        self.book = BidBook(capacity=1)
+        for field in ('price', 'amount', 'discharge', 'creator'):
+            setattr(self.book, field, arrays[field])
+        self.book.size = rows
+        self.book.creator[0] = 0
+        for i, (offset, capacity) in enumerate(zip(self.offsets.tolist(), capacities.tolist())):
+            self.book.creator[offset:offset + capacity] = i + 1
+
+        entries = [(i, name, der, int(self.offsets[i]), int(capacities[i])) for i, (name, der) in enumerate(self.ders.items())]
+        for shard in np.array_split(np.arange(len(entries)), min(self.workers, max(len(entries), 1))):
+            shard_entries = [entries[i] for i in shard.tolist()]
+            parent, child = self.context.Pipe()
+            process = self.context.Process(target=_worker, args=(child, shard_entries, names, shapes), daemon=True)
+            process.start()
+            child.close()
+            self.processes.append(process)
+            self.connections.append(parent)
+            for entry in shard_entries:
+                self.shards[entry[1]] = parent
+
+    def command(self, connections: list, message: tuple) -> list:
+        for conn in connections:
+            conn.send(message)
+        results = []
+        for conn in connections:
+            status, value = conn.recv()
+            if status == 'error':
+                raise RuntimeError(f'DER worker failed:\n{value}')
+            results.append(value)
+        return results
+
+    # Reads an attribute of a DER from the worker hosting it.
+    def get_attribute(self, name: str, attribute: str):
+        return self.command([self.shards[name]], ('get', name, attribute))[0]
+
+    def run_tick(self) -> dict:
+        if self.book is None:
+            self.start()
+        book = self.book
+        t = self.t
+
+        dso_bid = self.dso.make_bid(t, None)
+        grid_price = None
+        if dso_bid.discharge and dso_bid.amount is None:
+            grid_price = dso_bid.price_per_kwh
+        book.price[0] = dso_bid.price_per_kwh
+        book.amount[0] = np.inf if dso_bid.amount is None else dso_bid.amount
+        book.discharge[0] = dso_bid.discharge
+
+        self.command(self.connections, ('bid', t, grid_price))
+
+        # Rows in use: the grid's, then the first count rows of every DER's block.
+        counts = self.count.astype(np.int64)
+        total = int(counts.sum())
+        der_rows = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(self.offsets, counts)
+        rows = np.concatenate(([0], der_rows))
+
+        # Clamp the max sink bid to grid price.
+        der_sinks = der_rows[~book.discharge[der_rows]]
+        book.price[der_sinks] = np.minimum(book.price[der_sinks], grid_price)
+
+        source_rows = rows[book.discharge[rows]]
+        sink_rows = rows[~book.discharge[rows]]
+        self.notified[:] = False
+        price = None
+        if len(sink_rows) == 0:
+            # This breaks the double-auction logic, just manually deny all bids.
+            price = book.price[source_rows].min()
+            book.price[source_rows] = price
+            book.amount[source_rows] = 0.0
+            self.notified[source_rows] = True
+        elif len(source_rows) == 0:
+            # This breaks the double-auction logic, just manually deny all bids.
+            price = book.price[sink_rows].max()
+        else:
+            price, source_rows, sink_rows = clear_book(book, source_rows, sink_rows)
+            self.notified[rows] = True
+        price = float(price)
+
+        self.command(self.connections, ('settle', t, price))
+        if self.notified[0]:
+            self.dso.collect_bid_results(t, book.view(0))
+        self.dso.post_bid(t, price)
+        self.t = (self.t + 1) % 24
+
+        return {
+            'price': price,
+            'grid_price': grid_price,
+            'sources_total': len(source_rows),
+            'sinks_total': len(sink_rows),
+        }
+
+    def close(self):
+        if len(self.processes) > 0:
+            try:
+                self.command(self.connections, ('stop',))
+            finally:
+                for process in self.processes:
+                    process.join()
+                for conn in self.connections:
+                    conn.close()
+        self.processes = []
+        self.connections = []
+        self.book = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
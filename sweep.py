@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import itertools
+import json
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import numpy as np
+
+from scenario import load_scenario, merge, run_scenario
+
+# Parameter sweeps over simulation scenarios (see scenario.py).
+# A grid maps dotted scenario keys to the values to try, e.g.
+#     {'rbev.max_charge_price': [8.0, 10.0], 'home.randomness': [0.1, 0.3], 'fleet': [{'rbev': 4}, {'rbev': 8}]}
+# Every combination is run `repeats` times as an independent simulation on a process pool.
+# Each run gets its own seed spawned from the base scenario's seed with np.random.SeedSequence,
+# so results don't depend on the number of workers or the order runs finish in.
+# The base scenario is sent to each worker once by the pool initializer, and tasks only carry their overrides and seed.
+# Example: python sweep.py scenarios/mixed.json --grid rbev.max_charge_price=8,10,12 --grid home.randomness=0.1,0.3 --workers 4 --output sweep.csv
+
+# Base scenario of the worker process, set by _init_worker.
+_base_scenario = None
+
+def _init_worker(base_scenario: dict):
+    global _base_scenario
+    _base_scenario = base_scenario
+
+def nested(key: str, value) -> dict:
+    for part in reversed(key.split('.')):
+        value = {part: value}
+    return value
+
+# Every combination of the grid as a flat {dotted key: value} dict, in the order the keys are given.
+def expand_grid(grid: dict[str, list]) -> list[dict]:
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+def run_seeds(seed: int, count: int) -> list[int]:
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(count)]
+
+# Aggregates a run's daily summaries into one results row.
+def summarize(days: list[dict]) -> dict:
+    summaries = [day['summary'] for day in days]
+    row = {}
+    for field in ('mean_market_price', 'rbev_mean_cost', 'loev_mean_cost', 'home_mean_cost'):
+        values = [s[field] for s in summaries if s[field] is not None]
+        row[field] = float(np.mean(values)) if len(values) > 0 else None
+    row['max_market_price'] = max(s['max_market_price'] for s in summaries)
+    for field in ('grid_total_amount', 'grid_total_cost', 'mdr_misses', 'seconds'):
+        row[field] = sum(s[field] for s in summaries)
+    return row
+
+def run_point(params: dict, seed: int) -> dict:
+    overrides = {'seed': seed}
+    for key, value in params.items():
+        overrides = merge(overrides, nested(key, value))
+    scenario = merge(_base_scenario, overrides)
+    return summarize(run_scenario(scenario))
+
+def _run_task(task: tuple) -> dict:
+    index, params, repeat, seed = task
+    return {'run': index, **{k: _cell(v) for k, v in params.items()}, 'repeat': repeat, 'seed': seed, **run_point(params, seed)}
+
+def _cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+# Runs every point of the grid and returns one row per run, in grid order.
+# With executor=None a ProcessPoolExecutor with max_workers is created.
+# A given executor must have been created with initializer=_init_worker, initargs=(base_scenario,).
+def run_sweep(base_scenario: dict, grid: dict[str, list], repeats: int = 1, max_workers: int = None, executor: Executor = None) -> list[dict]:
+    points = expand_grid(grid)
+    seeds = run_seeds(base_scenario['seed'], len(points) * repeats)
+    tasks = []
+    for i, params in enumerate(points):
+        for repeat in range(repeats):
+            index = i * repeats + repeat
+            tasks.append((index, params, repeat, seeds[index]))
+
+    if executor is not None:
+        return list(executor.map(_run_task, tasks))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(base_scenario,)) as pool:
+        return list(pool.map(_run_task, tasks))
+
+def write_csv(rows: list[dict], f):
+    fields = []
+    for row in rows:
+        fields += [field for field in row if field not in fields]
+    writer = csv.DictWriter(f, fields)
+    writer.writeheader()
+    writer.writerows(rows)
+
+# Parses key=v1,v2,... with each value as JSON when possible (numbers, lists, dicts), otherwise as a string.
+# Values containing commas (lists, dicts) are separated by ';' instead.
+def parse_grid_arg(text: str) -> tuple[str, list]:
+    key, values = text.split('=', 1)
+    separator = ';' if ';' in values or values.lstrip().startswith(('[', '{')) else ','
+    parsed = []
+    for value in values.split(separator):
+        try:
+            parsed.append(json.loads(value))
+        except json.JSONDecodeError:
+            parsed.append(value)
+    return key.strip(), parsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a parameter sweep over a simulation scenario.')
+    parser.add_argument('scenario', nargs='?', help='Base scenario JSON file, defaults to scenario.DEFAULT_SCENARIO.')
+    parser.add_argument('--grid', action='append', type=parse_grid_arg, default=[], help='key=v1,v2,... e.g. rbev.max_charge_price=8,10')
+    parser.add_argument('--grid-file', help='JSON file with the whole grid as {key: [values]}.')
+    parser.add_argument('--repeats', type=int, default=1, help='Runs per grid point, each with its own seed.')
+    parser.add_argument('--days', type=int, help='Override the number of days.')
+    parser.add_argument('--seed', type=int, help='Override the base seed.')
+    parser.add_argument('--workers', type=int, help='Worker processes, defaults to the CPU count.')
+    parser.add_argument('--output', help='Write the results table as CSV to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.days is not None:
+        overrides['days'] = args.days
+    if args.seed is not None:
+        overrides['seed'] = args.seed
+    base_scenario = load_scenario(args.scenario, overrides)
+
+    grid = {}
+    if args.grid_file:
+        with open(args.grid_file) as f:
+            grid.update(json.load(f))
+    grid.update(dict(args.grid))
+
+    rows = run_sweep(base_scenario, grid, args.repeats, args.workers)
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_csv(rows, f)
+    else:
+        write_csv(rows, sys.stdout)
+
+if __name__ == '__main__':
+    main()
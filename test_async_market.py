@@ -0,0 +1,131 @@
+import asyncio
+
+import numpy as np
+
+from async_market import AsyncMarketController, SimulatedAgent
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import Home, gen_schedule_by_prices_and_mean
+from market import Bid, DoubleAuctionMarketController
+from rule_based_ev import RuleBasedEV
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+def make_ders():
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20.0, operating_range=(0.2, 0.8))
+    ders = {f'ev_{i}': RuleBasedEV(spec, mdr, driving_schedule, 9.0 + i, 14.0) for i in range(3)}
+    ders['home'] = Home(gen_schedule_by_prices_and_mean(weekday_winter, 2.0), 0.0)
+    return ders
+
+def test_fast_agents_match_sync_market():
+    sync_market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    async_market = AsyncMarketController(TimeOfUseGrid(weekday_winter), 1, deadline=1.0)
+    sync_ders = make_ders()
+    async_ders = make_ders()
+    for name in sync_ders:
+        sync_market.add_der(sync_ders[name], name)
+        # Agents answer in reverse order of registration.
+        async_market.add_der(SimulatedAgent(async_ders[name], 0.001 * (5 - len(name))), name)
+
+    async def run():
+        return [await async_market.run_tick() for _ in range(24)]
+
+    async_stats = asyncio.run(run())
+    for stats in async_stats:
+        expected = sync_market.run_tick()
+        assert stats['price'] == expected['price']
+        assert stats['late'] == []
+    for name in sync_ders:
+        if name != 'home':
+            assert async_ders[name].current_energy == sync_ders[name].current_energy
+
+class Counter:
+    def __init__(self, bid):
+        self.bid = bid
+        self.results = []
+        self.post_bids = 0
+
+    def make_bid(self, t, grid_price):
+        return Bid(self.bid[0], self.bid[1], self.bid[2], self)
+
+    def collect_bid_results(self, t, bid):
+        self.results.append(bid.amount)
+
+    def post_bid(self, t, price):
+        self.post_bids += 1
+        return {}
+
+def test_late_der_sits_out_the_tick():
+    market = AsyncMarketController(TimeOfUseGrid(weekday_winter), 1, deadline=0.05)
+    on_time = Counter((7.6, 2.0, False))
+    slow = Counter((7.6, 3.0, False))
+    market.add_der(on_time, 'on_time')
+    market.add_der(SimulatedAgent(slow, lambda method, t: 0.5 if method == 'make_bid' and t == 0 else 0.0), 'slow')
+
+    async def run():
+        return [await market.run_tick() for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first['late'] == ['slow']
+    assert first['sinks_total'] == 1
+    assert second['late'] == []
+    assert second['sinks_total'] == 2
+    # The late DER wasn't notified on the first tick, but got post_bid both times.
+    assert slow.results == [3.0]
+    assert slow.post_bids == 2
+    assert on_time.results == [2.0, 2.0]
+
+def test_failing_der_and_late_notifications():
+    class Broken(Counter):
+        def make_bid(self, t, grid_price):
+            raise RuntimeError('offline')
+
+    market = AsyncMarketController(TimeOfUseGrid(weekday_winter), 1, deadline=0.05)
+    market.add_der(Broken((7.6, 1.0, False)), 'broken')
+    sluggish = Counter((7.6, 1.0, False))
+    market.add_der(SimulatedAgent(sluggish, lambda method, t: 0.5 if method != 'make_bid' else 0.0), 'sluggish')
+
+    stats = asyncio.run(market.run_tick())
+    assert stats['failed'] == ['broken']
+    assert stats['late_results'] == ['sluggish']
+    assert stats['late_post_bid'] == ['sluggish']
+    assert sluggish.results == []
+    assert market.t == 1
+
+def test_failing_notifications_are_reported():
+    class Broken(Counter):
+        def collect_bid_results(self, t, bid: Bid):
+            raise RuntimeError('offline')
+
+        def post_bid(self, t, price):
+            raise RuntimeError('offline')
+
+    market = AsyncMarketController(TimeOfUseGrid(weekday_winter), 1, deadline=0.05)
+    market.add_der(Broken((7.6, 1.0, False)), 'broken')
+    market.add_der(Counter((7.6, 1.0, False)), 'working')
+
+    stats = asyncio.run(market.run_tick())
+    assert stats['failed'] == []
+    assert stats['failed_results'] == ['broken']
+    assert stats['failed_post_bid'] == ['broken']
+
+def test_failing_grid_notifications_are_reported():
+    class BrokenGrid(TimeOfUseGrid):
+        def collect_bid_results(self, t, bid: Bid):
+            raise RuntimeError('offline')
+
+    class Broken(Counter):
+        def collect_bid_results(self, t, bid: Bid):
+            raise RuntimeError('offline')
+
+    market = AsyncMarketController(BrokenGrid(weekday_winter), 1, deadline=0.05)
+    market.add_der(Broken((7.6, 1.0, False)), 'broken')
+    market.add_der(Counter((7.6, 1.0, False)), 'working')
+
+    stats = asyncio.run(market.run_tick())
+    assert stats['failed_results'] == ['broken', 'dso']
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from batched_market import BatchedMarket, build_batched_market
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import HomePopulation, gen_schedule_by_prices_and_mean
+from market import DoubleAuctionMarketController
+from rule_based_ev_fleet import RuleBasedEVFleet
+from scenario import load_scenario
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+def make_specs(energies):
+    return [EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=e, operating_range=(0.2, 0.8)) for e in energies]
+
+@pytest.mark.parametrize('aggregate', [False, True])
+def test_matches_separate_markets(aggregate):
+    scenarios, vehicles, homes = 6, 5, 3
+    rng = np.random.default_rng(0)
+    energies = rng.uniform(5.0, 35.0, (scenarios, vehicles))
+    prices = weekday_winter * rng.uniform(0.8, 1.2, (scenarios, 1))
+    home_schedule = gen_schedule_by_prices_and_mean(weekday_winter, 2.0) * rng.uniform(0.5, 3.0, (homes, 1))
+
+    # Homes without randomness, so every scenario's loads are the same as in its own market.
+    batched = BatchedMarket(
+        scenarios,
+        prices,
+        RuleBasedEVFleet(make_specs(energies.ravel()), mdr, driving_schedule, 9.0, 14.0),
+        HomePopulation(scenarios * homes, np.tile(home_schedule, (scenarios, 1)), 0.0, aggregate=aggregate),
+    )
+    markets = []
+    for s in range(scenarios):
+        market = DoubleAuctionMarketController(TimeOfUseGrid(prices[s]), 1, clearing='vectorized')
+        market.add_der(RuleBasedEVFleet(make_specs(energies[s]), mdr, driving_schedule, 9.0, 14.0), 'fleet')
+        market.add_der(HomePopulation(homes, home_schedule, 0.0, aggregate=aggregate), 'homes')
+        markets.append(market)
+
+    for _ in range(48):
+        stats = batched.run_tick()
+        for s, market in enumerate(markets):
+            market_stats = market.run_tick()
+            assert stats['price'][s] == pytest.approx(market_stats['price'])
+            assert stats['sources_total'][s] == market_stats['sources_total']
+            assert stats['sinks_total'][s] == market_stats['sinks_total']
+        energy = batched.fleet.current_energy.reshape(scenarios, vehicles)
+        for s, market in enumerate(markets):
+            np.testing.assert_allclose(energy[s], market.ders['fleet'].current_energy)
+
+def test_build_batched_market():
+    scenario = load_scenario(overrides={'fleet': {'rbev': 4, 'loev': 0, 'home': 8}})
+    market = build_batched_market(scenario, 100, initial_energy_range=(8.0, 32.0))
+    assert market.vehicles == 4
+    assert market.home_bids == 8
+    assert len(np.unique(market.fleet.current_energy)) == 400
+    prices = np.array([market.run_tick()['price'] for _ in range(24)])
+    assert prices.shape == (24, 100)
+    # Home draws differ between scenarios.
+    assert len(np.unique(market.homes.amounts.reshape(100, 8)[:, 0])) == 100
+
+    with pytest.raises(ValueError):
+        build_batched_market(load_scenario(), 2)
+
+def test_rejects_uneven_split():
+    with pytest.raises(ValueError):
+        BatchedMarket(3, weekday_winter, RuleBasedEVFleet(make_specs([10.0] * 4), mdr, driving_schedule, 9.0, 14.0))
@@ -0,0 +1,30 @@
+import json
+
+from benchmark import build_market, main, run_benchmarks, split_mix
+
+def test_split_mix():
+    assert split_mix(10, {'rbev': 0.4, 'loev': 0.1, 'home': 0.5}) == {'rbev': 4, 'loev': 1, 'home': 5}
+    assert sum(split_mix(7, {'rbev': 1, 'home': 1}).values()) == 7
+
+def test_build_market():
+    market = build_market(20, {'rbev': 0.5, 'home': 0.5})
+    assert len(market.ders) == 20
+
+def test_run_benchmarks():
+    report = run_benchmarks([10], {'rbev': 0.4, 'loev': 0.2, 'home': 0.4}, ['loop', 'vectorized'], ['dp'], ticks=3)
+    assert len(report['results']) == 2
+    result = report['results'][0]
+    assert result['ticks_per_sec'] > 0
+    assert result['phases']['tick']['count'] == 3
+    assert result['phases']['update_model']['count'] == 2
+    assert result['max_rss_kb'] > 0
+
+def test_shared_process_has_no_rss():
+    report = run_benchmarks([10], {'rbev': 0.5, 'home': 0.5}, ['loop'], ['dp'], ticks=2, isolate=False)
+    assert 'max_rss_kb' not in report['results'][0]
+
+def test_main_writes_json(tmp_path):
+    output = tmp_path / 'bench.json'
+    main(['--sizes', '5', '--ticks', '2', '--clearing', 'vectorized', '--output', str(output)])
+    report = json.loads(output.read_text())
+    assert report['results'][0]['clearing'] == 'vectorized'
@@ -0,0 +1,107 @@
+import random
+
+import numpy as np
+import pytest
+
+from bid_book import BidBook
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import Home, HomePopulation, gen_schedule_by_prices_and_mean
+from market import Bid, DoubleAuctionMarketController
+from optimized_ev import OptimizedEV
+from recording_wrapper import RecordingWrapper
+from rule_based_ev import RuleBasedEV
+from rule_based_ev_fleet import RuleBasedEVFleet
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+def test_append_and_view():
+    book = BidBook(capacity=1)
+    creator = object()
+    index = book.register(creator)
+    assert book.register(creator) == index
+    book.append(1.0, None, True, index)
+    book.append(2.0, 3.0, False, index)
+    assert book.size == 2
+    view = book.view(0)
+    assert view.amount is None
+    assert view.discharge
+    assert view.creator is creator
+    view.amount = 4.0
+    assert book.amount[0] == 4.0
+    assert book.view(0) is view
+
+def test_extend_and_reuse():
+    book = BidBook(capacity=2)
+    start = book.extend(np.full(5, 3.0), np.arange(5.0), False, book.register('a'))
+    assert start == 0
+    assert book.amount[:5].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    price = book.price
+    book.clear()
+    book.add_bid(Bid(1.0, 2.0, True, 'b'))
+    assert book.size == 1
+    assert book.price is price
+    assert book.creators == ['a', 'b']
+
+def make_market(bid_book, clearing='loop'):
+    ev_spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=10.0, operating_range=(0.2, 0.8))
+    home_schedule = gen_schedule_by_prices_and_mean(weekday_winter, 2.0)
+    mean = weekday_winter.mean()
+
+    market = DoubleAuctionMarketController(RecordingWrapper(TimeOfUseGrid(weekday_winter)), 1, clearing=clearing, bid_book=bid_book)
+    for i in range(3):
+        market.add_der(RecordingWrapper(RuleBasedEV(ev_spec, mdr, driving_schedule, (weekday_winter.min() + mean) / 2, (weekday_winter.max() + mean) / 2)), f'rbev_{i}')
+    market.add_der(RecordingWrapper(OptimizedEV(ev_spec, mdr, driving_schedule, weekday_winter.copy(), solver='dp')), 'loev_0')
+    for i in range(3):
+        market.add_der(RecordingWrapper(Home(home_schedule, 0.1)), f'home_{i}')
+    specs = [EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=e, operating_range=(0.2, 0.8)) for e in (8.0, 20.0, 30.0)]
+    market.add_der(RuleBasedEVFleet(specs, mdr, driving_schedule, 10.0, 14.0), 'fleet')
+    market.add_der(HomePopulation(5, home_schedule, 0.1, seed=1, aggregate=False), 'homes')
+    market.add_der(HomePopulation(5, home_schedule, 0.1, seed=2), 'homes_total')
+    return market
+
+def run(market, ticks):
+    random.seed(0)
+    results = []
+    for _ in range(ticks):
+        stats = market.run_tick()
+        ders = {name: d.post_bid_stats for name, d in market.ders.items() if isinstance(d, RecordingWrapper)}
+        results.append((stats, market.dso.post_bid_stats, ders, market.ders['fleet'].current_energy.tolist()))
+    return results
+
+def assert_close(expected, actual):
+    # The book sums amounts with np.cumsum, so partial fills can differ in the last bits.
+    if isinstance(expected, dict):
+        assert expected.keys() == actual.keys()
+        for key in expected:
+            assert_close(expected[key], actual[key])
+    elif isinstance(expected, (list, tuple)):
+        assert len(expected) == len(actual)
+        for e, a in zip(expected, actual):
+            assert_close(e, a)
+    elif isinstance(expected, (str, bool, type(None))):
+        assert expected == actual
+    else:
+        assert expected == pytest.approx(actual, rel=1e-12, abs=1e-12)
+
+@pytest.mark.parametrize('clearing', ['loop', 'vectorized'])
+def test_book_tick_matches_bid_objects(clearing):
+    expected = run(make_market(None, clearing), 72)
+    actual = run(make_market(BidBook(), clearing), 72)
+    assert_close(expected, actual)
+
+def test_book_reused_across_ticks():
+    book = BidBook()
+    market = make_market(book)
+    market.run_tick()
+    arrays = (book.price, book.amount, book.discharge, book.creator)
+    views = list(book.views)
+    for _ in range(5):
+        market.run_tick()
+    assert arrays == (book.price, book.amount, book.discharge, book.creator)
+    assert all(a is b for a, b in zip(views, book.views))
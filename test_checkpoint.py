@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from checkpoint import Checkpointer, load_checkpoint, save_checkpoint
+from ev import EVSpec
+from feeder import FeederMarket
+from grid import TimeOfUseGrid
+from home import HomePopulation
+from market import DoubleAuctionMarketController
+from rule_based_ev_fleet import RuleBasedEVFleet
+from scenario import build_market, load_scenario, run_day, run_scenario
+
+def small_scenario(days: int) -> dict:
+    return load_scenario(overrides={'days': days, 'fleet': {'rbev': 2, 'loev': 2, 'home': 3}})
+
+def hourly(days: list[dict]) -> list[dict]:
+    return [day['hourly'] for day in days]
+
+def test_resume_matches_uninterrupted(tmp_path):
+    path = str(tmp_path / 'run.npz')
+    scenario = small_scenario(3)
+    market = build_market(scenario)
+    run_day(market, scenario['fleet'])
+    save_checkpoint(path, market, ticks=24)
+    expected = [run_day(market, scenario['fleet']) for _ in range(2)]
+
+    # A fresh market in a different random state.
+    np.random.seed(1)
+    market = build_market(scenario)
+    run_day(market, scenario['fleet'])
+    market.run_tick()
+    meta = load_checkpoint(path, market)
+    assert meta['ticks'] == 24
+    assert market.t == 0
+    resumed = [run_day(market, scenario['fleet']) for _ in range(2)]
+    assert hourly(resumed) == hourly(expected)
+
+def test_run_scenario_resume(tmp_path):
+    path = str(tmp_path / 'run.npz')
+    expected = run_scenario(small_scenario(3))
+
+    assert len(run_scenario(small_scenario(2), checkpoint=path)) == 2
+    seen = []
+    days = run_scenario(small_scenario(3), lambda day_num, day: seen.append(day_num), checkpoint=path, resume=True)
+    assert seen == [3]
+    assert hourly(days) == hourly(expected[2:])
+
+def build_array_market() -> DoubleAuctionMarketController:
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20.0, operating_range=(0.2, 0.8))
+    prices = [7.6] * 7 + [15.8] * 4 + [12.2] * 6 + [15.8] * 2 + [7.6] * 5
+    mdr = [6.0] * 24
+    driving_schedule = [0.0] * 7 + [2.0] + [0.0] * 16
+    market = DoubleAuctionMarketController(TimeOfUseGrid(prices), 1)
+    market.add_der(RuleBasedEVFleet([spec] * 50, mdr, driving_schedule, 10.0, 14.0), 'fleet')
+    feeder = FeederMarket()
+    feeder.add_der(RuleBasedEVFleet([spec] * 10, mdr, driving_schedule, 9.0, 15.0), 'fleet')
+    feeder.add_der(HomePopulation(20, [1.0] * 24, 0.2, seed=3), 'homes')
+    market.add_der(feeder, 'feeder')
+    return market
+
+def test_array_ders_and_feeders(tmp_path):
+    path = str(tmp_path / 'arrays.npz')
+    market = build_array_market()
+    for _ in range(30):
+        market.run_tick()
+    save_checkpoint(path, market, compress=True)
+    expected = [market.run_tick()['price'] for _ in range(24)]
+    energy = market.ders['fleet'].current_energy.copy()
+
+    market = build_array_market()
+    load_checkpoint(path, market)
+    assert market.t == 6
+    assert market.ders['feeder'].ders['homes'].ticks == 30
+    assert [market.run_tick()['price'] for _ in range(24)] == expected
+    assert np.array_equal(market.ders['fleet'].current_energy, energy)
+
+def test_mismatched_market(tmp_path):
+    path = str(tmp_path / 'run.npz')
+    save_checkpoint(path, build_market(small_scenario(1)))
+    with pytest.raises(ValueError):
+        load_checkpoint(path, build_array_market())
+
+def test_checkpointer_interval(tmp_path):
+    path = str(tmp_path / 'run.npz')
+    market = build_array_market()
+    checkpointer = Checkpointer(path, market, interval=10)
+    for _ in range(25):
+        market.run_tick()
+        checkpointer.advance()
+    assert checkpointer.saved == 2
+
+    market = build_array_market()
+    checkpointer = Checkpointer(path, market, interval=10)
+    assert checkpointer.restore() == 20
+    assert market.t == 20
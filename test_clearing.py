@@ -0,0 +1,135 @@
+import random
+
+import numpy as np
+import pytest
+
+from clearing import clear_levels, clear_loop, clear_vectorized, price_levels
+from market import Bid, DoubleAuctionMarketController
+
+class MockDER:
+    def __init__(self, name):
+        self.name = name
+
+def gen_book(rng: random.Random, negative=False):
+    # Prices and amounts come from small grids so that ties are common.
+    # Amounts are multiples of 0.25 so running totals are exact in both engines.
+    prices = [0.0, 7.6, 12.2, 15.8]
+    low = -4 if negative else 0
+    sources = [Bid(rng.choice(prices), rng.randint(low, 40) / 4, True, MockDER(f'source_{i}'))
+               for i in range(rng.randint(1, 30))]
+    sinks = [Bid(rng.choice(prices), rng.randint(low, 40) / 4, False, MockDER(f'sink_{i}'))
+             for i in range(rng.randint(1, 30))]
+    if rng.random() < 0.8:
+        # The grid's unbounded source bid.
+        sources.insert(0, Bid(rng.choice(prices), None, True, MockDER('grid')))
+    return sources, sinks
+
+def copy_bids(bids):
+    return [Bid(b.price_per_kwh, b.amount, b.discharge, b.creator) for b in bids]
+
+def results(bids):
+    return [(b.creator.name, b.price_per_kwh, b.amount) for b in bids]
+
+@pytest.mark.parametrize('negative', [False, True])
+def test_vectorized_matches_loop(negative):
+    rng = random.Random(0)
+    for _ in range(500):
+        sources, sinks = gen_book(rng, negative)
+        loop_sources, loop_sinks = copy_bids(sources), copy_bids(sinks)
+        vec_sources, vec_sinks = copy_bids(sources), copy_bids(sinks)
+
+        assert clear_loop(loop_sources, loop_sinks) == clear_vectorized(vec_sources, vec_sinks)
+        assert results(loop_sources) == results(vec_sources)
+        assert results(loop_sinks) == results(vec_sinks)
+
+def by_name(bids):
+    return sorted(results(bids))
+
+@pytest.mark.parametrize('negative', [False, True])
+def test_levels_matches_vectorized(negative):
+    rng = random.Random(1)
+    for _ in range(500):
+        sources, sinks = gen_book(rng, negative)
+        vec_sources, vec_sinks = copy_bids(sources), copy_bids(sinks)
+        level_sources, level_sinks = copy_bids(sources), copy_bids(sinks)
+
+        assert clear_levels(level_sources, level_sinks) == clear_vectorized(vec_sources, vec_sinks)
+        assert by_name(level_sources) == by_name(vec_sources)
+        assert by_name(level_sinks) == by_name(vec_sinks)
+
+def test_levels_pro_rata():
+    rng = random.Random(2)
+    for _ in range(200):
+        sources, sinks = gen_book(rng)
+        sources = [b for b in sources if b.amount is None or b.amount > 0]
+        sinks = [b for b in sinks if b.amount > 0]
+        if len(sources) == 0 or len(sinks) == 0:
+            continue
+        requested = {b.creator.name: b.amount for b in sources + sinks}
+        price = clear_levels(sources, sinks, tick_size=5.0)
+        assert all(b.price_per_kwh == price for b in sources + sinks)
+        for b in sources + sinks:
+            assert requested[b.creator.name] is None or 0.0 <= b.amount <= requested[b.creator.name] + 1e-9
+        # Pro-rata fills balance unless one side ran out.
+        sink_total = sum(b.amount for b in sinks)
+        source_total = sum(b.amount for b in sources)
+        if sink_total < sum(requested[b.creator.name] for b in sinks) and all(requested[b.creator.name] is not None for b in sources):
+            if source_total < sum(requested[b.creator.name] for b in sources):
+                assert sink_total == pytest.approx(source_total)
+
+def test_levels_marginal_bucket_shared():
+    sources = [Bid(10.0, 4.0, True, MockDER('a')), Bid(10.5, 4.0, True, MockDER('b'))]
+    sinks = [Bid(12.0, 2.0, False, MockDER('c')), Bid(12.0, 2.0, False, MockDER('d'))]
+    price = clear_levels(sources, sinks, tick_size=1.0)
+    assert price == pytest.approx((12.0 + 10.25) / 2)
+    assert [b.amount for b in sources] == [2.0, 2.0]
+    assert [b.amount for b in sinks] == [2.0, 2.0]
+
+@pytest.mark.parametrize('tick_size', [0.01, 1.0, 1e-9])
+def test_bucketed_levels_match_unique(tick_size):
+    rng = np.random.default_rng(5)
+    prices = rng.uniform(0.0, 30.0, 500)
+    amounts = rng.uniform(0.0, 10.0, 500)
+    levels, _, totals = price_levels(prices, amounts, tick_size)
+    keys, expected = np.unique(np.floor(prices / tick_size), return_inverse=True)
+    assert np.array_equal(levels, expected)
+    assert np.array_equal(totals, np.bincount(expected, weights=amounts, minlength=len(keys)))
+
+def test_unbounded_source_partially_filled():
+    grid = MockDER('grid')
+    sources = [Bid(10.0, None, True, grid)]
+    sinks = [Bid(10.0, 3.0, False, MockDER('a')), Bid(10.0, 2.0, False, MockDER('b'))]
+    price = clear_vectorized(sources, sinks)
+    assert price == 10.0
+    assert sources[0].amount == 5.0
+    assert [b.amount for b in sinks] == [3.0, 2.0]
+
+class RecordingDER:
+    def __init__(self, bid):
+        self.bid = bid
+        self.result = None
+
+    def make_bid(self, t, grid_price):
+        return Bid(self.bid[0], self.bid[1], self.bid[2], self)
+
+    def collect_bid_results(self, t, bid: Bid):
+        self.result = (bid.price_per_kwh, bid.amount)
+
+    def post_bid(self, t, price):
+        return {}
+
+# With a tick size the price comes from the partly taken marginal bucket (the grid's) instead of the last full bid.
+@pytest.mark.parametrize('clearing, tick_size, price', [('loop', 0.0, 7.9), ('vectorized', 0.0, 7.9), ('levels', 0.0, 7.9), ('levels', 0.5, 15.8)])
+def test_controller_clearing_engine(clearing, tick_size, price):
+    dso = RecordingDER((15.8, None, True))
+    market = DoubleAuctionMarketController(dso, 1, clearing=clearing, tick_size=tick_size)
+    ders = [RecordingDER((15.8, 4.0, False)), RecordingDER((0.0, 3.0, True)), RecordingDER((20.0, 2.0, False))]
+    for i, d in enumerate(ders):
+        market.add_der(d, f'der_{i}')
+    stats = market.run_tick()
+    assert stats['price'] == price
+    assert [d.result for d in ders] == [(price, 4.0), (price, 3.0), (price, 2.0)]
+
+def test_tick_size_needs_levels():
+    with pytest.raises(ValueError):
+        DoubleAuctionMarketController(None, 1, clearing='loop', tick_size=1.0)
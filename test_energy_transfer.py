@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from energy_transfer import CHARGE, DISCHARGE, IDLE, ev_bounds, transfer_energy, transfer_ev_energy
+from ev import EV, EVSpec
+
+DECISIONS = {CHARGE: 'charge', DISCHARGE: 'discharge', IDLE: 'nope'}
+
+def random_evs(rng, n):
+    evs = []
+    for _ in range(n):
+        low = rng.uniform(0.0, 0.3)
+        spec = EVSpec(
+            capacity=float(rng.choice([40.0, 60.0, 100.0])),
+            charge_rate_max=float(rng.uniform(3.0, 11.0)),
+            discharge_rate_max=float(rng.uniform(3.0, 11.0)),
+            initial_energy=0.0,
+            operating_range=(low, rng.uniform(0.7, 1.0)),
+        )
+        ev = EV(spec, [10.0] * 24, [0.0] * 24)
+        # Including batteries outside their operating range.
+        ev.current_energy = float(rng.uniform(-5.0, 1.1 * spec.capacity))
+        evs.append(ev)
+    return evs
+
+@pytest.mark.parametrize('dt', [1, 0.5])
+@pytest.mark.parametrize('range', [None, (0.3, 0.6)])
+def test_matches_scalar(dt, range):
+    rng = np.random.default_rng(0)
+    n = 300
+    evs = random_evs(rng, n)
+    direction = rng.choice([IDLE, CHARGE, DISCHARGE], n)
+    amount = rng.uniform(0.0, 15.0, n)
+    # np.inf asks for the full rate, like amount=None.
+    amount[rng.random(n) < 0.2] = np.inf
+
+    expected_transfer = []
+    expected_energy = []
+    for ev, d, a in zip(random_evs(np.random.default_rng(0), n), direction.tolist(), amount.tolist()):
+        expected_transfer.append(ev.determine_energy_transfer(dt, DECISIONS[d], range, None if np.isinf(a) else a))
+        expected_energy.append(ev.current_energy)
+
+    transfer = transfer_ev_energy(evs, direction, amount, dt=dt, range=range)
+    assert [ev.current_energy for ev in evs] == expected_energy
+    assert transfer.tolist() == expected_transfer
+
+def test_shared_direction():
+    evs = random_evs(np.random.default_rng(1), 10)
+    bounds = ev_bounds(evs)
+    energy = np.array([ev.current_energy for ev in evs])
+    driven, transfer = transfer_energy(energy, DISCHARGE, 2.0, **bounds)
+    assert np.all(transfer <= 0.0)
+    assert np.all(transfer >= -2.0)
+    assert np.array_equal(driven, transfer_energy(energy, np.full(10, DISCHARGE), np.full(10, 2.0), **bounds)[0])
@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from ev import EVSpec
+from feeder import FeederClearingPlanner, FeederMarket
+from grid import TimeOfUseGrid
+from home import HomePopulation
+from market import Bid, DoubleAuctionMarketController
+from rule_based_ev import RuleBasedEV
+
+weekday_winter = [7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                  12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6]
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+# Bids the same every tick and records its results.
+class FixedDER:
+    def __init__(self, price, amount, discharge):
+        self.price = price
+        self.amount = amount
+        self.discharge = discharge
+        self.results = []
+
+    def make_bid(self, t, grid_price):
+        return Bid(self.price, self.amount, self.discharge, self)
+
+    def collect_bid_results(self, t, bid: Bid):
+        self.results.append((bid.price_per_kwh, bid.amount))
+
+    def post_bid(self, t, price):
+        return {}
+
+def flat_grid():
+    return TimeOfUseGrid([10.0] * 24)
+
+def test_local_trade_and_import():
+    feeder = FeederMarket()
+    source = FixedDER(1.0, 5.0, True)
+    sink = FixedDER(10.0, 5.0, False)
+    other_sink = FixedDER(10.0, 3.0, False)
+    feeder.add_der(source, 'source')
+    feeder.add_der(sink, 'sink')
+    feeder.add_der(other_sink, 'other_sink')
+    market = DoubleAuctionMarketController(flat_grid(), 1)
+    market.add_der(feeder, 'feeder')
+
+    stats = market.run_tick()
+    # Only the unmatched 3 kWh reach the upstream market.
+    assert stats['sinks_total'] == 1
+    assert source.results == [(5.5, 5.0)]
+    assert sink.results == [(5.5, 5.0)]
+    assert other_sink.results == [(10.0, 3.0)]
+
+def test_export():
+    feeder = FeederMarket()
+    source = FixedDER(1.0, 5.0, True)
+    feeder.add_der(source, 'source')
+    sink = FixedDER(10.0, 2.0, False)
+    market = DoubleAuctionMarketController(flat_grid(), 1)
+    market.add_der(feeder, 'feeder')
+    market.add_der(sink, 'sink')
+
+    stats = market.run_tick()
+    assert stats['price'] == 10.0
+    assert source.results == [(10.0, 2.0)]
+    assert sink.results == [(10.0, 2.0)]
+    assert [(b.price_per_kwh, b.amount) for b in feeder.residual_bids] == [(1.0, 5.0)]
+
+@pytest.mark.parametrize('nested', [False, True])
+def test_sinks_match_flat_market(nested):
+    amounts = [4.0, 2.5, 1.0, 6.0]
+    flat = [FixedDER(12.0, a, False) for a in amounts]
+    market = DoubleAuctionMarketController(flat_grid(), 1)
+    for i, der in enumerate(flat):
+        market.add_der(der, f'der_{i}')
+    market.run_tick()
+
+    fed = [FixedDER(12.0, a, False) for a in amounts]
+    upstream = DoubleAuctionMarketController(flat_grid(), 1)
+    feeders = [FeederMarket(), FeederMarket()]
+    for i, der in enumerate(fed):
+        feeders[i % 2].add_der(der, f'der_{i}')
+    if nested:
+        top = FeederMarket()
+        top.add_der(feeders[0], 'feeder_0')
+        top.add_der(feeders[1], 'feeder_1')
+        upstream.add_der(top, 'top')
+    else:
+        upstream.add_der(feeders[0], 'feeder_0')
+        upstream.add_der(feeders[1], 'feeder_1')
+    upstream.run_tick()
+
+    for a, b in zip(flat, fed):
+        assert b.results == pytest.approx(a.results)
+
+def build_feeders(count: int) -> tuple[list[FeederMarket], list[RuleBasedEV]]:
+    rng = np.random.default_rng(0)
+    feeders = []
+    evs = []
+    for f in range(count):
+        feeder = FeederMarket(clearing='vectorized')
+        for i in range(3):
+            spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10,
+                          initial_energy=float(rng.uniform(10.0, 30.0)), operating_range=(0.2, 0.8))
+            ev = RuleBasedEV(spec, mdr, driving_schedule, 10.0, 14.0)
+            feeder.add_der(ev, f'rbev_{i}')
+            evs.append(ev)
+        feeder.add_der(HomePopulation(5, weekday_winter, 0.2, seed=f), 'homes')
+        feeders.append(feeder)
+    return feeders, evs
+
+def run_day(feeders: list[FeederMarket], planner=None) -> list[float]:
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    if planner is not None:
+        market.add_planner(planner)
+    for i, feeder in enumerate(feeders):
+        market.add_der(feeder, f'feeder_{i}')
+    return [market.run_tick()['price'] for _ in range(24)]
+
+def test_concurrent_matches_serial():
+    feeders, evs = build_feeders(4)
+    expected_prices = run_day(feeders)
+    expected_energy = [ev.current_energy for ev in evs]
+
+    feeders, evs = build_feeders(4)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        prices = run_day(feeders, FeederClearingPlanner(executor))
+    assert prices == expected_prices
+    assert [ev.current_energy for ev in evs] == expected_energy
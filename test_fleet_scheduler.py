@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from ev import EVSpec
+from fleet_scheduler import FleetScheduler
+from grid import TimeOfUseGrid
+from market import DoubleAuctionMarketController
+from optimized_ev import OptimizedEV
+from recording_wrapper import RecordingWrapper
+from schedule import solve_dp, solve_heuristic, solve_pulp
+from schedule_cache import ScheduleCache
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+@pytest.fixture
+def evs():
+    rng = np.random.default_rng(0)
+    evs = []
+    for i in range(6):
+        spec = EVSpec(
+            capacity=40,
+            charge_rate_max=10,
+            discharge_rate_max=10,
+            initial_energy=10.0 + 3 * i,
+            operating_range=(0.2, 0.8),
+        )
+        evs.append(OptimizedEV(
+            spec=spec,
+            mdr=mdr,
+            driving_schedule=driving_schedule,
+            history=weekday_winter * rng.uniform(0.8, 1.2, 24),
+        ))
+    return evs
+
+def test_plan_matches_individual_solves(evs: list[OptimizedEV]):
+    FleetScheduler().plan(0, weekday_winter[0], [RecordingWrapper(ev) for ev in evs])
+    for ev in evs:
+        assert ev.schedule_presolved
+        problem = ev.schedule_problem()
+        assert problem.cost(ev.schedule) == pytest.approx(problem.cost(solve_pulp(problem)), abs=1e-6)
+
+def test_plan_only_at_midnight(evs: list[OptimizedEV]):
+    scheduler = FleetScheduler()
+    scheduler.plan(5, weekday_winter[5], evs)
+    assert scheduler.fleet_size == 0
+    assert not any(ev.schedule_presolved for ev in evs)
+
+def test_market_uses_planned_schedules(evs: list[OptimizedEV]):
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    scheduler = FleetScheduler()
+    market.add_planner(scheduler)
+    for i, ev in enumerate(evs):
+        ev.update_model = None # Would fail if the EV tried to solve its own model.
+        market.add_der(RecordingWrapper(ev), f'loev_{i}')
+    market.run_tick()
+    assert scheduler.fleet_size == len(evs)
+    assert not any(ev.schedule_presolved for ev in evs)
+
+def test_per_ev_solver_and_cache(evs: list[OptimizedEV]):
+    cache = ScheduleCache()
+    dp_ev = OptimizedEV(evs[0].spec, mdr, driving_schedule, weekday_winter.copy(), solver='dp', cache=cache)
+    heuristic_ev = OptimizedEV(evs[0].spec, mdr, driving_schedule, weekday_winter.copy(), solver='heuristic')
+    scheduler = FleetScheduler()
+    scheduler.plan(0, weekday_winter[0], evs + [dp_ev, heuristic_ev])
+    assert scheduler.fleet_size == len(evs) + 2
+    assert np.array_equal(dp_ev.schedule, solve_dp(dp_ev.schedule_problem()))
+    assert np.array_equal(heuristic_ev.schedule, solve_heuristic(heuristic_ev.schedule_problem()))
+    assert cache.misses == 1
+
+    # The next day's identical problem comes from the cache.
+    dp_ev.schedule = None
+    scheduler.plan(0, weekday_winter[0], [dp_ev])
+    assert cache.hits == 1
+    assert np.array_equal(dp_ev.schedule, solve_dp(dp_ev.schedule_problem()))
+
+def test_infeasible_ev_falls_back(evs: list[OptimizedEV]):
+    evs[0].current_energy = 0.0
+    scheduler = FleetScheduler()
+    scheduler.plan(0, weekday_winter[0], evs)
+    assert scheduler.fallbacks == 1
+    assert evs[0].fallbacks == 1
+    assert all(ev.fallbacks == 0 for ev in evs[1:])
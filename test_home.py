@@ -1,7 +1,7 @@
 import pytest
 import numpy as np
 
-from home import Home, gen_schedule_by_prices_and_mean
+from home import Home, HomePopulation, gen_schedule_by_prices_and_mean
 
 @pytest.fixture
 def home():
@@ -17,4 +17,34 @@ def test_make_bid(home: Home):
     bid = home.make_bid(0, 100.0)
     assert bid.creator == home
     assert bid.price_per_kwh == 100.0
-    assert not bid.discharge
\ No newline at end of file
+    assert not bid.discharge
+
+@pytest.fixture
+def schedule():
+    weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                               12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+    return gen_schedule_by_prices_and_mean(weekday_winter, 2.0)
+
+def test_population_reproducible(schedule):
+    a = HomePopulation(100, schedule, 0.1, seed=3, aggregate=False)
+    b = HomePopulation(100, schedule, 0.1, seed=3, aggregate=False)
+    for t in range(48):
+        assert [x.amount for x in a.make_bid(t % 24, 10.0)] == [x.amount for x in b.make_bid(t % 24, 10.0)]
+
+def test_population_draws_per_home(schedule):
+    small = HomePopulation(10, schedule, 0.1, seed=3)
+    large = HomePopulation(20, schedule, 0.1, seed=3)
+    for t in range(24):
+        small.make_bid(t, 10.0)
+        large.make_bid(t, 10.0)
+        assert np.array_equal(small.amounts, large.amounts[:10])
+
+def test_population_statistics(schedule):
+    population = HomePopulation(10000, schedule, 0.1, seed=0)
+    for t in range(24):
+        bid = population.make_bid(t, 10.0)
+        assert bid.amount == pytest.approx(population.amounts.sum())
+        assert bid.price_per_kwh == 10.0
+        assert not bid.discharge
+        assert (np.abs(population.amounts - schedule[t]) <= 0.1 * schedule[t] + 1e-12).all()
+        assert population.amounts.mean() == pytest.approx(schedule[t], rel=0.01)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from ev import EV, EVSpec
+import lookahead
+from lookahead import FleetLookahead, lookahead_table
+from rule_based_ev_fleet import RuleBasedEVFleet
+
+# The original per-tick loop.
+def reference(mdr, driving_schedule, current_energy, t, window=3):
+    skips = 0
+    lost_to_driving = 0.0
+    min_charge_amount = 0.0
+    for i in range(1, window + 1):
+        target = (t + i) % 24
+        if driving_schedule[target] != 0.0:
+            skips += 1
+            lost_to_driving += driving_schedule[target]
+        rem = i - skips
+        deficit = mdr[target] + lost_to_driving - current_energy
+        min_charge_amount = max(min_charge_amount, deficit / (rem+1))
+    return min_charge_amount
+
+def random_schedules(rng, n):
+    mdr = rng.choice([6.0, 10.0, 15.0, 20.0], (n, 24))
+    driving_schedule = rng.choice([0.0, 0.0, 0.0, 2.0, 4.5], (n, 24))
+    return mdr, driving_schedule
+
+@pytest.mark.parametrize('window', [1, 3, 6, 30])
+def test_matches_loop(window):
+    rng = np.random.default_rng(window)
+    mdr, driving_schedule = random_schedules(rng, 5)
+    energies = rng.uniform(0.0, 40.0, 20)
+    for m, d in zip(mdr.tolist(), driving_schedule.tolist()):
+        table = lookahead_table(m, d, window)
+        for t in range(24):
+            expected = [reference(m, d, e, t, window) for e in energies.tolist()]
+            assert [table.minimum_charge_amount(t, e) for e in energies.tolist()] == expected
+            assert table.minimum_charge_amounts(t, energies).tolist() == expected
+
+def test_tables_are_shared():
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20.0, operating_range=(0.2, 0.8))
+    mdr = [10.0] * 24
+    driving_schedule = [0.0] * 7 + [2.0] + [0.0] * 16
+    a = EV(spec, mdr, driving_schedule)
+    b = EV(spec, list(mdr), np.array(driving_schedule))
+    assert a.lookahead is b.lookahead
+    assert EV(spec, mdr, driving_schedule, lookahead_window=5).lookahead is not a.lookahead
+
+@pytest.mark.parametrize('distinct', [1, 4])
+def test_fleet_matches_vehicles(distinct):
+    rng = np.random.default_rng(distinct)
+    n = 40
+    mdr, driving_schedule = random_schedules(rng, distinct)
+    rows = rng.integers(0, distinct, n)
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20.0, operating_range=(0.2, 0.8))
+    fleet = RuleBasedEVFleet([spec] * n, mdr[rows], driving_schedule[rows], 10.0, 14.0)
+    fleet.current_energy = rng.uniform(0.0, 40.0, n)
+    assert len(fleet.lookahead.tables) == len(np.unique(rows))
+    for t in range(24):
+        expected = [reference(mdr[r].tolist(), driving_schedule[r].tolist(), e, t) for r, e in zip(rows, fleet.current_energy.tolist())]
+        assert fleet.minimum_charge_amount(t).tolist() == expected
+
+def test_empty_fleet():
+    lookahead = FleetLookahead(np.zeros((0, 24)), np.zeros((0, 24)))
+    assert lookahead.minimum_charge_amount(0, np.zeros(0)).shape == (0,)
+
+def test_table_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(lookahead, 'MAX_TABLES', 4)
+    monkeypatch.setattr(lookahead, '_TABLES', type(lookahead._TABLES)())
+    rng = np.random.default_rng(0)
+    mdr, driving_schedule = random_schedules(rng, 10)
+    first = lookahead_table(mdr[0], driving_schedule[0])
+    for m, d in zip(mdr[1:], driving_schedule[1:]):
+        lookahead_table(m, d)
+    assert len(lookahead._TABLES) == 4
+    assert lookahead_table(mdr[0], driving_schedule[0]) is not first
+    assert lookahead_table(mdr[-1], driving_schedule[-1]) is lookahead_table(mdr[-1], driving_schedule[-1])
+
+    # Fleet tables don't go through the cache.
+    keys = list(lookahead._TABLES)
+    FleetLookahead(*random_schedules(rng, 20))
+    assert list(lookahead._TABLES) == keys
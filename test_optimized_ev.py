@@ -3,6 +3,7 @@ import numpy as np
 
 from ev import EVSpec
 from optimized_ev import OptimizedEV
+from schedule import schedule_policy, solve_dp, solve_heuristic, solve_pulp
 
 @pytest.fixture
 def ev():
@@ -34,4 +35,87 @@ def test_make_bid(ev: OptimizedEV):
     if bid.discharge:
         assert bid.amount <= ev.spec.discharge_rate_max
     else:
-        assert bid.amount <= ev.spec.charge_rate_max
\ No newline at end of file
+        assert bid.amount <= ev.spec.charge_rate_max
+
+def test_make_bid_dp_solver(ev: OptimizedEV):
+    ev = OptimizedEV(spec=ev.spec, mdr=ev.mdr, driving_schedule=ev.driving_schedule, history=ev.history, solver='dp')
+    ev.make_bid(0, None)
+    problem = ev.schedule_problem()
+    assert problem.cost(ev.schedule) == pytest.approx(problem.cost(solve_pulp(problem)))
+
+def test_no_replan_by_default(ev: OptimizedEV):
+    ev.make_bid(0, 7.6)
+    ev.current_energy -= 5.0
+    ev.make_bid(1, 7.6)
+    assert ev.replans == 0
+
+def test_replan_on_deviation(ev: OptimizedEV):
+    ev = OptimizedEV(spec=ev.spec, mdr=ev.mdr, driving_schedule=ev.driving_schedule, history=ev.history,
+                     solver='dp', replan_threshold=0.5)
+    ev.make_bid(0, 7.6)
+    planned = ev.planned_energy.copy()
+    assert planned[0] == ev.current_energy
+
+    # Close enough to the plan.
+    ev.current_energy = planned[1] + 0.4
+    ev.make_bid(1, 7.6)
+    assert ev.replans == 0
+
+    # A partial fill leaves the vehicle short.
+    ev.current_energy = planned[2] - 4.0
+    ev.make_bid(2, 7.6)
+    assert ev.replans == 1
+    assert ev.planned_energy[2] == ev.current_energy
+    policy = schedule_policy(ev.schedule_problem())
+    assert np.array_equal(ev.schedule[2:], policy.schedule_from(2, ev.current_energy))
+    assert ev.planned_energy[-1] >= ev.mdr[23] - 1e-9
+
+def test_policy_matches_dp(ev: OptimizedEV):
+    problem = ev.schedule_problem()
+    policy = schedule_policy(problem)
+    schedule = solve_dp(problem)
+    assert np.array_equal(policy.schedule_from(0, problem.current_energy), schedule)
+
+    # Following the plan, the policy's continuation from any hour is the rest of the plan.
+    energy = problem.current_energy
+    for t in range(24):
+        assert policy.feasible(t, energy)
+        assert np.allclose(policy.schedule_from(t, energy), schedule[t:])
+        energy += schedule[t] - problem.driving_schedule[t]
+
+def test_model_built_once(ev: OptimizedEV):
+    for _ in range(2):
+        for t in range(24):
+            ev.make_bid(t, 7.6)
+            ev.post_bid(t, 7.6)
+    assert ev.solve.builds == 1
+
+def test_infeasible_day_falls_back(ev: OptimizedEV):
+    # Below the operating range, no schedule meets every constraint.
+    ev.current_energy = 0.0
+    ev.make_bid(0, 7.6)
+    assert ev.fallbacks == 1
+    assert np.array_equal(ev.schedule, solve_heuristic(ev.schedule_problem()))
+
+def test_infeasible_replan_is_remembered(ev: OptimizedEV, monkeypatch):
+    ev.replan_threshold = 0.5
+    ev.make_bid(0, 7.6)
+    calls = []
+    monkeypatch.setattr('optimized_ev.schedule_policy', lambda problem: calls.append(problem))
+    for t in range(1, 4):
+        ev.current_energy = 0.0
+        ev.make_bid(t, 7.6)
+    assert len(calls) == 1
+    assert ev.replans == 0
+
+def test_counters_in_stats_and_state(ev: OptimizedEV):
+    ev.current_energy = 0.0
+    ev.make_bid(0, 7.6)
+    stats = ev.post_bid(0, 7.6)
+    assert stats['fallbacks'] == 1
+    assert stats['replans'] == 0
+
+    state = ev.get_state()
+    ev.fallbacks = 0
+    ev.set_state(state)
+    assert ev.fallbacks == 1
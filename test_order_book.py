@@ -0,0 +1,121 @@
+import random
+
+import numpy as np
+import pytest
+
+from clearing import clear_vectorized
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import Home, HomePopulation, gen_schedule_by_prices_and_mean
+from market import Bid, DoubleAuctionMarketController
+from order_book import OrderBook, order_key
+from rule_based_ev import RuleBasedEV
+from rule_based_ev_fleet import RuleBasedEVFleet
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+class Creator:
+    def collect_bid_results(self, t, bid):
+        pass
+
+def random_bids(rng, count, discharge, creator):
+    prices = rng.choice([0.0, 5.0, 7.6, 12.2, 15.8], count)
+    amounts = rng.choice([0.5, 1.0, 2.0, 3.25, rng.uniform(0.1, 10.0)], count)
+    return [Bid(p, a, discharge, creator) for p, a in zip(prices.tolist(), amounts.tolist())]
+
+def copy_bids(bids):
+    return [Bid(b.price_per_kwh, b.amount, b.discharge, b.creator) for b in bids]
+
+def test_matches_clear_vectorized_across_updates():
+    rng = np.random.default_rng(0)
+    creator = Creator()
+    book = OrderBook()
+    sinks = random_bids(rng, 30, False, creator)
+    sources = random_bids(rng, 20, True, creator) + [Bid(15.8, None, True, creator)]
+    for tick in range(200):
+        # Change a few bids, drop or add some, and sometimes add irregular (zero) amounts.
+        for _ in range(3):
+            sinks[rng.integers(len(sinks))] = random_bids(rng, 1, False, creator)[0]
+            sources[rng.integers(len(sources) - 1)] = random_bids(rng, 1, True, creator)[0]
+        if tick % 10 == 5:
+            sinks = sinks[:-2]
+        if tick % 10 == 7:
+            sinks += random_bids(rng, 2, False, creator)
+        if tick % 20 == 9:
+            sinks[0] = Bid(7.6, 0.0, False, creator)
+
+        tick_sinks = copy_bids(sinks)
+        tick_sources = copy_bids(sources)
+        book.begin_tick()
+        for j, b in enumerate(tick_sources):
+            book.update(order_key(0, j), b)
+        for j, b in enumerate(tick_sinks):
+            book.update(order_key(1, j), b)
+        book.end_tick()
+        price = book.clear()
+
+        expected_sinks = copy_bids(sinks)
+        expected_sources = copy_bids(sources)
+        original = {id(b): i for i, b in enumerate(expected_sinks + expected_sources)}
+        expected_price = clear_vectorized(expected_sources, expected_sinks)
+        assert price == pytest.approx(expected_price)
+        results = sorted((original[id(b)], b.amount) for b in expected_sinks + expected_sources)
+        assert [b.amount for b in tick_sinks + tick_sources] == pytest.approx([amount for _, amount in results])
+        assert all(b.price_per_kwh == price for b in tick_sinks + tick_sources)
+
+def test_unchanged_bids_are_not_moved():
+    creator = Creator()
+    book = OrderBook()
+    for tick in range(3):
+        book.begin_tick()
+        book.update(order_key(0, 0), Bid(10.0, None, True, creator))
+        for j in range(100):
+            book.update(order_key(1, j), Bid(10.0, 1.0 + j % 3, False, creator))
+        book.end_tick()
+        book.clear()
+    assert book.changed == 0
+    assert book.sinks.prices == [10.0]
+    assert not book.sinks.level(0).dirty
+
+    book.begin_tick()
+    book.update(order_key(0, 0), Bid(10.0, None, True, creator))
+    for j in range(50):
+        book.update(order_key(1, j), Bid(10.0, 1.0 + j % 3, False, creator))
+    book.end_tick()
+    assert book.changed == 50
+    assert book.sinks.count == 50
+
+def make_market(order_book):
+    random.seed(0)
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1, clearing='vectorized', order_book=order_book)
+    rng = np.random.default_rng(1)
+    mean = weekday_winter.mean()
+    specs = [EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=e, operating_range=(0.2, 0.8))
+             for e in rng.uniform(8.0, 32.0, 20).tolist()]
+    for i, spec in enumerate(specs[:5]):
+        market.add_der(RuleBasedEV(spec, mdr, driving_schedule, (weekday_winter.min() + mean) / 2, (weekday_winter.max() + mean) / 2), f'rbev_{i}')
+    market.add_der(RuleBasedEVFleet(specs[5:], mdr, driving_schedule, 11.0, 12.0), 'fleet')
+    market.add_der(Home(gen_schedule_by_prices_and_mean(weekday_winter, 2.0), 0.1), 'home')
+    market.add_der(HomePopulation(10, gen_schedule_by_prices_and_mean(weekday_winter, 2.0), 0.1, aggregate=False), 'homes')
+    return market
+
+def run_market(market, ticks):
+    results = []
+    for _ in range(ticks):
+        stats = market.run_tick()
+        energies = [market.ders[f'rbev_{i}'].current_energy for i in range(5)] + market.ders['fleet'].current_energy.tolist()
+        results.append((stats, energies))
+    return results
+
+def test_market_matches_per_tick_clearing():
+    plain = run_market(make_market(None), 72)
+    incremental = run_market(make_market(OrderBook()), 72)
+    for (stats, energies), (incremental_stats, incremental_energies) in zip(plain, incremental):
+        assert incremental_stats['price'] == pytest.approx(stats['price'])
+        assert incremental_stats['sources_total'] == stats['sources_total']
+        assert incremental_energies == pytest.approx(energies)
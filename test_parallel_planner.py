@@ -0,0 +1,78 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from market import DoubleAuctionMarketController
+from optimized_ev import OptimizedEV
+from parallel_planner import ParallelPlanner
+from recording_wrapper import RecordingWrapper
+from schedule import solve_dp, solve_heuristic
+from schedule_cache import ScheduleCache
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+@pytest.fixture(scope='module')
+def executor():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+def make_evs(n, solver='pulp', cache=None):
+    rng = np.random.default_rng(0)
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20.0, operating_range=(0.2, 0.8))
+    evs = []
+    for _ in range(n):
+        ev = OptimizedEV(spec, mdr, driving_schedule, weekday_winter * rng.uniform(0.8, 1.2, 24), solver=solver, cache=cache)
+        ev.current_energy = rng.uniform(10.0, 30.0)
+        evs.append(ev)
+    return evs
+
+def test_plan_matches_serial(executor):
+    evs = make_evs(20, solver='dp')
+    expected = [solve_dp(ev.schedule_problem()) for ev in evs]
+    planner = ParallelPlanner(executor, chunksize=4)
+    planner.plan(0, weekday_winter[0], [RecordingWrapper(ev) for ev in evs])
+    assert planner.planned == 20
+    # Nothing to plan after midnight, the count is kept.
+    planner.plan(1, weekday_winter[1], evs)
+    assert planner.planned == 20
+    for ev, schedule in zip(evs, expected):
+        assert ev.schedule_presolved
+        assert np.array_equal(ev.schedule, schedule)
+
+def test_market_midnight_tick(executor):
+    evs = make_evs(4)
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    market.add_planner(ParallelPlanner(executor))
+    for i, ev in enumerate(evs):
+        market.add_der(RecordingWrapper(ev), f'loev_{i}')
+    market.run_tick()
+    assert not any(ev.schedule_presolved for ev in evs)
+    assert all(len(ev.schedule) == 24 for ev in evs)
+
+def test_per_ev_solver_and_cache(executor):
+    cache = ScheduleCache()
+    evs = make_evs(2, solver='dp', cache=cache) + make_evs(1, solver='heuristic')
+    cached = [1.0] * 24
+    cache.store(evs[0].schedule_problem(), 'dp', cached)
+    # Below the operating range, so infeasible.
+    infeasible = make_evs(1, solver='dp')[0]
+    infeasible.current_energy = 0.0
+    planner = ParallelPlanner(executor)
+    planner.plan(0, weekday_winter[0], evs + [infeasible])
+
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert evs[0].schedule == cached
+    assert np.array_equal(evs[1].schedule, solve_dp(evs[1].schedule_problem()))
+    assert np.array_equal(evs[2].schedule, solve_heuristic(evs[2].schedule_problem()))
+    assert planner.fallbacks == 1
+    assert infeasible.fallbacks == 1
+    assert np.array_equal(infeasible.schedule, solve_heuristic(infeasible.schedule_problem()))
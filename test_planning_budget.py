@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from market import DoubleAuctionMarketController
+from optimized_ev import OptimizedEV
+from planning_budget import PlanningBudget
+from recording_wrapper import RecordingWrapper
+from schedule import solve_dp, solve_heuristic
+from schedule_cache import ScheduleCache
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+def make_ev(initial_energy: float, **kwargs) -> OptimizedEV:
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=initial_energy, operating_range=(0.2, 0.8))
+    return OptimizedEV(spec, mdr, driving_schedule, weekday_winter.copy(), **kwargs)
+
+def test_solves_within_budget():
+    evs = [make_ev(10.0 + 3 * i) for i in range(4)]
+    planner = PlanningBudget(budget=60.0, time_limit=10.0)
+    planner.plan(0, weekday_winter[0], [RecordingWrapper(ev) for ev in evs])
+    assert planner.get_stats()['solved'] == 4
+    for ev in evs:
+        assert ev.schedule_presolved
+        problem = ev.schedule_problem()
+        assert problem.cost(ev.schedule) == pytest.approx(problem.cost(solve_dp(problem)), abs=1e-6)
+
+def test_falls_back_when_infeasible_or_over_budget():
+    # Starting below the operating range is infeasible.
+    planner = PlanningBudget(budget=60.0)
+    evs = [make_ev(0.0, solver='dp'), make_ev(20.0, solver='dp')]
+    planner.plan(0, weekday_winter[0], evs)
+    assert (planner.solved, planner.failed) == (1, 1)
+    assert np.array_equal(evs[0].schedule, solve_heuristic(evs[0].schedule_problem()))
+    assert [ev.fallbacks for ev in evs] == [1, 0]
+
+    planner = PlanningBudget(budget=0.0)
+    evs = [make_ev(20.0) for _ in range(3)]
+    planner.plan(0, weekday_winter[0], evs)
+    assert planner.get_stats()['over_budget'] == 3
+    assert planner.get_stats()['fallbacks'] == 3
+    assert all(ev.schedule_presolved for ev in evs)
+
+def test_uses_each_evs_solver_and_cache():
+    cache = ScheduleCache()
+    evs = [make_ev(20.0, solver='dp', cache=cache) for _ in range(3)]
+    planner = PlanningBudget(budget=60.0)
+    planner.plan(0, weekday_winter[0], evs)
+    assert planner.solved == 3
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert all(np.array_equal(ev.schedule, solve_dp(ev.schedule_problem())) for ev in evs)
+
+    # Hits don't need any budget.
+    planner = PlanningBudget(budget=0.0)
+    ev = make_ev(20.0, solver='dp', cache=cache)
+    planner.plan(0, weekday_winter[0], [ev])
+    assert (planner.solved, planner.over_budget) == (1, 0)
+    assert ev.fallbacks == 0
+
+def test_only_plans_at_midnight():
+    planner = PlanningBudget(budget=0.0)
+    planner.plan(5, weekday_winter[5], [make_ev(20.0)])
+    assert planner.get_stats()['over_budget'] == 0
+
+def test_market_day_with_budget():
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    planner = PlanningBudget(budget=0.0)
+    market.add_planner(planner)
+    for i in range(3):
+        market.add_der(RecordingWrapper(make_ev(20.0)), f'loev_{i}')
+    for _ in range(24):
+        market.run_tick()
+    assert planner.over_budget == 3
+
+def test_ev_falls_back_without_a_schedule():
+    ev = make_ev(0.0, solver='dp')
+    ev.make_bid(0, weekday_winter[0])
+    assert ev.fallbacks == 1
+    assert len(ev.schedule) == 24
+
+def test_ev_time_limit():
+    ev = make_ev(20.0, time_limit=10.0)
+    ev.make_bid(0, weekday_winter[0])
+    assert ev.fallbacks == 0
+    with pytest.raises(ValueError):
+        make_ev(20.0, solver='dp', time_limit=10.0)
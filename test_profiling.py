@@ -0,0 +1,97 @@
+import random
+
+import numpy as np
+import pytest
+
+from bid_book import BidBook
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import Home, gen_schedule_by_prices_and_mean
+from market import DoubleAuctionMarketController, PassiveMarketController
+from profiling import TickTracer, der_type
+from recording_wrapper import RecordingWrapper
+from rule_based_ev import RuleBasedEV
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+def make_market(clearing='loop', bid_book=None):
+    random.seed(0)
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1, clearing=clearing, bid_book=bid_book)
+    mean = weekday_winter.mean()
+    for i in range(3):
+        spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=10 + 5 * i, operating_range=(0.2, 0.8))
+        ev = RuleBasedEV(spec, mdr, driving_schedule, (weekday_winter.min() + mean) / 2, (weekday_winter.max() + mean) / 2)
+        market.add_der(RecordingWrapper(ev), f'ev_{i}')
+    market.add_der(Home(gen_schedule_by_prices_and_mean(weekday_winter, 2.0), 0.1), 'home')
+    return market
+
+@pytest.mark.parametrize('clearing, bid_book', [('loop', None), ('vectorized', None), ('loop', BidBook())])
+def test_tracing_doesnt_change_results(clearing, bid_book):
+    plain = make_market(clearing, bid_book)
+    plain_stats = [plain.run_tick() for _ in range(24)]
+
+    tracer = TickTracer()
+    traced_market = make_market(clearing, bid_book and BidBook())
+    with tracer.attach(traced_market):
+        traced_stats = [traced_market.run_tick() for _ in range(24)]
+    assert traced_market.tracer is None
+    assert traced_stats == plain_stats
+
+    report = tracer.report()
+    assert report['ticks'] == 24
+    for phase in ('plan', 'bid', 'post_bid'):
+        assert report['phases'][phase]['calls'] >= 24
+    if any(s['sources_total'] > 0 and s['sinks_total'] > 0 for s in traced_stats):
+        assert 'sort' in report['phases']
+        assert 'match' in report['phases']
+        assert 'notify' in report['phases']
+    assert report['der_types']['RuleBasedEV.post_bid']['calls'] == 3 * 24
+    assert report['der_types']['Home.post_bid']['calls'] == 24
+    assert {name for name, _ in tracer.slowest_ders()} == {'ev_0', 'ev_1', 'ev_2', 'home'}
+
+def test_slow_der_attributed_by_name():
+    class SlowHome(Home):
+        def make_bid(self, t, grid_price):
+            total = 0
+            for i in range(20000):
+                total += i
+            return super().make_bid(t, grid_price)
+
+    market = make_market()
+    market.add_der(SlowHome(gen_schedule_by_prices_and_mean(weekday_winter, 2.0), 0.1), 'slow_home')
+    market.tracer = TickTracer()
+    for _ in range(5):
+        market.run_tick()
+    assert market.tracer.slowest_ders(1)[0][0] == 'slow_home'
+
+def test_passive_market_tracing():
+    class Consumer:
+        def __init__(self):
+            self.results = []
+
+        def make_bid(self, t, grid_price):
+            return Home(gen_schedule_by_prices_and_mean(weekday_winter, 2.0), 0.0).make_bid(t, grid_price)
+
+        def collect_bid_results(self, t, bid):
+            self.results.append(bid.amount)
+
+        def post_bid(self, t):
+            pass
+
+    tracer = TickTracer()
+    market = PassiveMarketController(weekday_winter, 1, tracer=tracer)
+    market.add_der(Consumer())
+    market.run_tick()
+    report = tracer.report()
+    assert report['ticks'] == 1
+    assert set(report['phases']) == {'bid', 'notify', 'post_bid'}
+    assert report['slowest_ders'][0][0] == 0
+
+def test_der_type_unwraps():
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20, operating_range=(0.2, 0.8))
+    assert der_type(RecordingWrapper(RuleBasedEV(spec, mdr, driving_schedule, 8, 14))) == 'RuleBasedEV'
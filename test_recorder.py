@@ -0,0 +1,120 @@
+import random
+
+import numpy as np
+import pytest
+
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import Home, gen_schedule_by_prices_and_mean
+from market import Bid, DoubleAuctionMarketController
+from recorder import ColumnarRecorder, RecordingReader
+from recording_wrapper import RecordingWrapper
+from rule_based_ev import RuleBasedEV
+from rule_based_ev_fleet import RuleBasedEVFleet
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+names = ['grid', 'rbev_0', 'rbev_1', 'home_0']
+
+def make_market(wrap):
+    ev_spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=10.0, operating_range=(0.2, 0.8))
+    market = DoubleAuctionMarketController(wrap(TimeOfUseGrid(weekday_winter), 'grid'), 1)
+    for i in range(2):
+        market.add_der(wrap(RuleBasedEV(ev_spec, mdr, driving_schedule, 10.0, 14.0), f'rbev_{i}'), f'rbev_{i}')
+    home_schedule = gen_schedule_by_prices_and_mean(weekday_winter, 2.0)
+    market.add_der(wrap(Home(home_schedule, 0.1), 'home_0'), 'home_0')
+    return market
+
+def test_recording_matches_wrapper_stats(tmp_path):
+    random.seed(0)
+    market = make_market(lambda der, name: RecordingWrapper(der))
+    expected = []
+    for _ in range(50):
+        stats = market.run_tick()
+        expected.append((stats, {'grid': market.dso.post_bid_stats} | {n: d.post_bid_stats for n, d in market.ders.items()}))
+
+    random.seed(0)
+    recorder = ColumnarRecorder(str(tmp_path), names, chunk_ticks=24)
+    market = make_market(recorder.wrap)
+    for _ in range(50):
+        recorder.end_tick(market.run_tick())
+    recorder.close()
+
+    reader = RecordingReader(str(tmp_path))
+    assert reader.num_ticks == 50
+    assert reader.chunk_sizes == [24, 24, 2]
+    cost = reader.column('cost')
+    energy = reader.column('current_energy')
+    actions = reader.action_names(reader.column('action'))
+    assert reader.column('price').tolist() == [s['price'] for s, _ in expected]
+    for t, (_, der_stats) in enumerate(expected):
+        for i, name in enumerate(names):
+            assert cost[t, i] == der_stats[name]['cost']
+            assert np.isnan(energy[t, i]) == ('current_energy' not in der_stats[name])
+        for i in (1, 2):
+            assert energy[t, i] == der_stats[names[i]]['current_energy']
+            assert actions[t, i] == der_stats[names[i]]['last_action']
+
+def test_column_slices(tmp_path):
+    recorder = ColumnarRecorder(str(tmp_path), ['a', 'b'], chunk_ticks=4)
+    for t in range(10):
+        recorder.set('cost', 0, t)
+        recorder.set('cost', 1, -t)
+        recorder.end_tick({'price': t / 2})
+    recorder.close()
+
+    reader = RecordingReader(str(tmp_path))
+    assert reader.column('cost', 3, 9, names=['b'])[:, 0].tolist() == [-3, -4, -5, -6, -7, -8]
+    assert reader.column('price', 8).tolist() == [4.0, 4.5]
+    assert reader.column('cost', 5, 5).shape == (0, 2)
+
+def test_fleet_members(tmp_path):
+    ev_spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=10.0, operating_range=(0.2, 0.8))
+    recorder = ColumnarRecorder(str(tmp_path), ['rbev_0', 'fleet'], members={'fleet': 3})
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    market.add_der(recorder.wrap(RuleBasedEV(ev_spec, mdr, driving_schedule, 10.0, 14.0), 'rbev_0'), 'rbev_0')
+    fleet = RuleBasedEVFleet([ev_spec] * 3, mdr, driving_schedule, 10.0, 14.0)
+    market.add_der(recorder.wrap(fleet, 'fleet'), 'fleet')
+    for _ in range(24):
+        recorder.end_tick(market.run_tick())
+    recorder.close()
+
+    reader = RecordingReader(str(tmp_path))
+    assert reader.names == ['rbev_0', 'fleet/0', 'fleet/1', 'fleet/2']
+    energy = reader.column('current_energy')
+    assert energy.shape == (24, 4)
+    assert energy[-1, 1:].tolist() == fleet.current_energy.tolist()
+    # The fleet's vehicles behave like the lone RuleBasedEV.
+    assert np.array_equal(energy[:, 0], energy[:, 1])
+    assert (reader.action_names(reader.column('action', names=['fleet/0']))[:, 0] != None).all()
+
+def test_fleet_needs_members(tmp_path):
+    ev_spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=10.0, operating_range=(0.2, 0.8))
+    recorder = ColumnarRecorder(str(tmp_path), ['fleet'])
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    market.add_der(recorder.wrap(RuleBasedEVFleet([ev_spec] * 3, mdr, driving_schedule, 10.0, 14.0), 'fleet'), 'fleet')
+    with pytest.raises(ValueError, match='members'):
+        market.run_tick()
+
+def test_several_bids_add_up(tmp_path):
+    class TwoBids:
+        def make_bid(self, t, grid_price):
+            return [Bid(2.0, 1.0, False, self), Bid(3.0, 2.0, True, self)]
+
+        def collect_bid_results(self, t, bid: Bid):
+            pass
+
+        def post_bid(self, t, price):
+            return {}
+
+    recorder = ColumnarRecorder(str(tmp_path), ['two_bids'])
+    wrapper = recorder.wrap(TwoBids(), 'two_bids')
+    for bid in wrapper.make_bid(0, None):
+        wrapper.collect_bid_results(0, bid)
+    wrapper.post_bid(0, None)
+    assert recorder.current('two_bids')['cost'] == -4.0
+    assert recorder.current('two_bids')['granted_amount'] == 3.0
@@ -61,4 +61,16 @@ def test_no_bid(rw: RecordingWrapper):
     assert rw.post_bid(0, None) == {
         'multiplier': 3.0,
         'cost': 0.0,
-    }
\ No newline at end of file
+    }
+
+def test_several_bids(rw: RecordingWrapper):
+    rw.der.make_bid = lambda t, grid_price: [Bid(2.0, 1.0, False, None), Bid(3.0, 2.0, True, None)]
+    bids = rw.make_bid(0, None)
+    assert all(bid.creator == rw for bid in bids)
+    for bid in bids:
+        rw.collect_bid_results(0, bid)
+    assert rw.post_bid(0, None) == {
+        'multiplier': 3.0,
+        'cost': -4.0,
+        'granted_amount': 3.0,
+    }
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from market import Bid, DoubleAuctionMarketController
+from rule_based_ev import RuleBasedEV
+from rule_based_ev_fleet import RuleBasedEVFleet
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+class Load:
+    def __init__(self, amount):
+        self.amount = amount
+
+    def make_bid(self, t, grid_price):
+        return Bid(grid_price, self.amount, False, self)
+
+    def collect_bid_results(self, t, bid):
+        pass
+
+    def post_bid(self, t, price):
+        return {}
+
+def make_specs(n):
+    rng = np.random.default_rng(0)
+    return [
+        EVSpec(
+            capacity=float(rng.choice([40, 60])),
+            charge_rate_max=float(rng.choice([7, 10])),
+            discharge_rate_max=float(rng.choice([5, 10])),
+            initial_energy=float(rng.uniform(0.0, 40.0)),
+            operating_range=(0.2, 0.8),
+        )
+        for _ in range(n)
+    ]
+
+def test_fleet_matches_individual_evs():
+    n = 30
+    specs = make_specs(n)
+    max_charge_price = np.linspace(7.0, 13.0, n)
+    min_discharge_price = np.linspace(12.0, 16.0, n)
+
+    market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    market.add_der(Load(20.0), 'load_0')
+    evs = []
+    for i in range(n):
+        ev = RuleBasedEV(specs[i], mdr, driving_schedule, max_charge_price[i], min_discharge_price[i])
+        evs.append(ev)
+        market.add_der(ev, f'rbev_{i}')
+    market.add_der(Load(5.0), 'load_1')
+
+    fleet_market = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    fleet_market.add_der(Load(20.0), 'load_0')
+    fleet = RuleBasedEVFleet(specs, mdr, driving_schedule, max_charge_price, min_discharge_price)
+    fleet_market.add_der(fleet, 'rbevs')
+    fleet_market.add_der(Load(5.0), 'load_1')
+
+    for _ in range(72):
+        t = market.t
+        assert market.run_tick() == fleet_market.run_tick()
+        stats = fleet.get_current_stats(t)
+        assert stats['current_energy'].tolist() == [ev.current_energy for ev in evs]
+        assert stats['last_action'].tolist() == [ev.last_action for ev in evs]
+        assert stats['meeting_next_mdr'].tolist() == [ev.get_current_stats(t)['meeting_next_mdr'] for ev in evs]
+
+def test_per_vehicle_schedules():
+    specs = make_specs(2)
+    driving = np.zeros((2, 24))
+    driving[1, 0] = 3.0
+    fleet = RuleBasedEVFleet(specs, mdr, driving, 10.0, 100.0)
+    bids = fleet.make_bid(0, 5.0)
+    assert len(bids) == 1
+    assert fleet.last_action.tolist() == [2, 1]
+    for b in bids:
+        fleet.collect_bid_results(0, b)
+    energy = fleet.current_energy.copy()
+    stats = fleet.post_bid(0, 5.0)
+    assert stats['current_energy'][0] == pytest.approx(energy[0] + bids[0].amount)
+    assert stats['cost'][0] == pytest.approx(bids[0].amount * 5.0)
+    assert stats['granted_amount'][1] == 0.0
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from recorder import RecordingReader
+from scenario import DEFAULT_SCENARIO, build_market, load_scenario, merge, run_scenario, thresholds
+
+def test_merge_is_nested_and_copies():
+    merged = merge(DEFAULT_SCENARIO, {'fleet': {'loev': 0}, 'days': 1})
+    assert merged['fleet'] == {'rbev': 4, 'loev': 0, 'home': 8}
+    assert merged['days'] == 1
+    assert DEFAULT_SCENARIO['fleet']['loev'] == 4
+
+def test_load_scenario(tmp_path):
+    path = tmp_path / 'small.json'
+    path.write_text(json.dumps({'fleet': {'rbev': 2, 'loev': 1, 'home': 3}, 'rbev': {'max_charge_price': 9.0}}))
+    scenario = load_scenario(str(path), {'seed': 5})
+    assert scenario['seed'] == 5
+    assert scenario['fleet']['home'] == 3
+    max_charge_price, min_discharge_price = thresholds(scenario)
+    assert max_charge_price == 9.0
+    assert min_discharge_price == pytest.approx((15.8 + sum(scenario['prices']) / 24) / 2)
+    assert len(build_market(scenario).ders) == 6
+
+def test_example_scenarios_load():
+    directory = os.path.join(os.path.dirname(__file__), 'scenarios')
+    for name in os.listdir(directory):
+        scenario = load_scenario(os.path.join(directory, name))
+        assert set(scenario['fleet']) <= {'rbev', 'loev', 'home'}
+
+def test_run_scenario_is_reproducible():
+    scenario = load_scenario(overrides={'days': 2, 'fleet': {'rbev': 2, 'loev': 1, 'home': 3}})
+    seen = []
+    days = run_scenario(scenario, lambda day_num, day: seen.append(day_num))
+    assert seen == [1, 2]
+    assert len(days[0]['hourly']['market_price']) == 24
+    summary = days[0]['summary']
+    assert summary['home_mean_cost'] is not None
+
+    again = run_scenario(scenario)
+    for day, other in zip(days, again):
+        assert day['hourly'] == other['hourly']
+
+def test_recorded_run_matches(tmp_path):
+    scenario = load_scenario(overrides={'days': 2, 'fleet': {'rbev': 2, 'loev': 1, 'home': 3}})
+    expected = run_scenario(scenario)
+    days = run_scenario(scenario, record=str(tmp_path))
+    for day, other in zip(days, expected):
+        assert day['hourly'] == other['hourly']
+        assert day['mdr_misses'] == other['mdr_misses']
+
+    reader = RecordingReader(str(tmp_path))
+    assert reader.num_ticks == 48
+    assert reader.names == ['grid', 'rbev_0', 'rbev_1', 'loev_0', 'home_0', 'home_1', 'home_2']
+    assert reader.column('price').tolist() == expected[0]['hourly']['market_price'] + expected[1]['hourly']['market_price']
+    assert reader.column('cost', names=['grid'])[:24, 0].tolist() == expected[0]['hourly']['grid_cost']
+
+def test_cli_runs_headless(tmp_path):
+    scenario_path = tmp_path / 'tiny.json'
+    scenario_path.write_text(json.dumps({'days': 1, 'fleet': {'rbev': 1, 'loev': 1, 'home': 1}}))
+    output = tmp_path / 'out.json'
+    figures = tmp_path / 'figures'
+    env = dict(os.environ, MPLBACKEND='')
+    result = subprocess.run(
+        [sys.executable, os.path.dirname(os.path.abspath(__file__)), str(scenario_path), '--jsonl', '--output', str(output), '--figures', str(figures)],
+        capture_output=True, text=True, check=True, env=env,
+    )
+    lines = result.stdout.strip().splitlines()
+    assert json.loads(lines[-1])['day'] == 1
+    assert json.loads(output.read_text())['scenario']['fleet']['loev'] == 1
+    assert os.listdir(figures) == ['day_001.png']
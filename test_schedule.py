@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from schedule import ScheduleMismatchError, ScheduleModel, ScheduleProblem, solve_checked, solve_dp, solve_heuristic, solve_pulp, solve_pulp_optimal
+
+def gen_problem(rng: np.random.Generator) -> ScheduleProblem:
+    capacity = rng.uniform(30, 80)
+    energy_range = (0.2 * capacity, 0.8 * capacity)
+    driving_schedule = np.where(rng.random(24) < 0.2, rng.uniform(0.5, 5.0, 24), 0.0).tolist()
+    mdr = rng.uniform(0.0, 0.6 * capacity, 24).tolist()
+    return ScheduleProblem(
+        history=rng.uniform(5.0, 20.0, 24),
+        mdr=mdr,
+        driving_schedule=driving_schedule,
+        current_energy=rng.uniform(*energy_range),
+        energy_range=energy_range,
+    )
+
+def energies(problem: ScheduleProblem, schedule) -> np.ndarray:
+    return problem.current_energy + np.cumsum(np.array(schedule) - np.array(problem.driving_schedule))
+
+def test_dp_matches_cbc_on_random_problems():
+    rng = np.random.default_rng(0)
+    feasible = 0
+    for _ in range(100):
+        problem = gen_problem(rng)
+        # Raises if DP and CBC disagree on feasibility or cost.
+        schedule = solve_checked(problem)
+        if schedule is None:
+            continue
+        feasible += 1
+        e = energies(problem, schedule)
+        assert (e >= np.maximum(problem.mdr, problem.energy_range[0]) - 1e-9).all()
+        assert (e <= problem.energy_range[1] + 1e-9).all()
+        assert (np.abs(schedule) <= 10 + 1e-9).all()
+        assert (schedule[np.array(problem.driving_schedule) != 0.0] == 0.0).all()
+    assert feasible > 20
+
+def test_dp_infeasible_start():
+    problem = ScheduleProblem(
+        history=np.full(24, 10.0),
+        mdr=[0.0] * 24,
+        driving_schedule=[0.0] * 24,
+        current_energy=0.0,
+        energy_range=(8.0, 32.0),
+    )
+    assert solve_dp(problem) is None
+
+def test_dp_charges_cheapest_hours():
+    history = np.full(24, 20.0)
+    history[3] = 5.0
+    problem = ScheduleProblem(
+        history=history,
+        mdr=[0.0] * 23 + [30.0],
+        driving_schedule=[0.0] * 24,
+        current_energy=20.0,
+        energy_range=(8.0, 32.0),
+    )
+    schedule = solve_dp(problem)
+    assert schedule[3] == pytest.approx(10.0)
+    assert problem.cost(schedule) == pytest.approx(problem.cost(solve_pulp(problem)))
+
+def test_checked_raises_on_mismatch(monkeypatch):
+    import schedule
+    problem = gen_problem(np.random.default_rng(1))
+    monkeypatch.setattr(schedule, 'solve_dp', lambda p: np.zeros(24))
+    with pytest.raises(ScheduleMismatchError):
+        schedule.solve_checked(problem)
+
+def test_heuristic_is_feasible_when_the_problem_is():
+    rng = np.random.default_rng(2)
+    feasible = 0
+    for _ in range(100):
+        problem = gen_problem(rng)
+        best = solve_dp(problem)
+        schedule = solve_heuristic(problem)
+        if best is None:
+            continue
+        feasible += 1
+        e = energies(problem, schedule)
+        assert (e >= np.maximum(problem.mdr, problem.energy_range[0]) - 1e-9).all()
+        assert (e <= problem.energy_range[1] + 1e-9).all()
+        assert (np.abs(schedule) <= 10 + 1e-9).all()
+        assert (schedule[np.array(problem.driving_schedule) != 0.0] == 0.0).all()
+        assert problem.cost(schedule) >= problem.cost(best) - 1e-6
+    assert feasible > 20
+
+def test_pulp_optimal_rejects_infeasible():
+    problem = ScheduleProblem(
+        history=np.full(24, 10.0),
+        mdr=[0.0] * 24,
+        driving_schedule=[0.0] * 24,
+        current_energy=0.0,
+        energy_range=(8.0, 32.0),
+    )
+    # CBC still reports values for infeasible problems, only solve_pulp_optimal rejects them.
+    assert solve_pulp(problem) is not None
+    assert solve_pulp_optimal(problem) is None
+    assert len(solve_heuristic(problem)) == 24
+
+def test_model_is_reused_across_days():
+    rng = np.random.default_rng(3)
+    base = gen_problem(rng)
+    model = ScheduleModel(require_optimal=False)
+    for _ in range(5):
+        problem = ScheduleProblem(
+            history=rng.uniform(5.0, 20.0, 24),
+            mdr=base.mdr,
+            driving_schedule=base.driving_schedule,
+            current_energy=rng.uniform(*base.energy_range),
+            energy_range=base.energy_range,
+        )
+        schedule = model(problem)
+        expected = solve_pulp(problem)
+        assert (schedule is None) == (expected is None)
+        if schedule is not None:
+            assert problem.cost(schedule) == pytest.approx(problem.cost(expected), abs=1e-6)
+    assert model.builds == 1
+
+    # A different driving schedule needs a new model.
+    other = gen_problem(rng)
+    model(other)
+    assert model.builds == 2
+
+def test_optimal_model_rejects_infeasible():
+    problem = ScheduleProblem(
+        history=np.full(24, 10.0),
+        mdr=[0.0] * 24,
+        driving_schedule=[0.0] * 24,
+        current_energy=0.0,
+        energy_range=(8.0, 32.0),
+    )
+    assert ScheduleModel(require_optimal=False)(problem) is not None
+    assert ScheduleModel()(problem) is None
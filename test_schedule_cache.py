@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from ev import EVSpec
+from optimized_ev import OptimizedEV
+from schedule import ScheduleProblem, solve_dp
+from schedule_cache import ScheduleCache
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+def problem(current_energy=20.0, history=weekday_winter) -> ScheduleProblem:
+    return ScheduleProblem(
+        history=history,
+        mdr=mdr,
+        driving_schedule=driving_schedule,
+        current_energy=current_energy,
+        energy_range=(8.0, 32.0),
+    )
+
+class CountingSolver:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, problem):
+        self.calls += 1
+        return solve_dp(problem)
+
+def test_identical_problems_solve_once():
+    cache = ScheduleCache()
+    solver = CountingSolver()
+    schedules = [cache.solve(problem(), solver, 'counting') for _ in range(5)]
+    assert solver.calls == 1
+    assert all(s == schedules[0] for s in schedules)
+    assert cache.get_stats() == {'hits': 4, 'misses': 1, 'evictions': 0, 'entries': 1}
+
+def test_exact_keys_without_tolerance():
+    cache = ScheduleCache()
+    solver = CountingSolver()
+    cache.solve(problem(20.0), solver, 'counting')
+    cache.solve(problem(20.01), solver, 'counting')
+    assert solver.calls == 2
+
+def test_quantized_keys():
+    cache = ScheduleCache(history_tolerance=0.1, energy_tolerance=0.5)
+    solver = CountingSolver()
+    cache.solve(problem(20.0), solver, 'counting')
+    cache.solve(problem(20.1, weekday_winter + 0.01), solver, 'counting')
+    assert solver.calls == 1
+    assert cache.hits == 1
+
+def test_lru_eviction():
+    cache = ScheduleCache(max_entries=2)
+    solver = CountingSolver()
+    cache.solve(problem(10.0), solver, 'counting')
+    cache.solve(problem(12.0), solver, 'counting')
+    cache.solve(problem(10.0), solver, 'counting') # Refreshes 10.0
+    cache.solve(problem(14.0), solver, 'counting') # Evicts 12.0
+    assert cache.evictions == 1
+    cache.solve(problem(10.0), solver, 'counting')
+    assert solver.calls == 3
+    cache.solve(problem(12.0), solver, 'counting')
+    assert solver.calls == 4
+
+def test_shared_between_evs():
+    cache = ScheduleCache()
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20.0, operating_range=(0.2, 0.8))
+    evs = [OptimizedEV(spec, mdr, driving_schedule, weekday_winter.copy(), solver='dp', cache=cache) for _ in range(10)]
+    for ev in evs:
+        ev.make_bid(0, weekday_winter[0])
+    assert cache.misses == 1
+    assert cache.hits == 9
+    assert evs[-1].schedule == pytest.approx(solve_dp(evs[0].schedule_problem()))
+
+def test_keyed_on_solver_name():
+    cache = ScheduleCache()
+    spec = EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=20.0, operating_range=(0.2, 0.8))
+    evs = [OptimizedEV(spec, mdr, driving_schedule, weekday_winter.copy(), solver='pulp', cache=cache, time_limit=10.0),
+           OptimizedEV(spec, mdr, driving_schedule, weekday_winter.copy(), solver='dp', cache=cache),
+           OptimizedEV(spec, mdr, driving_schedule, weekday_winter.copy(), solver='pulp_optimal', cache=cache)]
+    for ev in evs:
+        ev.make_bid(0, weekday_winter[0])
+    assert cache.misses == 2
+    assert cache.hits == 1
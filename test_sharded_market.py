@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from bid_book import BidBook
+from ev import EVSpec
+from grid import TimeOfUseGrid
+from home import HomePopulation, gen_schedule_by_prices_and_mean
+from market import Bid, DoubleAuctionMarketController
+from recording_wrapper import RecordingWrapper
+from rule_based_ev import RuleBasedEV
+from rule_based_ev_fleet import RuleBasedEVFleet
+from sharded_market import ShardedMarketController
+
+weekday_winter = np.array([7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 7.6, 15.8, 15.8, 15.8, 15.8, 12.2,
+                           12.2, 12.2, 12.2, 12.2, 12.2, 15.8, 15.8, 7.6, 7.6, 7.6, 7.6, 7.6])
+driving_schedule = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0,
+                    4.0, 0.0, 0.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+mdr = [6.0, 6.0, 6.0, 6.0, 6.0, 6.0, 15.0, 20.0, 20.0, 15.0, 15.0, 15.0,
+       15.0, 15.0, 15.0, 15.0, 15.0, 20.0, 15.0, 15.0, 15.0, 10.0, 10.0, 10.0]
+
+def make_ders():
+    rng = np.random.default_rng(0)
+    specs = [EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=e, operating_range=(0.2, 0.8))
+             for e in rng.uniform(8.0, 32.0, 12).tolist()]
+    ders = {}
+    for i, spec in enumerate(specs[:6]):
+        ders[f'rbev_{i}'] = RecordingWrapper(RuleBasedEV(spec, mdr, driving_schedule, 9.0 + i % 3, 13.0))
+    ders['fleet'] = RuleBasedEVFleet(specs[6:], mdr, driving_schedule, 10.0, 12.0)
+    ders['homes'] = HomePopulation(5, gen_schedule_by_prices_and_mean(weekday_winter, 2.0), 0.2, seed=3, aggregate=False)
+    return ders
+
+def test_matches_single_process_market():
+    plain = DoubleAuctionMarketController(RecordingWrapper(TimeOfUseGrid(weekday_winter)), 1, clearing='vectorized', bid_book=BidBook())
+    for name, der in make_ders().items():
+        plain.add_der(der, name)
+
+    dso = RecordingWrapper(TimeOfUseGrid(weekday_winter))
+    with ShardedMarketController(dso, 1, workers=3) as sharded:
+        for name, der in make_ders().items():
+            sharded.add_der(der, name)
+        sharded.start()
+        assert len(sharded.processes) == 3
+        for _ in range(48):
+            expected = plain.run_tick()
+            stats = sharded.run_tick()
+            assert stats['price'] == pytest.approx(expected['price'])
+            assert stats['sources_total'] == expected['sources_total']
+            assert stats['sinks_total'] == expected['sinks_total']
+            assert dso.post_bid_stats['granted_amount'] == pytest.approx(plain.dso.post_bid_stats['granted_amount'])
+
+        for i in range(6):
+            assert sharded.get_attribute(f'rbev_{i}', 'post_bid_stats') == plain.ders[f'rbev_{i}'].post_bid_stats
+        np.testing.assert_allclose(sharded.get_attribute('fleet', 'current_energy'), plain.ders['fleet'].current_energy)
+
+def test_wrapped_fleet_gets_a_row_per_vehicle():
+    specs = [EVSpec(capacity=40, charge_rate_max=10, discharge_rate_max=10, initial_energy=e, operating_range=(0.2, 0.8))
+             for e in (10.0, 20.0, 30.0)]
+    plain = DoubleAuctionMarketController(TimeOfUseGrid(weekday_winter), 1)
+    plain.add_der(RuleBasedEVFleet(specs, mdr, driving_schedule, 10.0, 12.0), 'fleet')
+    with ShardedMarketController(TimeOfUseGrid(weekday_winter), 1, workers=1) as sharded:
+        sharded.add_der(RecordingWrapper(RuleBasedEVFleet(specs, mdr, driving_schedule, 10.0, 12.0)), 'fleet')
+        for _ in range(24):
+            assert sharded.run_tick()['price'] == pytest.approx(plain.run_tick()['price'])
+
+class TooManyBids:
+    def make_bid(self, t, grid_price):
+        return [Bid(1.0, 1.0, False, self), Bid(1.0, 1.0, False, self)]
+
+    def collect_bid_results(self, t, bid):
+        pass
+
+    def post_bid(self, t, price):
+        return {}
+
+def test_worker_errors_are_raised():
+    with ShardedMarketController(TimeOfUseGrid(weekday_winter), 1, workers=1) as market:
+        market.add_der(TooManyBids(), 'bad')
+        with pytest.raises(RuntimeError, match='2 bids but has 1 rows'):
+            market.run_tick()
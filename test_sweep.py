@@ -0,0 +1,52 @@
+import csv
+import io
+
+from scenario import load_scenario
+from sweep import expand_grid, main, nested, parse_grid_arg, run_seeds, run_sweep, write_csv
+
+def small_scenario():
+    return load_scenario(overrides={'days': 1, 'fleet': {'rbev': 2, 'loev': 0, 'home': 2}})
+
+def test_expand_grid():
+    points = expand_grid({'a.b': [1, 2], 'c': ['x', 'y', 'z']})
+    assert len(points) == 6
+    assert points[0] == {'a.b': 1, 'c': 'x'}
+    assert points[-1] == {'a.b': 2, 'c': 'z'}
+    assert expand_grid({}) == [{}]
+    assert nested('a.b.c', 1) == {'a': {'b': {'c': 1}}}
+
+def test_run_seeds_are_deterministic_and_distinct():
+    assert run_seeds(0, 4) == run_seeds(0, 4)
+    assert len(set(run_seeds(0, 4))) == 4
+    assert run_seeds(0, 2) == run_seeds(0, 4)[:2]
+
+def test_parse_grid_arg():
+    assert parse_grid_arg('rbev.max_charge_price=8,10.5') == ('rbev.max_charge_price', [8, 10.5])
+    assert parse_grid_arg('clearing=loop,vectorized') == ('clearing', ['loop', 'vectorized'])
+    assert parse_grid_arg('fleet={"rbev": 1};{"rbev": 2}') == ('fleet', [{'rbev': 1}, {'rbev': 2}])
+
+def test_run_sweep_is_independent_of_workers():
+    grid = {'rbev.max_charge_price': [8.0, 12.0], 'home.randomness': [0.0, 0.3]}
+    rows = run_sweep(small_scenario(), grid, repeats=2, max_workers=2)
+    assert len(rows) == 8
+    assert [row['run'] for row in rows] == list(range(8))
+    assert rows[0]['rbev.max_charge_price'] == 8.0
+    assert rows[0]['seed'] != rows[1]['seed']
+
+    single = run_sweep(small_scenario(), grid, repeats=2, max_workers=1)
+    for row, other in zip(rows, single):
+        assert {k: v for k, v in row.items() if k != 'seconds'} == {k: v for k, v in other.items() if k != 'seconds'}
+
+def test_write_csv():
+    f = io.StringIO()
+    write_csv([{'run': 0, 'a': 1}, {'run': 1, 'a': 2, 'b': 3}], f)
+    rows = list(csv.DictReader(io.StringIO(f.getvalue())))
+    assert rows[1] == {'run': '1', 'a': '2', 'b': '3'}
+
+def test_main_writes_csv(tmp_path):
+    output = tmp_path / 'sweep.csv'
+    main(['--days', '1', '--grid', 'fleet={"rbev": 1, "loev": 0, "home": 1};{"rbev": 2, "loev": 0, "home": 1}',
+          '--workers', '2', '--output', str(output)])
+    rows = list(csv.DictReader(output.open()))
+    assert len(rows) == 2
+    assert float(rows[0]['mean_market_price']) > 0